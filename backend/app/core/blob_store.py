@@ -0,0 +1,196 @@
+"""
+==============================================================================
+FILE: app/core/blob_store.py
+DESCRIPTION: Innehållsadresserad lagring av bilder (och andra blobbar) på
+             disk bredvid databasen: logs/blobs/ab/<sha256>. Samma bild
+             sparas bara en gång. history.image innehåller bara referensen
+             "blob:sha256:<hash>", själva bilden läses först när en modell
+             behöver den (load_blob). En miniatyr (JPEG, THUMB_SIZE px) görs
+             direkt när bilden tas emot, så förhandsvisningar slipper
+             avkoda hela bilden.
+==============================================================================
+"""
+import os
+import time
+import base64
+import hashlib
+import tempfile
+import threading
+import app.core.database as database
+from app.core.database import get_db_connection
+
+PREFIX = "blob:sha256:"
+THUMB_SIZE = 256
+THUMB_QUALITY = 80
+
+_schema_lock = threading.Lock()
+_schema_path = None
+
+
+def _ensure_schema():
+    global _schema_path
+    with _schema_lock:
+        if _schema_path == database.DB_PATH: return
+        with get_db_connection() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY, size INTEGER, mime TEXT, width INTEGER, height INTEGER,
+                thumb INTEGER DEFAULT 0, created_at REAL)''')
+            conn.commit()
+        _schema_path = database.DB_PATH
+
+
+def blob_dir():
+    return os.path.join(os.path.dirname(database.DB_PATH), "blobs")
+
+
+def is_ref(value):
+    return isinstance(value, str) and value.startswith(PREFIX)
+
+
+def _hash_of(ref):
+    digest = ref[len(PREFIX):] if is_ref(ref) else ref
+    if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        raise ValueError(f"Ogiltig blob-referens: {ref}")
+    return digest
+
+
+def blob_path(ref):
+    digest = _hash_of(ref)
+    return os.path.join(blob_dir(), digest[:2], digest)
+
+
+def thumb_path(ref):
+    digest = _hash_of(ref)
+    return os.path.join(blob_dir(), "thumbs", digest[:2], f"{digest}.jpg")
+
+
+def sniff_mime(data):
+    if data[:3] == b"\xff\xd8\xff": return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n": return "image/png"
+    if data[:6] in (b"GIF87a", b"GIF89a"): return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP": return "image/webp"
+    return "application/octet-stream"
+
+
+def decode_inline(value):
+    """base64 eller data-URL ("data:image/png;base64,...") -> bytes. ValueError om det inte är base64."""
+    if isinstance(value, (bytes, bytearray)): return bytes(value)
+    return base64.b64decode("".join(value.split(",", 1)[-1].split()), validate=True)
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
+
+
+def _make_thumbnail(data, path):
+    """Miniatyr med OpenCV (laddas först här). Returnerar (bredd, höjd) för originalet eller None."""
+    try:
+        import cv2
+        import numpy as np
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if img is None: return None
+        h, w = img.shape[:2]
+        scale = THUMB_SIZE / max(h, w)
+        if scale < 1:
+            img = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, THUMB_QUALITY])
+        if not ok: return None
+        _write_atomic(path, buf.tobytes())
+        return w, h
+    except Exception as e:
+        print(f"[BLOB] Ingen miniatyr: {e}")
+        return None
+
+
+def put_blob(data, mime=None, thumbnail=True):
+    """Sparar data (bytes, base64 eller data-URL) och returnerar referensen. Finns den redan skrivs inget."""
+    if is_ref(data): return data
+    data = decode_inline(data)
+    if not data: raise ValueError("Tom blob")
+    digest = hashlib.sha256(data).hexdigest()
+    ref = PREFIX + digest
+    _ensure_schema()
+    path = blob_path(ref)
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    mime = mime or sniff_mime(data)
+    with get_db_connection() as conn:
+        if conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone():
+            return ref
+    size = _make_thumbnail(data, thumb_path(ref)) if thumbnail and mime.startswith("image/") else None
+    with get_db_connection() as conn:
+        conn.execute("INSERT OR IGNORE INTO blobs (hash, size, mime, width, height, thumb, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     (digest, len(data), mime, size[0] if size else None, size[1] if size else None, 1 if size else 0, time.time()))
+        conn.commit()
+    return ref
+
+
+def load_blob(ref):
+    """Hela bloben (bytes). Bytes och inline-base64 (äldre rader) skickas igenom."""
+    if not is_ref(ref): return decode_inline(ref)
+    with open(blob_path(ref), "rb") as f:
+        return f.read()
+
+
+def load_thumbnail(ref):
+    try:
+        with open(thumb_path(ref), "rb") as f:
+            return f.read()
+    except (OSError, ValueError):
+        return None
+
+
+def load_image(value):
+    """(bytes, mime) för en modell. value: referens, bytes eller base64."""
+    data = load_blob(value)
+    return data, sniff_mime(data)
+
+
+def blob_info(ref):
+    _ensure_schema()
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT * FROM blobs WHERE hash = ?", (_hash_of(ref),)).fetchone()
+    return dict(row) if row else None
+
+
+# --- MIGRERING ---
+
+def migrate_inline_images(batch=200):
+    """
+    Flyttar bilder som ligger inline i history.image (base64) till blobbar.
+    Körs vid uppvärmningen, ett partiellt index gör det billigt när inget återstår.
+    """
+    with get_db_connection() as conn:
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_history_inline_image ON history (id) "
+                     "WHERE image IS NOT NULL AND image NOT LIKE 'blob:%'")
+        conn.commit()
+    moved, last_id = 0, 0
+    while True:
+        with get_db_connection() as conn:
+            rows = conn.execute("SELECT id, image FROM history WHERE image IS NOT NULL AND image NOT LIKE 'blob:%' "
+                                "AND id > ? ORDER BY id LIMIT ?", (last_id, batch)).fetchall()
+        if not rows: break
+        updates = []
+        for row in rows:
+            try: updates.append((put_blob(row["image"]), row["id"]))
+            except Exception as e: print(f"[BLOB] Rad {row['id']} kunde inte flyttas: {e}")
+        with get_db_connection() as conn:
+            conn.executemany("UPDATE history SET image = ? WHERE id = ?", updates)
+            conn.commit()
+        moved += len(updates)
+        last_id = rows[-1]["id"]
+    if moved:
+        with get_db_connection() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                conn.executescript("PRAGMA incremental_vacuum;")
+        print(f"[BLOB] Flyttade {moved} bilder från history till blob-lagret.")
+    return moved
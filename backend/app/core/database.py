@@ -1,12 +1,17 @@
 import sqlite3
 import os
-from config.settings import DB_PATH
+import json
+import hashlib
+from config.settings import DB_PATH, SYSTEM_KEYS, invalidate_config
+from app.utils.metrics import timed, inc
 
 DEFAULT_SETTINGS = [
     "GOOGLE_API_KEY", "OPENAI_API_KEY", "ELEVENLABS_API_KEY",
     "GARMIN_EMAIL", "GARMIN_PASSWORD", "STRAVA_CLIENT_ID",
     "LATITUDE", "LONGITUDE", "HA_BASE_URL", "HA_TOKEN",
-    "OLLAMA_URL", "MQTT_BROKER_IP"
+    "OLLAMA_URL", "MQTT_BROKER_IP", "HA_CONTEXT_ENTITIES", "GATEWAY_API_KEY",
+    "GCAL_CALENDAR_ID", "VISION_ENABLED", "VISION_LIGHT_ENTITY", "VISION_VACUUM_ENTITY",
+    "HISTORY_RETENTION_DAYS"
 ]
 
 # HÄR ÄR ALLA TEXTER SAMLADE.
@@ -30,7 +35,9 @@ TILLGÄNGLIGA VERKTYG (Används automatiskt):
 1. tool_get_weather: Hämtar väderprognos.
 2. tool_analyze_health_data: Bekräftar att du läst hälsodatan i kontexten.
 3. tool_control_light / vacuum: Styr hemmet.
-4. tool_analyze_code: Analyserar källkoden.
+4. tool_control_entities: Styr flera enheter eller hela områden i ett anrop (använd hellre denna än många enskilda anrop).
+5. tool_analyze_code: Analyserar källkoden.
+6. get_calendar_events / get_calendar_agenda: Kalendern (kommande, idag, imorgon, veckan).
 
 VIKTIGT OM TRÄNINGSDATA:
 Du har INTE tillgång till en "analyze_workout"-funktion. 
@@ -58,22 +65,62 @@ Strukturera svaret:
 
     # 3. Verktygsbeskrivning (För LLM-logiken)
     "TOOL_DESC_AUDIT": """Analyserar projektets källkod för att hitta fel och förbättringar.
-Används när användaren ber om 'analysera koden', 'självanalys' eller 'systemanalys'."""
+Används när användaren ber om 'analysera koden', 'självanalys' eller 'systemanalys'.""",
+
+    # 4. Sammanfattning av gamla samtal (history_archive.py)
+    "HISTORY_SUMMARY_PROMPT": """Du sammanfattar ett äldre samtal mellan Anders och assistenten DAA som ska arkiveras.
+Skriv på svenska, högst 5 meningar. Ta med beslut, fakta om Anders, utförda åtgärder och sådant som kan behövas senare.
+Hoppa över hälsningsfraser och småprat."""
 }
 
+class VersionConflict(Exception):
+    """If-Match stämmer inte, någon annan har sparat sedan värdena lästes."""
+    def __init__(self, etag):
+        super().__init__(f"Versionen har ändrats ({etag})")
+        self.etag = etag
+
+def content_etag(values):
+    """ETag för en tabells innehåll (key -> value). Samma innehåll ger samma tagg."""
+    digest = hashlib.sha256(json.dumps(values, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+    return f'"{digest[:16]}"'
+
+def _save_bulk(table, values, expected_etag=None):
+    """
+    Alla nycklar i en transaktion. expected_etag (If-Match) kontrolleras mot
+    innehållet i samma transaktion, VersionConflict om det inte stämmer.
+    Returnerar (ny etag, ändrade nycklar).
+    """
+    with get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        current = {r["key"]: r["value"] for r in conn.execute(f"SELECT key, value FROM {table}")}
+        if expected_etag is not None and expected_etag != content_etag(current):
+            conn.rollback()
+            raise VersionConflict(content_etag(current))
+        changed = {k: str(v) for k, v in values.items() if current.get(k) != str(v)}
+        if changed:
+            conn.executemany(f"INSERT OR REPLACE INTO {table} (key, value) VALUES (?, ?)", list(changed.items()))
+            current.update(changed)
+        conn.commit()
+    return content_etag(current), sorted(changed)
+
 def get_db_connection():
     conn = sqlite3.connect(DB_PATH, timeout=10.0, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     return conn
 
+@timed("db")
 def init_db():
     try:
         os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
         with get_db_connection() as conn:
             c = conn.cursor()
+            # Nya databaser frigör utrymme stegvis (history_archive kör incremental_vacuum)
+            c.execute("PRAGMA auto_vacuum = INCREMENTAL")
             c.execute('''CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, role TEXT, content TEXT, image TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
             c.execute('''CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)''')
             c.execute('''CREATE TABLE IF NOT EXISTS prompts (key TEXT PRIMARY KEY, value TEXT)''')
+            # Senaste sekvensnummer som message_writer skrivit, i samma transaktion som raderna (se get_history)
+            c.execute('''CREATE TABLE IF NOT EXISTS message_writer (writer TEXT PRIMARY KEY, seq INTEGER)''')
             
             for key in DEFAULT_SETTINGS:
                 c.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", (key, ""))
@@ -82,51 +129,133 @@ def init_db():
                 c.execute("INSERT OR IGNORE INTO prompts (key, value) VALUES (?, ?)", (key, val))
                 
             conn.commit()
-    except Exception as e: print(f"❌ Databasfel: {e}")
+        invalidate_config()
+        invalidate_prompts()
+    except Exception as e:
+        inc("db_errors_total", op="init_db")
+        print(f"❌ Databasfel: {e}")
 
+@timed("db")
 def get_db_settings():
     try:
         with get_db_connection() as conn:
             c = conn.cursor()
             c.execute("SELECT key, value FROM settings")
             return {row["key"]: row["value"] for row in c.fetchall()}
-    except: return {}
+    except: inc("db_errors_total", op="get_db_settings"); return {}
 
+@timed("db")
 def save_db_setting(key, value):
     try:
         with get_db_connection() as conn:
             conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
             conn.commit()
+        invalidate_config()
         return True
-    except: return False
+    except: inc("db_errors_total", op="save_db_setting"); return False
+
+def get_settings_etag():
+    return content_etag(get_db_settings())
+
+@timed("db")
+def save_db_settings(values, expected_etag=None):
+    """Flera inställningar på en gång (inställningsdialogen). (etag, ändrade nycklar), None vid DB-fel."""
+    values = {k: v for k, v in values.items() if k not in SYSTEM_KEYS}
+    try: etag, changed = _save_bulk("settings", values, expected_etag)
+    except VersionConflict: raise
+    except: inc("db_errors_total", op="save_db_settings"); return None
+    if changed: invalidate_config()
+    return etag, changed
+
+# Prompterna läses vid varje chattur (system-prompten). Cachen töms när de sparas.
+_prompt_cache = {"prompts": None, "path": None}
+
+def invalidate_prompts():
+    _prompt_cache["prompts"] = None
 
+@timed("db")
 def get_db_prompts():
+    if _prompt_cache["prompts"] is not None and _prompt_cache["path"] == DB_PATH:
+        return dict(_prompt_cache["prompts"])
     try:
         with get_db_connection() as conn:
             c = conn.cursor()
             c.execute("SELECT key, value FROM prompts")
-            return {row["key"]: row["value"] for row in c.fetchall()}
-    except: return {}
+            prompts = {row["key"]: row["value"] for row in c.fetchall()}
+        _prompt_cache.update(prompts=prompts, path=DB_PATH)
+        return dict(prompts)
+    except: inc("db_errors_total", op="get_db_prompts"); return {}
+
+def get_prompts_etag():
+    return content_etag(get_db_prompts())
 
+@timed("db")
+def save_db_prompts(values, expected_etag=None):
+    """Som save_db_settings fast för prompterna."""
+    try: etag, changed = _save_bulk("prompts", values, expected_etag)
+    except VersionConflict: raise
+    except: inc("db_errors_total", op="save_db_prompts"); return None
+    if changed: invalidate_prompts()
+    return etag, changed
+
+@timed("db")
 def save_db_prompt(key, value):
     try:
         with get_db_connection() as conn:
             conn.execute("INSERT OR REPLACE INTO prompts (key, value) VALUES (?, ?)", (key, str(value)))
             conn.commit()
+        invalidate_prompts()
         return True
-    except: return False
+    except: inc("db_errors_total", op="save_db_prompt"); return False
 
+@timed("db")
 def save_message(session_id, role, content, image=None):
+    """image: bytes, base64 eller blob-referens. Sparas i blob_store, raden får bara referensen."""
     try:
+        if image is not None:
+            from app.core.blob_store import put_blob
+            image = put_blob(image)
         with get_db_connection() as conn:
             conn.execute("INSERT INTO history (session_id, role, content, image) VALUES (?, ?, ?, ?)", (session_id, role, content, image))
             conn.commit()
-    except: pass
+    except: inc("db_errors_total", op="save_message")
+
+@timed("db")
+def save_messages(rows, writer=None, seq=None):
+    """
+    Flera meddelanden (session_id, role, content, image) i en transaktion. Kastar vid fel.
+    message_writer skickar med sitt id och batchens sista sekvensnummer, som sparas i samma transaktion.
+    """
+    from app.core.blob_store import put_blob
+    rows = [(s, r, c, put_blob(i) if i is not None else None) for s, r, c, i in rows]
+    try:
+        with get_db_connection() as conn:
+            conn.executemany("INSERT INTO history (session_id, role, content, image) VALUES (?, ?, ?, ?)", rows)
+            if writer is not None:
+                # En rad per process räcker, tidigare processers rader behövs inte
+                conn.execute("DELETE FROM message_writer WHERE writer != ?", (writer,))
+                conn.execute("INSERT OR REPLACE INTO message_writer (writer, seq) VALUES (?, ?)", (writer, seq))
+            conn.commit()
+    except: inc("db_errors_total", op="save_messages"); raise
 
+@timed("db")
 def get_history(session_id=None, limit=600):
+    """Senaste meddelandena, inklusive de som message_writer ännu inte hunnit skriva."""
+    from app.core.message_writer import get_message_writer
+    writer = get_message_writer()
     try:
+        # Kön läses före databasen: det som hinner skrivas emellan sorteras bort
+        # med sekvensnumret, som läses i samma transaktion som raderna.
+        pending = writer.snapshot()
         with get_db_connection() as conn:
             c = conn.cursor()
-            c.execute(f"SELECT * FROM history ORDER BY id DESC LIMIT ?", (limit,))
-            return [{"role": r["role"], "content": r["content"], "image": r["image"]} for r in reversed(c.fetchall())]
-    except: return []
\ No newline at end of file
+            c.execute("BEGIN")
+            # image är en blob-referens, bilden läses först när en modell behöver den
+            c.execute("SELECT role, content, image FROM history ORDER BY id DESC LIMIT ?", (limit,))
+            rows = [{"role": r["role"], "content": r["content"], "image": r["image"]} for r in reversed(c.fetchall())]
+            written = c.execute("SELECT seq FROM message_writer WHERE writer = ?", (writer.id,)).fetchone()
+            conn.rollback()
+        written = written[0] if written else 0
+        pending = [{"role": r, "content": t, "image": i} for seq, r, t, i in pending if seq > written]
+        return (rows + pending)[-limit:] if pending else rows
+    except: inc("db_errors_total", op="get_history"); return []
\ No newline at end of file
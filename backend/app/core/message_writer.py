@@ -0,0 +1,127 @@
+"""
+==============================================================================
+FILE: app/core/message_writer.py
+DESCRIPTION: Write-behind för chatthistoriken. enqueue() lägger meddelandet
+             i minnet och returnerar direkt, en egen tråd skriver det som
+             samlats (högst BATCH_ROWS rader, efter FLUSH_INTERVAL s) i en
+             transaktion via save_messages. Användarens första token väntar
+             alltså aldrig på en commit/fsync.
+
+             get_history (database.py) slår ihop databasen med det som ännu
+             inte skrivits (pending), så en fråga ser alltid sina egna
+             meddelanden. Varje batch sparar sitt sista sekvensnummer i
+             tabellen message_writer i samma transaktion som raderna, så
+             get_history vet exakt vilka köade rader databasen redan har.
+             close() tömmer kön vid shutdown (lifespan).
+==============================================================================
+"""
+import time
+import uuid
+import threading
+from app.utils.metrics import inc
+
+FLUSH_INTERVAL = 0.005   # s att vänta in fler rader innan en batch skrivs
+BATCH_ROWS = 200
+RETRY_DELAY = 0.5        # s innan en misslyckad batch provas igen
+MAX_RETRIES = 3
+
+
+class MessageWriter:
+    def __init__(self, flush_interval=FLUSH_INTERVAL, batch_rows=BATCH_ROWS):
+        self.flush_interval = flush_interval
+        self.batch_rows = batch_rows
+        self._cond = threading.Condition()
+        self._pending = []       # (seq, session_id, role, content, image), äldst först
+        self._seq = 0            # senast köade
+        self.committed = 0       # allt med seq <= committed finns i databasen
+        self.id = uuid.uuid4().hex
+        self._thread = None
+        self._closing = False
+        self.dropped = 0
+
+    def enqueue(self, session_id, role, content, image=None):
+        """
+        Köar ett meddelande (samma argument som save_message). Väntar aldrig på databasen.
+        En bild som inte redan är en referens läggs i blob_store här, kön håller bara referensen.
+        """
+        if image is not None:
+            from app.core.blob_store import put_blob
+            image = put_blob(image)
+        with self._cond:
+            self._seq += 1
+            self._pending.append((self._seq, session_id, role, content, image))
+            if self._thread is None or not self._thread.is_alive():
+                self._closing = False
+                self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            return self._seq
+
+    def snapshot(self):
+        """Ej bekräftade rader som (seq, role, content, image), äldst först."""
+        with self._cond:
+            return [(seq, r, c, i) for seq, _, r, c, i in self._pending]
+
+    def _run(self):
+        from app.core.database import save_messages
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing:
+                    self._cond.wait()
+                if not self._pending: return
+                # Vänta in fler rader en kort stund (om inte batchen redan är full eller vi stänger)
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._pending) < self.batch_rows and not self._closing:
+                    left = deadline - time.monotonic()
+                    if left <= 0: break
+                    self._cond.wait(left)
+                batch = self._pending[:self.batch_rows]
+            rows = [row[1:] for row in batch]
+            for attempt in range(MAX_RETRIES):
+                try:
+                    save_messages(rows, writer=self.id, seq=batch[-1][0])
+                    break
+                except Exception as e:
+                    print(f"[HISTORY] Kunde inte spara {len(rows)} meddelanden (försök {attempt + 1}): {e}")
+                    if attempt < MAX_RETRIES - 1: time.sleep(RETRY_DELAY)
+            else:
+                self.dropped += len(rows)
+                inc("history_dropped_total", value=len(rows))
+            with self._cond:
+                del self._pending[:len(batch)]
+                self.committed = batch[-1][0]
+                self._cond.notify_all()
+
+    def flush(self, timeout=5.0):
+        """Väntar tills allt som köats hittills finns i databasen. False vid timeout."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            target = self._seq
+            while self.committed < target:
+                left = deadline - time.monotonic()
+                if left <= 0 or not (self._thread and self._thread.is_alive()): return self.committed >= target
+                self._cond.wait(left)
+            return True
+
+    def close(self, timeout=5.0):
+        """Skriver ut kön och stoppar tråden (vid shutdown)."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread and thread.is_alive():
+            thread.join(timeout)
+        if self._pending:
+            print(f"[HISTORY] {len(self._pending)} meddelanden hann inte sparas.")
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_message_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = MessageWriter()
+        return _writer
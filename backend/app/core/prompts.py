@@ -53,11 +53,18 @@ def get_system_prompt():
 def get_audit_prompt():
     return get_prompts_data().get("CODE_AUDIT_PROMPT", "Ingen kodanalys-prompt hittades.")
 
+def get_summary_prompt():
+    return get_prompts_data().get("HISTORY_SUMMARY_PROMPT", "Sammanfatta samtalet kort på svenska.")
+
 def get_audit_tool_desc():
     # Standardbeskrivning om den saknas i DB
     default = "Analyserar projektets källkod för att hitta fel och förbättringar."
     return get_prompts_data().get("TOOL_DESC_AUDIT", default)
 
-# Variabler för import till andra filer
-CODE_AUDIT_PROMPT = get_audit_prompt()
-ANALYZE_CODE_TOOL_DESC = get_audit_tool_desc()
\ No newline at end of file
+# Äldre variabelnamn. Läses från DB först när de efterfrågas (inte vid import),
+# använd hellre funktionerna ovan så att ändringar i inställningarna slår igenom.
+_LAZY = {"CODE_AUDIT_PROMPT": get_audit_prompt, "ANALYZE_CODE_TOOL_DESC": get_audit_tool_desc}
+
+def __getattr__(name):
+    if name in _LAZY: return _LAZY[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
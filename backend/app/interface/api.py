@@ -1,40 +1,33 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Header, HTTPException
+import asyncio
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel
-import google.generativeai as genai
 import requests
 import json
 import time
-import asyncio
-from typing import List, Optional
-
-# Importera databasfunktioner
-from app.core.database import save_message, get_history
-# Importera System Prompt
-from app.core.prompts import get_system_prompt
+import uuid
+from typing import List, Optional, Union
 
 # Importera inställningar
 try:
     from config.settings import (
         GOOGLE_API_KEY, 
         OPENAI_API_KEY, 
-        OLLAMA_URL, 
-        GARMIN_EMAIL, 
-        GARMIN_PASSWORD,
-        STRAVA_CLIENT_ID,
-        STRAVA_REFRESH_TOKEN
+        OLLAMA_URL
     )
 except ImportError:
     GOOGLE_API_KEY = None
     OPENAI_API_KEY = None
     OLLAMA_URL = "http://127.0.0.1:11434"
-    GARMIN_EMAIL = None
-    GARMIN_PASSWORD = None
-    STRAVA_CLIENT_ID = None
-    STRAVA_REFRESH_TOKEN = None
 
-# Verktyg
-from app.tools.garmin_core import GarminCoach
-from app.tools.strava_core import StravaTool
+# Gemensam chattpipeline (historik, realtidsdata, strömning via stream_response)
+from app.services.chat_pipeline import run_turn, CHAT_FALLBACK_MODEL
+# Coalescing och kort cache för automatiska anrop via /v1
+from app.services.response_cache import get_coalescer, get_semantic_cache, request_key, idempotent_ttl
+from config.settings import get_config
+from app.services.history_archive import search_history, archive_stats
+from app.services.job_queue import get_job_queue
+from app.core.blob_store import put_blob, load_blob, load_thumbnail, blob_info, is_ref as is_blob_ref, PREFIX as BLOB_PREFIX
 
 router = APIRouter()
 
@@ -42,41 +35,39 @@ router = APIRouter()
 has_google = False
 if GOOGLE_API_KEY:
     try:
+        import google.generativeai as genai
         genai.configure(api_key=GOOGLE_API_KEY)
         has_google = True
     except: pass
 
-# --- GARMIN INIT ---
-garmin_tool = None
-if GARMIN_EMAIL and GARMIN_PASSWORD:
-    try:
-        garmin_tool = GarminCoach()
-    except: pass
-
-last_garmin_fetch = 0
-cached_garmin_data = None
-
-# --- STRAVA INIT ---
-strava_tool = None
-if STRAVA_CLIENT_ID and STRAVA_REFRESH_TOKEN:
-    try:
-        strava_tool = StravaTool()
-    except: pass
-
-last_strava_fetch = 0
-cached_strava_data = None
-
-
 # --- MODELLER ---
 class Message(BaseModel):
     role: str
     content: str
-    image: Optional[str] = None
+    image: Optional[str] = None       # base64/data-URL (skickas inline)
+    image_ref: Optional[str] = None   # eller en referens från POST /api/blobs
+
+class BlobRequest(BaseModel):
+    data: str                         # base64 eller data-URL
+    mime: Optional[str] = None
 
 class ChatRequest(BaseModel):
     model: str = "gemini-1.5-flash"
     messages: List[Message]
     session_id: str = "default"
+    stream: bool = False
+    cache: bool = True   # False = gå alltid till modellen
+
+# OpenAI-kompatibelt format (/v1/chat/completions)
+class CompletionMessage(BaseModel):
+    role: str
+    content: Union[str, List[dict], None] = None
+
+class CompletionRequest(BaseModel):
+    model: str = CHAT_FALLBACK_MODEL
+    messages: List[CompletionMessage]
+    stream: bool = False
+    cache: bool = True
 
 # --- ENDPOINTS ---
 
@@ -88,6 +79,7 @@ async def get_models():
     # 1. Google
     if has_google:
         try:
+            import google.generativeai as genai
             for m in genai.list_models():
                 if 'generateContent' in m.supported_generation_methods:
                     clean_id = m.name.replace("models/", "")
@@ -120,145 +112,140 @@ async def get_models():
 
     return {"data": models}
 
+def _sse(data):
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _completion_chunk(completion_id, model, created, delta, finish_reason=None):
+    """En bit i OpenAI:s strömformat (chat.completion.chunk)."""
+    return {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+async def stream_sse(chunks, model):
+    """Textbitar -> Server-Sent Events i OpenAI-kompatibelt format, avslutas med [DONE]."""
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    yield _sse(_completion_chunk(completion_id, model, created, {"role": "assistant"}))
+    async for chunk in chunks:
+        yield _sse(_completion_chunk(completion_id, model, created, {"content": chunk}))
+    yield _sse(_completion_chunk(completion_id, model, created, {}, "stop"))
+    yield "data: [DONE]\n\n"
+
+@router.get("/api/cache/stats")
+async def cache_stats():
+    """Träffar/missar för svarscacharna."""
+    return {"semantic": get_semantic_cache().stats(), "gateway": get_coalescer().stats()}
+
+@router.get("/api/history/search")
+async def history_search(q: str, session_id: Optional[str] = None, limit: int = 20, archive: bool = True):
+    """Sök i historiken, sammanfattningarna och arkivet (read-through)."""
+    results = await asyncio.to_thread(search_history, q, session_id, min(max(limit, 1), 200), archive)
+    return {"query": q, "results": results}
+
+@router.get("/api/history/archive")
+async def history_archive_status():
+    return await asyncio.to_thread(archive_stats)
+
+@router.post("/api/history/archive")
+async def history_archive_run(retention_days: Optional[int] = None):
+    """Startar arkiveringen som bakgrundsjobb (samma som det dagliga schemat)."""
+    args = {"retention_days": retention_days} if retention_days is not None else None
+    try: job_id, existing = await asyncio.to_thread(get_job_queue().submit, "archive_history", args)
+    except Exception as e: raise HTTPException(status_code=500, detail=str(e))
+    return {"job_id": job_id, "existing": existing}
+
+# --- BLOBBAR (bilder) ---
+
+@router.post("/api/blobs")
+async def upload_blob(req: BlobRequest):
+    """Sparar en bild en gång. Referensen kan sedan skickas som image_ref i /api/chat."""
+    try: ref = await asyncio.to_thread(put_blob, req.data, req.mime)
+    except ValueError as e: raise HTTPException(status_code=400, detail=str(e))
+    digest = ref[len(BLOB_PREFIX):]
+    info = await asyncio.to_thread(blob_info, ref) or {}
+    return {"ref": ref, "mime": info.get("mime"), "width": info.get("width"), "height": info.get("height"),
+            "url": f"/api/blobs/{digest}", "thumbnail": f"/api/blobs/{digest}/thumbnail" if info.get("thumb") else None}
+
+@router.get("/api/blobs/{digest}")
+async def get_blob(digest: str):
+    try:
+        info = await asyncio.to_thread(blob_info, digest)
+        data = await asyncio.to_thread(load_blob, BLOB_PREFIX + digest)
+    except (ValueError, OSError): raise HTTPException(status_code=404)
+    return Response(data, media_type=(info or {}).get("mime") or "application/octet-stream",
+                    headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@router.get("/api/blobs/{digest}/thumbnail")
+async def get_blob_thumbnail(digest: str):
+    data = await asyncio.to_thread(load_thumbnail, digest)
+    if data is None: raise HTTPException(status_code=404)
+    return Response(data, media_type="image/jpeg", headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
 @router.post("/chat")
 @router.post("/api/chat")
 async def chat(request: ChatRequest):
-    global last_garmin_fetch, cached_garmin_data
-    global last_strava_fetch, cached_strava_data
-    
-    user_msg = request.messages[-1].content
-    session_id = request.session_id
-    model_id = request.model.lower()
-
-    # 2. SPARA ANVÄNDARENS MEDDELANDE
-    save_message(session_id, "user", user_msg)
-
-    # 3. Hämta historik
-    db_history = get_history(session_id)
-
-    # 4. Hämta System Prompt
-    system_prompt = get_system_prompt()
-
-    # --- HÄMTA GARMIN-DATA (Körs i tråd för att inte blockera) ---
-    garmin_triggers = ["puls", "sömn", "stress", "garmin", "mår jag", "status", "kropp"]
-    if garmin_tool and any(t in user_msg.lower() for t in garmin_triggers):
-        now = time.time()
-        if (now - last_garmin_fetch > 900) or not cached_garmin_data:
-            try:
-                # Garmin-biblioteket är synkront, så vi kör det i en executor
-                loop = asyncio.get_event_loop()
-                report = await loop.run_in_executor(None, garmin_tool.get_health_report)
-                if report:
-                    cached_garmin_data = report
-                    last_garmin_fetch = now
-            except: pass
-        
-        if cached_garmin_data:
-            d = cached_garmin_data
-            data_block = (
-                f"   - 💤 Sömn: {d.get('sömn_timmar')} timmar\n"
-                f"   - ❤️ Vilopuls: {d.get('vilopuls')} bpm\n"
-                f"   - ⚡ Stressnivå: {d.get('stress_snitt')}/100\n"
-                f"   - 🔋 Body Battery: {d.get('body_battery', 'N/A')}"
-            )
-            system_prompt += f"\n\n[HÄLSODATA FRÅN GARMIN IDAG]:\n{data_block}\n\nINSTRUKTION: Analysera ovanstående data. Ge konkreta råd baserat på värdena."
-
-    # --- HÄMTA STRAVA-DATA (Nu med await) ---
-    strava_triggers = ["strava", "löpning", "cykling", "pass", "träning", "aktivitet"]
-    if strava_tool and any(t in user_msg.lower() for t in strava_triggers):
-        now = time.time()
-        if (now - last_strava_fetch > 300) or not cached_strava_data:
-            try:
-                # Strava-verktyget är nu async
-                activities = await strava_tool.get_health_report(limit=3)
-                if activities:
-                    cached_strava_data = activities
-                    last_strava_fetch = now
-            except: pass
-
-        if cached_strava_data:
-            strava_text = ""
-            for act in cached_strava_data:
-                strava_text += (
-                    f"   - 📅 {act['datum']}: {act['typ']}\n"
-                    f"     Distans: {act['distans_km']} km | Tid: {act['tid_min']} min | Ansträngning: {act['ansträngning']}\n"
-                )
-            system_prompt += f"\n\n[SENASTE TRÄNINGSPASS]:\n{strava_text}\nINSTRUKTION: Kommentera träningen kortfattat och uppmuntrande."
-
-    response_text = ""
-
-    # 5. ANROPA AI
-    
-    # --- GOOGLE GEMINI ---
-    if "gemini" in model_id:
-        try:
-            gemini_history = []
-            gemini_history.append({"role": "user", "parts": [system_prompt]})
-            gemini_history.append({"role": "model", "parts": ["Uppfattat. Jag svarar strukturerat."]})
-
-            for msg in db_history:
-                role = "model" if msg['role'] == "assistant" else "user"
-                gemini_history.append({"role": role, "parts": [msg['content']]})
-            
-            if not db_history or db_history[-1]['content'] != user_msg:
-                 gemini_history.append({"role": "user", "parts": [user_msg]})
-
-            # Kör async om möjligt, annars executor
-            loop = asyncio.get_event_loop()
-            gmodel = genai.GenerativeModel(model_id)
-            final_response = await loop.run_in_executor(None, lambda: gmodel.generate_content(gemini_history))
-            response_text = final_response.text
-
-        except Exception as e:
-            response_text = f"Gemini Error: {e}"
-
-    # --- OPENAI / OTHERS ---
-    elif "gpt" in model_id or "o1" in model_id:
-        try:
-            messages = [{"role": "system", "content": system_prompt}]
-            for msg in db_history:
-                messages.append({"role": msg['role'], "content": msg['content']})
-            
-            if not db_history or db_history[-1]['content'] != user_msg:
-                 messages.append({"role": "user", "content": user_msg})
-
-            payload = {"model": model_id, "messages": messages}
-            h = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
-            # Använd requests i executor för att inte blockera
-            loop = asyncio.get_event_loop()
-            r = await loop.run_in_executor(None, lambda: requests.post("https://api.openai.com/v1/chat/completions", json=payload, headers=h))
-            
-            if r.status_code == 200:
-                response_text = r.json()["choices"][0]["message"]["content"]
-            else:
-                response_text = f"OpenAI Error: {r.text}"
-        except Exception as e:
-            response_text = f"Error: {e}"
-
-    # --- OLLAMA ---
-    else:
-        try:
-            messages = [{"role": "system", "content": system_prompt}]
-            for msg in db_history:
-                messages.append({"role": msg['role'], "content": msg['content']})
-            
-            if not db_history or db_history[-1]['content'] != user_msg:
-                 messages.append({"role": "user", "content": user_msg})
-
-            payload = {"model": model_id, "messages": messages, "stream": False}
-            # Ollama kan vara långsamt, kör i executor
-            loop = asyncio.get_event_loop()
-            r = await loop.run_in_executor(None, lambda: requests.post(f"{OLLAMA_URL}/api/chat", json=payload, timeout=60))
-            
-            if r.status_code == 200:
-                response_text = r.json().get("message", {}).get("content", "")
-            else:
-                response_text = f"Ollama Error: {r.text}"
-        except Exception as e:
-            response_text = f"Error: {e}"
+    last = request.messages[-1]
+    # Bilden läggs i blob_store direkt, trasig base64 eller okänd referens ger 400
+    image_data = None
+    if last.image:
+        try: image_data = await asyncio.to_thread(put_blob, last.image)
+        except ValueError as e: raise HTTPException(status_code=400, detail=f"Ogiltig bild: {e}")
+    elif last.image_ref:
+        try: known = is_blob_ref(last.image_ref) and await asyncio.to_thread(blob_info, last.image_ref)
+        except ValueError: known = None
+        if not known: raise HTTPException(status_code=400, detail=f"Okänd bildreferens: {last.image_ref}")
+        image_data = last.image_ref
+
+    # Samma pipeline som Socket.IO: historik, realtidsdata, reservmodell och sparning
+    chunks = run_turn(last.content, request.model, session_id=request.session_id, image_data=image_data,
+                      use_cache=request.cache, source="rest")
+
+    if request.stream:
+        return StreamingResponse(stream_sse(chunks, request.model), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    # Utan stream returneras hela svaret som förut
+    return "".join([chunk async for chunk in chunks])
+
+# --- OPENAI-KOMPATIBEL GATEWAY ---
+# För n8n, skript och andra assistenter. Samma pipeline (kontext, verktyg,
+# minne) men klienten skickar sin egen historik och inget sparas i DAA:s chatt.
+
+def _text_of(content):
+    """content kan vara en sträng eller en lista med delar ({"type": "text", ...})."""
+    if isinstance(content, list):
+        return "".join(p.get("text", "") for p in content if p.get("type") == "text")
+    return content or ""
+
+def _check_gateway_key(authorization):
+    key = get_config().get("GATEWAY_API_KEY")
+    if key and authorization != f"Bearer {key}":
+        raise HTTPException(status_code=401, detail={"error": {"message": "Ogiltig API-nyckel", "type": "invalid_request_error"}})
+
+@router.post("/v1/chat/completions")
+async def chat_completions(request: CompletionRequest, authorization: Optional[str] = Header(None)):
+    _check_gateway_key(authorization)
+    messages = [{"role": m.role, "content": _text_of(m.content)} for m in request.messages]
+    system = "\n\n".join(m["content"] for m in messages if m["role"] == "system" and m["content"])
+    dialog = [m for m in messages if m["role"] in ("user", "assistant") and m["content"]]
+    if not dialog or dialog[-1]["role"] != "user":
+        raise HTTPException(status_code=400, detail={"error": {"message": "Sista meddelandet måste komma från user", "type": "invalid_request_error"}})
+    text = dialog[-1]["content"]
+
+    # Identiska samtidiga frågor delar en generering, idempotenta svar (väder, kalender) cachas kort
+    chunks = get_coalescer().stream(
+        request_key(request.model, messages),
+        lambda: run_turn(text, request.model, history=dialog[:-1], extra_system=system or None, persist=False,
+                         use_cache=request.cache, source="gateway"),
+        ttl=idempotent_ttl(text) if request.cache else None,
+    )
 
-    # 6. SPARA SVAR
-    if response_text:
-        save_message(session_id, "assistant", response_text)
+    if request.stream:
+        return StreamingResponse(stream_sse(chunks, request.model), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-    return response_text
\ No newline at end of file
+    content = "".join([chunk async for chunk in chunks])
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "object": "chat.completion", "created": int(time.time()),
+        "model": request.model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+    }
@@ -120,16 +120,25 @@ HTML_CONTENT = """
                 const response = await fetch('/api/chat', {
                     method: 'POST',
                     headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({ model: "gemini-1.5-flash", messages: [{role: "user", content: text}], session_id: "daa-web-final" })
+                    body: JSON.stringify({ model: "gemini-1.5-flash", messages: [{role: "user", content: text}], session_id: "daa-web-final", stream: true })
                 });
+                if (!response.ok) throw new Error("HTTP " + response.status);
+                // Server-Sent Events: "data: {...}" per bit, avslutas med "data: [DONE]"
                 const reader = response.body.getReader();
                 const decoder = new TextDecoder();
-                let fullText = "";
+                let buffer = "", fullText = "";
                 while (true) {
                     const { done, value } = await reader.read();
                     if (done) break;
-                    fullText += decoder.decode(value);
-                    mainText.innerText = fullText; 
+                    buffer += decoder.decode(value, { stream: true });
+                    const events = buffer.split("\\n\\n");
+                    buffer = events.pop();
+                    for (const event of events) {
+                        const data = event.replace(/^data: /, "");
+                        if (!data || data === "[DONE]") continue;
+                        fullText += JSON.parse(data).choices[0].delta.content || "";
+                    }
+                    mainText.innerText = fullText;
                 }
                 speakResponse(fullText);
             } catch (err) { setState(''); mainText.innerText = "Serverfel."; log("API Fel: " + err.message); }
@@ -0,0 +1,224 @@
+"""
+==============================================================================
+FILE: app/services/calendar_service.py
+DESCRIPTION: Google Kalender med lokal händelselagring. Klienten (och dess
+             credentials, som förnyas först när de gått ut) byggs en gång.
+             Händelserna synkas inkrementellt med Calendars sync tokens till
+             SQLite och frågor som "vad händer idag/i veckan" besvaras lokalt.
+==============================================================================
+"""
+import os
+import json
+import time
+import asyncio
+import datetime
+import threading
+from app.core.database import get_db_connection
+from config.settings import get_config
+
+SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
+# Hur ofta den lokala kalendern synkas vid läsning (sekunder)
+SYNC_INTERVAL = 120
+# Första fullständiga synken börjar så här många dagar bakåt
+FULL_SYNC_DAYS_BACK = 7
+PAGE_SIZE = 250
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _ensure_schema():
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready: return
+        with get_db_connection() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS gcal_events (
+                id TEXT, calendar_id TEXT, summary TEXT, location TEXT,
+                start_ts REAL, end_ts REAL, all_day INTEGER, start_text TEXT,
+                updated TEXT, payload TEXT, PRIMARY KEY (calendar_id, id))''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_gcal_start ON gcal_events (calendar_id, start_ts)')
+            conn.execute('''CREATE TABLE IF NOT EXISTS gcal_sync (
+                calendar_id TEXT PRIMARY KEY, sync_token TEXT, synced_at REAL)''')
+            conn.commit()
+        _schema_ready = True
+
+
+def _to_ts(when):
+    """Calendar-tid ({"dateTime": ...} eller {"date": ...}) -> (epoch, heldag)."""
+    if "dateTime" in when:
+        return datetime.datetime.fromisoformat(when["dateTime"].replace("Z", "+00:00")).timestamp(), False
+    day = datetime.date.fromisoformat(when["date"])
+    return datetime.datetime.combine(day, datetime.time.min).timestamp(), True
+
+
+def _event_row(calendar_id, event):
+    start_ts, all_day = _to_ts(event["start"])
+    end_ts, _ = _to_ts(event.get("end") or event["start"])
+    start = event["start"].get("dateTime", event["start"].get("date"))
+    return (event["id"], calendar_id, event.get("summary", "Inget namn"), event.get("location"),
+            start_ts, end_ts, int(all_day), start, event.get("updated"), json.dumps(event))
+
+
+class CalendarService:
+    def __init__(self):
+        self._service = None
+        self._service_lock = threading.Lock()
+        self._sync_lock = threading.RLock()
+        self.last_sync = 0
+
+    @property
+    def calendar_id(self):
+        return get_config().get("GCAL_CALENDAR_ID") or "primary"
+
+    @property
+    def configured(self):
+        key_path = get_config().get("SERVICE_ACCOUNT_FILE")
+        return bool(key_path and os.path.exists(key_path))
+
+    # --- KLIENT ---
+
+    def _client(self):
+        """
+        Byggs en gång. Credentials-objektet återanvänds och google-auth
+        förnyar token först när den gått ut.
+        """
+        with self._service_lock:
+            if self._service is None:
+                if not self.configured:
+                    raise FileNotFoundError("Ingen kalender-nyckel hittades.")
+                key_path = get_config()["SERVICE_ACCOUNT_FILE"]
+                from google.oauth2 import service_account
+                from googleapiclient.discovery import build
+                creds = service_account.Credentials.from_service_account_file(key_path, scopes=SCOPES)
+                self._service = build('calendar', 'v3', credentials=creds, cache_discovery=False)
+            return self._service
+
+    # --- SYNK ---
+
+    def _load_token(self, calendar_id):
+        _ensure_schema()
+        with get_db_connection() as conn:
+            row = conn.execute("SELECT sync_token FROM gcal_sync WHERE calendar_id = ?", (calendar_id,)).fetchone()
+        return row["sync_token"] if row else None
+
+    def _apply(self, calendar_id, events, token, reset=False):
+        with get_db_connection() as conn:
+            if reset:
+                conn.execute("DELETE FROM gcal_events WHERE calendar_id = ?", (calendar_id,))
+            cancelled = [(calendar_id, e["id"]) for e in events if e.get("status") == "cancelled"]
+            live = [_event_row(calendar_id, e) for e in events if e.get("status") != "cancelled" and "start" in e]
+            conn.executemany("DELETE FROM gcal_events WHERE calendar_id = ? AND id = ?", cancelled)
+            conn.executemany('''INSERT OR REPLACE INTO gcal_events
+                (id, calendar_id, summary, location, start_ts, end_ts, all_day, start_text, updated, payload)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', live)
+            conn.execute("INSERT OR REPLACE INTO gcal_sync (calendar_id, sync_token, synced_at) VALUES (?, ?, ?)",
+                         (calendar_id, token, time.time()))
+            conn.commit()
+        return len(live) + len(cancelled)
+
+    def _list_all(self, calendar_id, token):
+        """Alla sidor från events.list. Returnerar (händelser, nästa sync token)."""
+        params = {"calendarId": calendar_id, "singleEvents": True, "maxResults": PAGE_SIZE}
+        if token:
+            params["syncToken"] = token
+        else:
+            since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=FULL_SYNC_DAYS_BACK)
+            params["timeMin"] = since.isoformat()
+        events, page_token = [], None
+        while True:
+            result = self._client().events().list(pageToken=page_token, **params).execute()
+            events.extend(result.get("items", []))
+            page_token = result.get("nextPageToken")
+            if not page_token:
+                return events, result.get("nextSyncToken")
+
+    def sync(self):
+        """Inkrementell synk (blockerande). Ogiltig sync token (410) ger en ny fullständig synk."""
+        calendar_id = self.calendar_id
+        with self._sync_lock:
+            token = self._load_token(calendar_id)
+            try:
+                events, next_token = self._list_all(calendar_id, token)
+            except Exception as e:
+                if token and getattr(getattr(e, "resp", None), "status", None) == 410:
+                    print("[GCAL] Sync token ogiltig, gör full synk.")
+                    token = None
+                    events, next_token = self._list_all(calendar_id, None)
+                else:
+                    raise
+            changed = self._apply(calendar_id, events, next_token, reset=token is None)
+            self.last_sync = time.time()
+            if changed: print(f"[GCAL] Synkade {changed} händelser{' (full synk)' if token is None else ''}.")
+            return changed
+
+    def ensure_synced(self, max_age=SYNC_INTERVAL):
+        """Synkar om den lokala kalendern är äldre än `max_age`. Fel loggas, lagrad data används ändå."""
+        if not self.configured: return False
+        with self._sync_lock:
+            # Den som väntade på låset behöver inte synka igen
+            if time.time() - self.last_sync < max_age: return True
+            try:
+                self.sync()
+                return True
+            except Exception as e:
+                print(f"[GCAL] Synkfel: {e}")
+                return False
+
+    async def ensure_synced_async(self, max_age=SYNC_INTERVAL):
+        return await asyncio.to_thread(self.ensure_synced, max_age)
+
+    # --- LÄSNING (lokalt) ---
+
+    def events_between(self, start, end):
+        """Händelser som överlappar [start, end) (datetime), i tidsordning."""
+        _ensure_schema()
+        with get_db_connection() as conn:
+            rows = conn.execute('''SELECT summary, location, start_ts, end_ts, all_day, start_text FROM gcal_events
+                                   WHERE calendar_id = ? AND start_ts < ? AND end_ts > ? ORDER BY start_ts''',
+                                (self.calendar_id, end.timestamp(), start.timestamp())).fetchall()
+        return [dict(r) for r in rows]
+
+    def upcoming(self, limit=5):
+        _ensure_schema()
+        with get_db_connection() as conn:
+            rows = conn.execute('''SELECT summary, location, start_ts, end_ts, all_day, start_text FROM gcal_events
+                                   WHERE calendar_id = ? AND end_ts > ? ORDER BY start_ts LIMIT ?''',
+                                (self.calendar_id, time.time(), limit)).fetchall()
+        return [dict(r) for r in rows]
+
+
+def period_range(period, now=None):
+    """"idag", "imorgon" eller "veckan" (resten av veckan t.o.m. söndag) -> (start, slut)."""
+    now = now or datetime.datetime.now()
+    midnight = datetime.datetime.combine(now.date(), datetime.time.min)
+    if period == "imorgon":
+        return midnight + datetime.timedelta(days=1), midnight + datetime.timedelta(days=2)
+    if period == "veckan":
+        return now, midnight + datetime.timedelta(days=7 - now.weekday())
+    return midnight, midnight + datetime.timedelta(days=1)
+
+
+WEEKDAYS = ["mån", "tis", "ons", "tor", "fre", "lör", "sön"]
+
+
+def format_events(events, with_day=False):
+    lines = []
+    for e in events:
+        start = datetime.datetime.fromtimestamp(e["start_ts"])
+        day = f"{WEEKDAYS[start.weekday()]} {start.day}/{start.month} " if with_day else ""
+        when = "Heldag" if e["all_day"] else f"Kl {start:%H:%M}"
+        place = f" ({e['location']})" if e.get("location") else ""
+        lines.append(f"{day}{when}: {e['summary']}{place}")
+    return lines
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_calendar_service():
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = CalendarService()
+        return _service
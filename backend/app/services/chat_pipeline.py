@@ -0,0 +1,137 @@
+"""
+==============================================================================
+FILE: app/services/chat_pipeline.py
+DESCRIPTION: En chattur från meddelande till sparat svar. Delas av Socket.IO
+             (server.py) och REST-routern (api.py) så att båda får samma
+             historik, realtidsdata, reservmodell och strömning via
+             stream_response.
+==============================================================================
+"""
+import asyncio
+from app.core.database import get_history
+from app.core.message_writer import get_message_writer
+from app.core.blob_store import put_blob, is_ref
+from app.services.context_providers import build_context
+from app.services.fallback import FallbackPolicy
+from app.services.response_cache import get_semantic_cache, context_fingerprint, conversation_key
+from app.utils.metrics import timed_stream
+from app.utils import tracing
+
+# Reservmodell för chatten: startas parallellt om den valda modellen inte
+# gett någon token inom försprånget, första användbara token vinner. Den
+# parallella reserven får inga verktyg (förloraren kan inte stoppas mitt i
+# en tråd, och två modeller får inte tända samma lampa).
+CHAT_FALLBACK_MODEL = "gemini-2.0-flash-exp"
+CHAT_HEAD_START = 4.0
+HISTORY_TURNS = 10
+
+
+def _load_stream_response():
+    """llm_handler (alla modell-SDK:er och verktyg) laddas vid första frågan, inte när servern startar."""
+    from app.services.llm_handler import stream_response
+    return stream_response
+
+
+def _head_start(model):
+    """
+    Gemini svarar först när hela turen (inklusive verktygsanrop) är klar, så
+    tid till första token säger inget om att den hängt sig. Där startas
+    reserven bara om modellen misslyckas.
+    """
+    name = model.lower()
+    return None if "gemini" in name or "google" in name else CHAT_HEAD_START
+
+
+def _clean_history(rows, new_message):
+    """Bara role/content till modellerna, och utan det nyss sparade meddelandet."""
+    history = [{"role": r["role"], "content": r["content"]} for r in rows if r.get("content")]
+    if history and history[-1]["role"] == "user" and history[-1]["content"] == new_message:
+        history.pop()
+    return history
+
+
+async def _no_history():
+    return None
+
+
+def run_turn(text, model=None, session_id="hybrid", image_data=None, history=None, extra_system=None,
+             persist=True, use_cache=True, source="chat"):
+    """
+    Async generator med svarets textbitar. Vinner reservmodellen skickas först
+    en rad om det. history: klientens egen historik (annars läses databasen).
+    image_data: bytes eller blob-referens (läses först om modellen tar bilder).
+    persist=False sparar varken frågan eller svaret (t.ex. automatiska anrop).
+    use_cache=False går alltid till modellen.
+    Hela turen mäts som turn_* i /metrics (tid till första bit sett från klienten)
+    och spåras per steg (source: "socket", "rest", "gateway"...), se tracing.py.
+    """
+    turn = tracing.traced_turn(
+        source, lambda: _run_turn(text, model, session_id, image_data, history, extra_system, persist, use_cache),
+        model=model or CHAT_FALLBACK_MODEL, message_chars=len(text), image=bool(image_data), cache=use_cache)
+    return timed_stream("turn", turn)
+
+
+async def _run_turn(text, model, session_id, image_data, history, extra_system, persist, use_cache):
+    requested_model = model or CHAT_FALLBACK_MODEL
+    trace = tracing.current()
+    writer = get_message_writer()
+    if persist:
+        # Köas bara (write-behind), get_history nedan ser den ändå.
+        # En bild hamnar i blob_store, raden (och kön) får bara referensen.
+        with tracing.stage("save_user"):
+            if image_data is not None and not is_ref(image_data):
+                image_data = await asyncio.to_thread(put_blob, image_data)
+            writer.enqueue(session_id, "user", text, image_data)
+    full_resp = ""
+    try:
+        # Historik och realtidsdata (bara relevanta källor) hämtas parallellt.
+        # Själva system-prompten läggs till av stream_response.
+        rows, (context_block, sources) = await asyncio.gather(
+            tracing.traced("history", asyncio.to_thread(get_history, session_id, HISTORY_TURNS) if history is None else _no_history()),
+            tracing.traced("context", build_context(text, with_sources=True)),
+        )
+        hist = _clean_history(rows if history is None else history, text)
+        if extra_system:
+            context_block = f"{extra_system}\n\n{context_block}" if context_block else extra_system
+
+        # Semantisk cache: bara datafrågor (minst en realtidskälla), aldrig kommandon eller bilder
+        cache = get_semantic_cache()
+        fingerprint = None
+        if sources and not image_data and cache.accepts(text):
+            if use_cache:
+                fingerprint = context_fingerprint(context_block, conversation_key(text, hist))
+                hit = cache.lookup(requested_model, text, fingerprint)
+                tracing.annotate(cache_hit=hit is not None)
+                if hit is not None:
+                    full_resp = hit
+                    yield hit
+            else:
+                cache.bypass()
+
+        answered_by = requested_model
+        if not full_resp:
+            stream_response = await asyncio.to_thread(_load_stream_response)
+            policy = FallbackPolicy([requested_model, CHAT_FALLBACK_MODEL], head_start=_head_start(requested_model))
+            stream = policy.stream(lambda m: stream_response(m, hist, text, image_data, system_injection=context_block),
+                                   hedge_factory=lambda m: stream_response(m, hist, text, image_data, system_injection=context_block, tools=False))
+            with tracing.stage("model") as model_stage:
+                async for used_model, chunk in stream:
+                    if not full_resp:
+                        answered_by = used_model
+                        tracing.annotate(provider=used_model)
+                        if trace: model_stage["first_token_ms"] = trace.ms()
+                        if used_model != requested_model:
+                            yield f"[System: Svarar med {used_model}]\n"
+                    full_resp += chunk
+                    yield chunk
+            # Svarade reservmodellen sparas inget (nyckeln är den valda modellen)
+            if fingerprint and answered_by == requested_model:
+                cache.store(requested_model, text, fingerprint, full_resp, cache.ttl_for(sources))
+
+    except Exception as e:
+        print(f"[LLM ERROR] {e}")
+        yield f"Fel: {e}"
+
+    if persist and full_resp:
+        with tracing.stage("save_answer"):
+            writer.enqueue(session_id, "assistant", full_resp)
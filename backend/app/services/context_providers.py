@@ -0,0 +1,224 @@
+"""
+==============================================================================
+FILE: app/services/context_providers.py
+DESCRIPTION: Realtidsdata till system-prompten. Varje datakälla registrerar
+             en hämtare, en cache-TTL och en relevansfunktion. Bara källor som
+             är relevanta för meddelandet hämtas, parallellt och inom en
+             tidsbudget. Används av både server.py och api.py.
+==============================================================================
+"""
+import os
+import re
+import time
+import asyncio
+from config.settings import get_config
+from app.utils import tracing
+from app.utils.metrics import span
+
+# Hur länge vi väntar på datakällorna innan svaret startas ändå (sekunder)
+DEFAULT_BUDGET = 2.5
+# Lägsta relevanspoäng (0-1) för att en källa ska hämtas
+DEFAULT_THRESHOLD = 0.5
+
+
+class ContextProvider:
+    def __init__(self, name, fetcher, ttl, scorer, enabled=None):
+        self.name = name
+        self.fetcher = fetcher      # async () -> str
+        self.ttl = ttl              # sekunder som en hämtad text återanvänds
+        self.scorer = scorer        # (meddelande) -> 0..1
+        self.enabled = enabled or (lambda cfg: True)  # (config) -> bool
+        self.cached_text = None
+        self.cached_at = 0
+        self.inflight = None
+
+    def fresh(self):
+        return self.cached_text is not None and time.time() - self.cached_at < self.ttl
+
+    async def _fetch(self):
+        try:
+            with span("context", source=self.name):
+                text = await self.fetcher()
+            self.cached_text = text or ""
+            self.cached_at = time.time()
+        except Exception as e:
+            print(f"[CONTEXT] {self.name} misslyckades: {e}")
+        finally:
+            self.inflight = None
+        return self.cached_text
+
+    def fetch(self):
+        """Samma pågående hämtning delas av alla som frågar samtidigt."""
+        if self.inflight is None:
+            self.inflight = asyncio.ensure_future(self._fetch())
+        return self.inflight
+
+
+_providers = {}
+
+
+def register_provider(name, fetcher, ttl, scorer, enabled=None):
+    """Registrerar (eller ersätter) en datakälla."""
+    _providers[name] = ContextProvider(name, fetcher, ttl, scorer, enabled)
+    return _providers[name]
+
+
+def get_providers():
+    return dict(_providers)
+
+
+def keyword_scorer(weights):
+    """
+    Enkel relevansfunktion: summan av vikterna för de ord/fraser som finns i
+    meddelandet, max 1. Nycklarna matchas som ordbörjan ("sov" matchar "sovit").
+    """
+    patterns = [(re.compile(r"\b" + re.escape(k), re.IGNORECASE), w) for k, w in weights.items()]
+
+    def score(message):
+        return min(1.0, sum(w for p, w in patterns if p.search(message)))
+    return score
+
+
+def score_providers(message):
+    """[(poäng, provider)] för aktiverade källor, högst poäng först."""
+    cfg = get_config()
+    scored = []
+    for p in _providers.values():
+        try:
+            if not p.enabled(cfg): continue
+            scored.append((p.scorer(message), p))
+        except Exception as e:
+            print(f"[CONTEXT] {p.name} scorer fel: {e}")
+    return sorted(scored, key=lambda x: x[0], reverse=True)
+
+
+async def build_context(message, budget=DEFAULT_BUDGET, threshold=DEFAULT_THRESHOLD, with_sources=False):
+    """
+    Bygger REALTIDSDATA-blocket för ett meddelande. Källor under tröskeln
+    hämtas aldrig. Källor som inte hinner klart inom budgeten hoppas över
+    den här gången men fortsätter i bakgrunden och fyller cachen.
+    with_sources=True ger (text, [namn på källorna som ingår]).
+    """
+    if not _providers: register_default_providers()
+    relevant = [p for s, p in score_providers(message) if s >= threshold]
+    if not relevant: return ("", []) if with_sources else ""
+
+    pending = {p.name: p.fetch() for p in relevant if not p.fresh()}
+    trace = tracing.current()
+    if trace:
+        # Per källa i spårningen: från cache, klar efter x ms, eller ej klar inom budgeten
+        started = time.perf_counter()
+        report = {p.name: {"source": p.name, "cached": p.name not in pending} for p in relevant}
+        for name, fut in pending.items():
+            fut.add_done_callback(lambda f, n=name: report[n].setdefault("ms", round((time.perf_counter() - started) * 1000, 2)))
+    if pending:
+        await asyncio.wait(pending.values(), timeout=budget)
+
+    # En något för gammal text är bättre än ingen om uppdateringen inte hann klart
+    used = [p for p in relevant if p.cached_text]
+    text = "\n\n".join(p.cached_text for p in used)
+    if trace:
+        for p in relevant:
+            report[p.name].update(used=bool(p.cached_text), chars=len(p.cached_text or ""))
+            if p.name in pending and not pending[p.name].done(): report[p.name]["timed_out"] = True
+        trace.set(context_sources=list(report.values()), context_chars=len(text))
+    return (text, [p.name for p in used]) if with_sources else text
+
+
+# --- STANDARDKÄLLOR ---
+
+async def _garmin_context():
+    from app.services.garmin_service import get_garmin_service, format_trends
+    service = get_garmin_service()
+    d = await service.get_report()
+    if not d or "fel" in d: return ""
+    text = (
+        f"[HÄLSODATA FRÅN GARMIN IDAG]:\n"
+        f"   - 💤 Sömn: {d.get('sömn_timmar')} (poäng {d.get('sömn_poäng')}, djup {d.get('djup_sömn')}, REM {d.get('rem_sömn')})\n"
+        f"   - ❤️ Vilopuls: {d.get('vilopuls')} bpm | HRV: {d.get('hrv_status')}\n"
+        f"   - ⚡ Stressnivå: {d.get('stress_snitt')}/100\n"
+        f"   - 🔋 Body Battery: {d.get('body_battery_nu', 'N/A')} (högst {d.get('body_battery_högst')}, lägst {d.get('body_battery_lägst')})\n"
+        f"   - 👣 Steg: {d.get('steg')} av {d.get('mål_steg')}"
+    )
+    trend = format_trends(await service.get_trends_async(7))
+    if trend: text += f"\n[GARMIN SENASTE 7 DAGARNA]:\n{trend}"
+    return text + "\nINSTRUKTION: Analysera ovanstående data. Ge konkreta råd baserat på värdena."
+
+
+async def _strava_context():
+    from app.services.strava_sync import get_strava_sync, get_recent_activities, get_period_summary, format_summary
+    await get_strava_sync().ensure_synced()
+    activities = await asyncio.to_thread(get_recent_activities, 3)
+    if not activities: return ""
+    week = await asyncio.to_thread(get_period_summary, "week")
+    month = await asyncio.to_thread(get_period_summary, "month")
+    lines = "".join(
+        f"   - 📅 {a['datum']}: {a['typ']}\n"
+        f"     Distans: {a['distans']} | Tid: {a['tid']} | Tempo: {a['tempo']} | Ansträngning: {a['ansträngning']}\n"
+        for a in activities
+    )
+    return (f"[SENASTE TRÄNINGSPASS]:\n{lines}"
+            f"[DENNA VECKA]:\n{format_summary(week)}\n[DENNA MÅNAD]:\n{format_summary(month)}\n"
+            f"INSTRUKTION: Kommentera träningen kortfattat och uppmuntrande.")
+
+
+async def _withings_context():
+    from app.services.withings_service import get_withings_service, get_latest_report, get_trend, format_trend
+    await get_withings_service().ensure_synced()
+    w = await asyncio.to_thread(get_latest_report)
+    if not w: return ""
+    text = "[KROPPSDATA FRÅN WITHINGS]:\n" + "\n".join(f"   - {k}: {v}" for k, v in w.items())
+    trends = [format_trend(m, await asyncio.to_thread(get_trend, m, 8)) for m in ("vikt", "fett", "blodtryck_sys")]
+    trend_text = "\n".join(t for t in trends if t)
+    if trend_text: text += f"\n[TRENDER, VECKOSNITT]:\n{trend_text}"
+    return text
+
+
+async def _weather_context():
+    from app.tools.weather_core import get_weather
+    return f"[VÄDER]:\n{await get_weather(detail=True)}"
+
+
+async def _ha_context():
+    from app.tools.ha_core import get_ha_state
+    entities = [e.strip() for e in (get_config().get("HA_CONTEXT_ENTITIES") or "").split(",") if e.strip()]
+    if not entities: return ""
+    states = await asyncio.gather(*(get_ha_state(e) for e in entities))
+    return "[HEMMET JUST NU]:\n" + "\n".join(f"   - {s}" for s in states)
+
+
+async def _calendar_context():
+    from app.services.calendar_service import get_calendar_service, period_range, format_events
+    service = get_calendar_service()
+    await service.ensure_synced_async()
+    today = await asyncio.to_thread(service.events_between, *period_range("idag"))
+    week = await asyncio.to_thread(service.events_between, *period_range("veckan"))
+    later = [e for e in week if e not in today]
+    text = "[KALENDER IDAG]:\n" + ("\n".join(f"   - {l}" for l in format_events(today)) or "   - Inget inbokat.")
+    if later: text += "\n[RESTEN AV VECKAN]:\n" + "\n".join(f"   - {l}" for l in format_events(later, with_day=True))
+    return text
+
+
+def _has(*keys):
+    return lambda cfg: all(cfg.get(k) for k in keys)
+
+
+def register_default_providers():
+    register_provider("garmin", _garmin_context, ttl=300, enabled=_has("GARMIN_EMAIL", "GARMIN_PASSWORD"),
+                      scorer=keyword_scorer({"garmin": 1, "sömn": 1, "sov": 1, "puls": 0.6, "stress": 0.6, "mår jag": 1,
+                                             "body battery": 1, "hrv": 1, "återhämtning": 0.6, "kropp": 0.5, "energi": 0.5, "steg": 0.5}))
+    register_provider("strava", _strava_context, ttl=300, enabled=_has("STRAVA_CLIENT_ID", "STRAVA_REFRESH_TOKEN"),
+                      scorer=keyword_scorer({"strava": 1, "löp": 0.6, "spring": 0.6, "cykl": 0.6, "pass": 0.5,
+                                             "träning": 0.6, "tränat": 0.6, "aktivitet": 0.5, "tempo": 0.5, "km": 0.3}))
+    register_provider("withings", _withings_context, ttl=900, enabled=_has("WITHINGS_REFRESH_TOKEN"),
+                      scorer=keyword_scorer({"withings": 1, "vikt": 1, "väg": 0.6, "blodtryck": 1, "fett": 0.6,
+                                             "muskel": 0.6, "bmi": 1, "kilo": 0.5}))
+    register_provider("weather", _weather_context, ttl=600, enabled=_has("LATITUDE", "LONGITUDE"),
+                      scorer=keyword_scorer({"väder": 1, "vädr": 1, "regn": 1, "snö": 1, "temperatur": 0.5, "grader": 0.5,
+                                             "ute": 0.4, "kallt": 0.6, "varmt": 0.6, "vind": 0.6, "blås": 0.6, "paraply": 1, "jacka": 0.6}))
+    register_provider("calendar", _calendar_context, ttl=120, enabled=lambda cfg: os.path.exists(cfg.get("SERVICE_ACCOUNT_FILE") or ""),
+                      scorer=keyword_scorer({"kalender": 1, "möte": 1, "möten": 1, "inbokat": 1, "bokning": 1, "schema": 0.6,
+                                             "agenda": 1, "händer": 0.5, "upptagen": 0.6, "ledig": 0.5}))
+    register_provider("ha", _ha_context, ttl=30, enabled=_has("HA_BASE_URL", "HA_TOKEN", "HA_CONTEXT_ENTITIES"),
+                      scorer=keyword_scorer({"hemma": 0.6, "huset": 0.6, "lampa": 0.6, "lampor": 0.6, "inne": 0.5,
+                                             "sensor": 0.6, "dammsugar": 0.6, "status": 0.5}))
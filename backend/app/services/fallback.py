@@ -0,0 +1,270 @@
+"""
+==============================================================================
+FILE: app/services/fallback.py
+DESCRIPTION: Reservmodeller utan att vänta ut timeouts. Nästa leverantör
+             startas parallellt om den föregående inte gett en användbar token
+             inom sitt försprång (hedged requests). Första användbara token
+             vinner och övriga avbryts. Varje leverantör har en circuit breaker
+             baserad på felfrekvens och latens de senaste anropen.
+==============================================================================
+"""
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+
+
+class AllProvidersFailed(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Öppnar (hoppar över leverantören) när felandelen eller medianlatensen de
+    senaste `window` anropen är för hög. Efter `cooldown` sekunder släpps ett
+    provanrop igenom (halvöppen), lyckas det stängs brytaren igen.
+    """
+    def __init__(self, window=20, min_calls=4, max_error_rate=0.5, max_latency=None, cooldown=30.0):
+        self.window = deque(maxlen=window)   # (ok, latens)
+        self.min_calls = min_calls
+        self.max_error_rate = max_error_rate
+        self.max_latency = max_latency
+        self.cooldown = cooldown
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    def _should_open(self):
+        if len(self.window) < self.min_calls: return False
+        if self.error_rate() > self.max_error_rate: return True
+        if self.max_latency is not None:
+            latencies = sorted(l for ok, l in self.window if ok)
+            if latencies and latencies[len(latencies) // 2] > self.max_latency: return True
+        return False
+
+    def error_rate(self):
+        if not self.window: return 0.0
+        return sum(1 for ok, _ in self.window if not ok) / len(self.window)
+
+    @property
+    def state(self):
+        if self.opened_at is None: return "closed"
+        return "half_open" if time.time() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        """Får leverantören provas nu? (Reserverar inget, se begin.)"""
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self.trial_running)
+
+    def begin(self):
+        """Anropas när ett anrop faktiskt startar. I halvöppet läge blir det provanropet."""
+        with self._lock:
+            if self.state == "half_open":
+                self.trial_running = True
+
+    def release(self):
+        """Anropet avbröts innan det gav ett utfall (förloraren i ett lopp). Provanropet släpps utan att räknas."""
+        with self._lock:
+            self.trial_running = False
+
+    def record(self, ok, latency=0.0):
+        with self._lock:
+            self.window.append((ok, latency))
+            if self.opened_at is not None:
+                self.trial_running = False
+                if ok:
+                    # Provanropet lyckades: börja om med ren historik
+                    self.opened_at = None
+                    self.window.clear()
+                else:
+                    self.opened_at = time.time()
+            elif self._should_open():
+                self.opened_at = time.time()
+                print(f"[FALLBACK] Circuit breaker öppnad (fel {self.error_rate():.0%})")
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name, **kwargs):
+    """Delad brytare per leverantör/modell, så alla anropsställen lär sig av varandra."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(**kwargs)
+        return _breakers[name]
+
+
+def breaker_states():
+    return {name: {"state": b.state, "error_rate": round(b.error_rate(), 2)} for name, b in _breakers.items()}
+
+
+def default_is_useful(chunk):
+    """Tomma bitar och DAA:s egna felsträngar räknas inte som ett svar."""
+    return bool(chunk) and bool(str(chunk).strip()) and not str(chunk).startswith("⚠️")
+
+
+class FallbackPolicy:
+    """
+    providers: leverantörer i prioritetsordning.
+    head_start: sekunder innan nästa leverantör startas parallellt. None: nästa
+                startas först när den föregående misslyckats (ingen hedging).
+    max_parallel: hur många som får köra samtidigt.
+    """
+    def __init__(self, providers, head_start=3.0, max_parallel=2, is_useful=None, breaker_options=None):
+        self.providers = [p for i, p in enumerate(providers) if p and p not in providers[:i]]
+        self.head_start = head_start
+        self.max_parallel = max(1, max_parallel)
+        self.is_useful = is_useful or default_is_useful
+        self.breaker_options = breaker_options or {}
+
+    def _breaker(self, name):
+        return get_breaker(name, **self.breaker_options)
+
+    def candidates(self):
+        """Leverantörer vars brytare släpper igenom. Är alla öppna provas alla ändå."""
+        allowed = [p for p in self.providers if self._breaker(p).allow()]
+        return allowed or list(self.providers)
+
+    # --- ASYNC STRÖMMAR ---
+
+    async def stream(self, factory, hedge_factory=None):
+        """
+        factory(provider) -> async iterator med textbitar.
+        hedge_factory: används i stället för leverantörer som startas medan en
+        annan fortfarande kör (t.ex. utan verktyg, förloraren kan inte ångra
+        det den redan gjort).
+        Ger (provider, bit) för vinnaren. Kastar AllProvidersFailed om ingen lyckas.
+        """
+        queue = asyncio.Queue()
+        waiting = list(self.candidates())
+        running = {}
+        started = {}
+        errors = []
+        last_launch = [0.0]
+
+        async def pump(name, make):
+            try:
+                async for chunk in make(name):
+                    await queue.put(("chunk", name, chunk))
+                await queue.put(("done", name, None))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await queue.put(("error", name, e))
+
+        def launch():
+            name = waiting.pop(0)
+            self._breaker(name).begin()
+            started[name] = last_launch[0] = time.time()
+            make = hedge_factory if hedge_factory and running else factory
+            running[name] = asyncio.ensure_future(pump(name, make))
+
+        def fail(name, error):
+            running.pop(name, None)
+            self._breaker(name).record(False, time.time() - started[name])
+            errors.append(f"{name}: {error}")
+
+        launch()
+        winner = None
+        try:
+            # Fas 1: vänta på första användbara token, starta reserver efter försprånget
+            while winner is None:
+                if not running and not waiting:
+                    raise AllProvidersFailed("; ".join(errors) or "Inga leverantörer")
+                if not running:
+                    launch()
+                    continue
+                timeout = None
+                if waiting and len(running) < self.max_parallel and self.head_start is not None:
+                    timeout = max(0.0, last_launch[0] + self.head_start - time.time())
+                try:
+                    kind, name, payload = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    print(f"[FALLBACK] Inget svar inom {self.head_start}s, startar även {waiting[0]}")
+                    launch()
+                    continue
+                if name not in running: continue
+                if kind == "chunk" and self.is_useful(payload):
+                    winner = name
+                    self._breaker(name).record(True, time.time() - started[name])
+                    for other, task in list(running.items()):
+                        if other != name:
+                            task.cancel()
+                            running.pop(other)
+                            self._breaker(other).release()
+                    yield name, payload
+                elif kind == "done":
+                    fail(name, "tomt svar")
+                elif kind == "error":
+                    fail(name, payload)
+
+            # Fas 2: strömma resten från vinnaren
+            while True:
+                kind, name, payload = await queue.get()
+                if name != winner: continue
+                if kind == "chunk": yield name, payload
+                elif kind == "done": break
+                else: raise payload
+        finally:
+            for name, task in running.items():
+                task.cancel()
+                if name != winner: self._breaker(name).release()
+
+    # --- SYNKRONA ANROP (trådar) ---
+
+    def call(self, fn):
+        """
+        fn(provider) -> resultat, körs i trådar med samma försprång.
+        Förlorare kan inte avbrytas mitt i, men deras resultat ignoreras.
+        """
+        waiting = list(self.candidates())
+        errors = []
+        pool = ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix="fallback")
+        running = {}
+        try:
+            def launch():
+                name = waiting.pop(0)
+                self._breaker(name).begin()
+                running[pool.submit(fn, name)] = (name, time.time())
+
+            launch()
+            while running or waiting:
+                if not running:
+                    launch()
+                    continue
+                hedge = waiting and len(running) < self.max_parallel and self.head_start is not None
+                timeout = self.head_start if hedge else None
+                done, _ = wait_futures(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    launch()
+                    continue
+                for fut in done:
+                    name, t0 = running.pop(fut)
+                    try:
+                        result = fut.result()
+                    except Exception as e:
+                        self._breaker(name).record(False, time.time() - t0)
+                        errors.append(f"{name}: {e}")
+                        continue
+                    if not self.is_useful(result):
+                        self._breaker(name).record(False, time.time() - t0)
+                        errors.append(f"{name}: tomt svar")
+                        continue
+                    self._breaker(name).record(True, time.time() - t0)
+                    return name, result
+            raise AllProvidersFailed("; ".join(errors) or "Inga leverantörer")
+        finally:
+            # Förlorare som fortfarande kör räknas när de är klara, avbrutna släpper sitt provanrop
+            for fut, (name, t0) in running.items():
+                fut.add_done_callback(lambda f, name=name, t0=t0: self._record_late(name, t0, f))
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _record_late(self, name, t0, fut):
+        if fut.cancelled():
+            self._breaker(name).release()
+            return
+        try: ok = self.is_useful(fut.result())
+        except Exception: ok = False
+        self._breaker(name).record(ok, time.time() - t0)
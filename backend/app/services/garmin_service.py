@@ -0,0 +1,178 @@
+"""
+==============================================================================
+FILE: app/services/garmin_service.py
+DESCRIPTION: Cachad Garmin-tjänst. Rådata per dag och metric sparas i SQLite.
+             Passerade dagar är oföränderliga och hämtas aldrig igen, dagens
+             data förnyas i bakgrunden när den blivit gammal. En endpoint som
+             svarar utan data för en passerad dag (t.ex. HRV på en klocka utan
+             HRV) sparas som null och räknas också som slutgiltig. Ett anrop
+             som misslyckas (rate limit, 5xx, timeout) sparas inte, dagen
+             hämtas igen nästa gång.
+==============================================================================
+"""
+import json
+import time
+import asyncio
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.core.database import get_db_connection
+from app.tools.garmin_core import GarminCoach, ENDPOINTS, build_health_report
+
+# Hur länge dagens data räknas som färsk (sekunder)
+TODAY_TTL = 900
+# Dagar som hämtas samtidigt i get_trends (var och en anropar alla ENDPOINTS)
+TRENDS_PARALLEL_DAYS = 4
+
+_schema_ready = False
+
+
+def _ensure_schema():
+    global _schema_ready
+    if _schema_ready: return
+    with get_db_connection() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS garmin_cache (
+            date TEXT, metric TEXT, payload TEXT, fetched_at REAL,
+            PRIMARY KEY (date, metric))''')
+        conn.commit()
+    _schema_ready = True
+
+
+def _end_of_day(date_str):
+    day = datetime.date.fromisoformat(date_str) + datetime.timedelta(days=1)
+    return datetime.datetime.combine(day, datetime.time.min).timestamp()
+
+
+class GarminService:
+    def __init__(self):
+        self._coach = None
+        self._coach_lock = threading.Lock()
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+
+    # --- KLIENT ---
+
+    def _get_coach(self):
+        """Loggar in först när data faktiskt behövs (inloggningen är långsam)."""
+        with self._coach_lock:
+            if self._coach is None:
+                self._coach = GarminCoach()
+            elif not self._coach.client and self._coach.email:
+                self._coach._login()
+            return self._coach if self._coach.client else None
+
+    # --- CACHE ---
+
+    def _load(self, date_str):
+        _ensure_schema()
+        with get_db_connection() as conn:
+            rows = conn.execute("SELECT metric, payload, fetched_at FROM garmin_cache WHERE date = ?", (date_str,)).fetchall()
+        return {r["metric"]: (json.loads(r["payload"]), r["fetched_at"]) for r in rows}
+
+    def _store(self, date_str, raw):
+        now = time.time()
+        rows = [(date_str, metric, json.dumps(payload), now) for metric, payload in raw.items()]
+        if not rows: return
+        with get_db_connection() as conn:
+            conn.executemany("INSERT OR REPLACE INTO garmin_cache (date, metric, payload, fetched_at) VALUES (?, ?, ?, ?)", rows)
+            conn.commit()
+
+    def _fetch_and_store(self, date_str):
+        coach = self._get_coach()
+        if not coach: return None
+        print(f">> [GARMIN] Hämtar data för: {date_str}")
+        # Bara lyckade anrop finns i raw (ett tomt svar är None = slutgiltigt för en
+        # passerad dag). Misslyckade saknas och hämtas igen nästa gång.
+        raw = coach.fetch_day(date_str)
+        self._store(date_str, raw)
+        return raw
+
+    def _refresh_in_background(self, date_str):
+        with self._refresh_lock:
+            if date_str in self._refreshing: return
+            self._refreshing.add(date_str)
+
+        def worker():
+            try: self._fetch_and_store(date_str)
+            except Exception as e: print(f">> [GARMIN] Bakgrundsuppdatering misslyckades: {e}")
+            finally:
+                with self._refresh_lock: self._refreshing.discard(date_str)
+
+        threading.Thread(target=worker, name="garmin-refresh", daemon=True).start()
+
+    def get_day_raw(self, date_str, wait_for_fresh=False):
+        """
+        Returnerar rådata för ett datum.
+        - Passerad dag som hämtats efter dygnets slut: alltid från cache.
+        - Idag: från cache om den är färsk, annars cache + bakgrundsuppdatering.
+        - Saknas data helt hämtas den direkt.
+        """
+        cached = self._load(date_str)
+        # null i cachen: endpointen svarade utan data för dagen (se _fetch_and_store)
+        values = {m: payload for m, (payload, _) in cached.items() if payload is not None}
+        complete = all(m in cached for m in ENDPOINTS)
+        if complete:
+            oldest = min(fetched for _, fetched in cached.values())
+            if oldest >= _end_of_day(date_str):
+                return values
+            if date_str == datetime.date.today().isoformat():
+                if time.time() - oldest < TODAY_TTL:
+                    return values
+                if not wait_for_fresh:
+                    self._refresh_in_background(date_str)
+                    return values
+
+        raw = self._fetch_and_store(date_str)
+        if raw is None:
+            return values if cached else None
+        # Behåll äldre cachevärden för endpoints som inte svarade nu
+        for metric, payload in values.items():
+            raw.setdefault(metric, payload)
+        return raw
+
+    # --- PUBLIKT API ---
+
+    def get_health_report(self, date_str=None):
+        date_str = date_str or datetime.date.today().isoformat()
+        raw = self.get_day_raw(date_str)
+        if raw is None: return {"fel": "Ej inloggad på Garmin."}
+        return build_health_report(date_str, raw)
+
+    async def get_report(self, date_str=None):
+        """Async variant av get_health_report (körs i tråd)."""
+        return await asyncio.to_thread(self.get_health_report, date_str)
+
+    def get_trends(self, days=7):
+        """Rapport per dag för de senaste `days` dagarna. Historik hämtas bara en gång, saknade dagar parallellt."""
+        today = datetime.date.today()
+        dates = [(today - datetime.timedelta(days=offset)).isoformat() for offset in range(days - 1, -1, -1)]
+        if not dates: return []
+        with ThreadPoolExecutor(max_workers=min(TRENDS_PARALLEL_DAYS, len(dates)), thread_name_prefix="garmin-days") as pool:
+            reports = list(pool.map(self.get_health_report, dates))
+        return [r for r in reports if "fel" not in r]
+
+    async def get_trends_async(self, days=7):
+        return await asyncio.to_thread(self.get_trends, days)
+
+
+def format_trends(reports):
+    """Kompakt textrad per dag för system-prompten."""
+    lines = []
+    for r in reports:
+        lines.append(
+            f"   - {r['datum']}: Sömn {r.get('sömn_timmar')} (poäng {r.get('sömn_poäng')}), "
+            f"vilopuls {r.get('vilopuls')}, stress {r.get('stress_snitt')}, "
+            f"Body Battery max {r.get('body_battery_högst')}, steg {r.get('steg')}"
+        )
+    return "\n".join(lines)
+
+
+_service = None
+
+
+def get_garmin_service():
+    """Delad instans så att server.py och api.py använder samma cache."""
+    global _service
+    if _service is None:
+        _service = GarminService()
+    return _service
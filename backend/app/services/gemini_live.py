@@ -1,5 +1,6 @@
 import asyncio
 import os
+import time
 import sys
 import pyaudio
 import traceback
@@ -12,7 +13,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(
 
 # --- IMPORTERA DYNAMISKA TEXTER ---
 # Vi hämtar prompt-funktionen och verktygsbeskrivningen (som i sin tur hämtar från DB)
-from app.core.prompts import get_system_prompt, ANALYZE_CODE_TOOL_DESC
+from app.core.prompts import get_system_prompt, get_audit_tool_desc
+from app.utils.metrics import span, observe
 
 # --- IMPORTERA VERKTYG ---
 try:
@@ -22,7 +24,13 @@ except ImportError:
     weather_available = False
 
 try:
-    from app.tools.code_auditor import run_code_audit
+    from app.tools.ha_core import control_entities
+    ha_available = True
+except ImportError:
+    ha_available = False
+
+try:
+    from app.services.job_queue import get_job_queue
     audit_available = True
 except ImportError:
     audit_available = False
@@ -48,18 +56,41 @@ funcs = []
 if weather_available:
     funcs.append(types.FunctionDeclaration(
         name="get_weather", 
-        description="Hämtar väderprognos för aktuell plats."
+        description="Hämtar väder just nu, timprognos, regnrisk ikväll/inatt och de kommande dagarna för aktuell plats."
+    ))
+
+if ha_available:
+    funcs.append(types.FunctionDeclaration(
+        name="control_entities",
+        description="Styr flera Home Assistant-enheter eller hela områden samtidigt i ett anrop (t.ex. släck alla lampor på nedervåningen).",
+        parameters=types.Schema(
+            type="OBJECT",
+            properties={
+                "action": types.Schema(type="STRING", description="on/off/toggle för lampor och brytare, start/stop/pause/dock för dammsugare."),
+                "entity_ids": types.Schema(type="ARRAY", items=types.Schema(type="STRING"), description="Lista med entity_id, t.ex. light.kok."),
+                "area_ids": types.Schema(type="ARRAY", items=types.Schema(type="STRING"), description="Home Assistant-områden (area_id)."),
+                "domain": types.Schema(type="STRING", description="Enhetstyp för områden, t.ex. light."),
+            },
+            required=["action"],
+        ),
     ))
 
 if audit_available:
     funcs.append(types.FunctionDeclaration(
         name="analyze_code", 
-        description=ANALYZE_CODE_TOOL_DESC  # <-- Hämtas dynamiskt från DB/Prompts
+        description=get_audit_tool_desc()  # <-- Hämtas dynamiskt från DB/Prompts
     ))
 
 my_tools = [types.Tool(function_declarations=funcs)] if funcs else []
 
-pya = pyaudio.PyAudio()
+# PyAudio-instansen skapas först när mikrofonen öppnas
+_pya = None
+
+def get_pyaudio():
+    global _pya
+    if _pya is None:
+        _pya = pyaudio.PyAudio()
+    return _pya
 
 class AudioLoop:
     def __init__(self, api_key, on_audio_data=None, on_transcription=None, on_status=None, on_error=None, on_turn_complete=None, input_device_index=None):
@@ -87,6 +118,7 @@ class AudioLoop:
 
     async def listen_audio(self):
         try:
+            pya = get_pyaudio()
             mic_info = pya.get_default_input_device_info()
             print(f"[DAA] Mic: {mic_info['name']}")
             
@@ -112,6 +144,7 @@ class AudioLoop:
 
     async def receive_audio(self):
         print("[DAA] Lyssnar (Text-mode)...")
+        turn_start = None
         try:
             while not self.stop_event.is_set():
                 if not self.session: 
@@ -119,6 +152,7 @@ class AudioLoop:
                     continue
                     
                 async for response in self.session.receive():
+                    if turn_start is None: turn_start = time.perf_counter()
                     
                     # --- HANTERA VERKTYG ---
                     if tool_call := response.tool_call:
@@ -128,7 +162,8 @@ class AudioLoop:
                             if fc.name == "get_weather":
                                 print("[DAA] Verktyg: Hämtar väder...")
                                 try: 
-                                    w = await get_weather()
+                                    with span("live_tool", tool="get_weather"):
+                                        w = await get_weather(detail=True)
                                 except Exception as e: 
                                     w = f"Kunde inte hämta väder: {e}"
                                     
@@ -136,17 +171,36 @@ class AudioLoop:
                                     function_responses=[types.FunctionResponse(name="get_weather", id=fc.id, response={"result": w})]
                                 )
                             
-                            # 2. KODANALYS
+                            # 2. HEMSTYRNING (flera enheter i ett anrop)
+                            elif fc.name == "control_entities":
+                                args = dict(fc.args or {})
+                                print(f"[DAA] Verktyg: Styr enheter {args}")
+                                try:
+                                    with span("live_tool", tool="control_entities"):
+                                        res = await control_entities(
+                                            args.get("action", ""), args.get("entity_ids"),
+                                            args.get("area_ids"), args.get("domain") or "light")
+                                except Exception as e:
+                                    res = f"Kunde inte styra enheterna: {e}"
+
+                                await self.session.send_tool_response(
+                                    function_responses=[types.FunctionResponse(name="control_entities", id=fc.id, response={"result": res})]
+                                )
+
+                            # 3. KODANALYS
                             elif fc.name == "analyze_code":
                                 print("[DAA] Verktyg: Analyserar kod...")
                                 if self.on_status: self.on_status("Analyserar kod...")
                                 
-                                # Kör i tråd för att inte blockera ljudströmmen
+                                # Körs som bakgrundsjobb, resultatet publiceras när det är klart.
+                                # submit skriver i SQLite, därför i en tråd (inte i event-loopen)
                                 try:
-                                    res = await asyncio.to_thread(run_code_audit)
+                                    job_id, existing = await asyncio.to_thread(get_job_queue().submit, "analyze_code")
+                                    res = (f"Kodanalysen pågår redan (jobb #{job_id})." if existing
+                                           else f"Kodanalysen har startats i bakgrunden (jobb #{job_id}).")
                                 except Exception as e:
                                     res = f"Analysfel: {e}"
-                                    
+
                                 await self.session.send_tool_response(
                                     function_responses=[types.FunctionResponse(name="analyze_code", id=fc.id, response={"result": res})]
                                 )
@@ -160,6 +214,8 @@ class AudioLoop:
                                     if self.on_transcription: self.on_transcription(part.text)
                         
                         if server_content.turn_complete:
+                            observe("live_turn_seconds", time.perf_counter() - turn_start)
+                            turn_start = None
                             if self.on_turn_complete: self.on_turn_complete()
                             
                 await asyncio.sleep(0.01)
@@ -196,7 +252,9 @@ class AudioLoop:
                     async def send_from_queue():
                         while not self.stop_event.is_set():
                             msg = await self.out_queue.get()
-                            try: await session.send_realtime_input(data=msg["data"], mime_type=msg["mime_type"])
+                            try:
+                                with span("live_send"):
+                                    await session.send_realtime_input(data=msg["data"], mime_type=msg["mime_type"])
                             except: pass
                             
                     tg.create_task(send_from_queue())
@@ -0,0 +1,397 @@
+"""
+==============================================================================
+FILE: app/services/history_archive.py
+DESCRIPTION: Gallring och arkivering av history. Meddelanden äldre än
+             HISTORY_RETENTION_DAYS (standard 90, 0 = av) flyttas till
+             komprimerade månadsfiler (logs/archive/history-ÅÅÅÅ-MM.jsonl.zst,
+             .gz om zstandard saknas) och varje samtal (session + dag)
+             ersätts av en sammanfattning från modellen i history_summaries.
+             Därefter frigörs utrymmet med incremental_vacuum.
+
+             Körs som bakgrundsjobbet "archive_history" (job_queue), en gång
+             per dygn via ArchiveScheduler. search_history söker i tabellen,
+             sammanfattningarna och arkivfilerna.
+==============================================================================
+"""
+import os
+import gzip
+import json
+import time
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+import app.core.database as database
+from app.core.database import get_db_connection
+from config.settings import get_config, gemini_options
+from app.services.fallback import FallbackPolicy, AllProvidersFailed
+from app.utils.metrics import timed
+
+DEFAULT_RETENTION_DAYS = 90
+# Rader per omgång (en omgång = en skrivning per månadsfil + en transaktion)
+BATCH_ROWS = 2000
+# Högst så många modellsammanfattningar per körning, resten tas nästa gång
+MAX_SUMMARIES_PER_RUN = 50
+# Samtal med färre meddelanden sammanfattas utan modell
+MIN_MESSAGES_FOR_MODEL = 4
+SUMMARY_MODELS = ['gemini-2.0-flash-exp', 'gpt-4o']
+SUMMARY_HEAD_START = 20.0
+# Transkriptet till modellen kortas av (tecken)
+SUMMARY_MAX_CHARS = 12000
+# Schemat: första körningen efter start, sedan en gång per dygn
+FIRST_RUN_DELAY = 300
+RUN_INTERVAL = 24 * 3600
+
+_schema_lock = threading.Lock()
+_schema_path = None
+_run_lock = threading.Lock()
+
+
+def _ensure_schema():
+    global _schema_path
+    with _schema_lock:
+        if _schema_path == database.DB_PATH: return
+        with get_db_connection() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS history_summaries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, day TEXT, first_id INTEGER, last_id INTEGER,
+                messages INTEGER, summary TEXT, model TEXT, created_at REAL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_summaries_day ON history_summaries (day)')
+            conn.execute('''CREATE TABLE IF NOT EXISTS archive_segments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, month TEXT, file TEXT, first_id INTEGER, last_id INTEGER,
+                rows INTEGER, raw_bytes INTEGER, stored_bytes INTEGER, created_at REAL)''')
+            conn.commit()
+        _schema_path = database.DB_PATH
+
+
+def archive_dir():
+    """Bredvid databasen (logs/archive), så att en tillfällig DB får ett eget arkiv."""
+    return os.path.join(os.path.dirname(database.DB_PATH), "archive")
+
+
+# --- KOMPRIMERING ---
+# Varje körning lägger till en ny ram (zstd) eller medlem (gzip) i månadsfilen.
+# Båda formaten tillåter sammanslagna ramar, så filen läses i ett svep.
+
+def _zstd():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+
+def _compress(data):
+    zstd = _zstd()
+    if zstd: return "zst", zstd.ZstdCompressor(level=10).compress(data)
+    return "gz", gzip.compress(data, compresslevel=9)
+
+
+def _read_segment(path):
+    with open(path, "rb") as f:
+        if path.endswith(".gz"):
+            return gzip.decompress(f.read())
+        zstd = _zstd()
+        if not zstd:
+            print(f"[ARCHIVE] {os.path.basename(path)} kräver zstandard (pip install zstandard)")
+            return b""
+        with zstd.ZstdDecompressor().stream_reader(f, read_across_frames=True) as reader:
+            return reader.read()
+
+
+def _segment_files():
+    """{månad: [filer]}"""
+    files = {}
+    try: names = os.listdir(archive_dir())
+    except FileNotFoundError: return files
+    for name in sorted(names):
+        if name.startswith("history-") and name.endswith((".jsonl.zst", ".jsonl.gz")):
+            files.setdefault(name[8:15], []).append(os.path.join(archive_dir(), name))
+    return files
+
+
+def iter_archive(month=None):
+    """Arkiverade meddelanden (dict), nyaste månaden först. Dubbletter (avbruten körning) hoppas över."""
+    files = _segment_files()
+    for m in sorted(files, reverse=True):
+        if month and m != month: continue
+        seen = set()
+        rows = []
+        for path in files[m]:
+            for line in _read_segment(path).splitlines():
+                try: row = json.loads(line)
+                except ValueError: continue
+                if row.get("id") in seen: continue
+                seen.add(row.get("id"))
+                rows.append(row)
+        yield from sorted(rows, key=lambda r: r.get("id") or 0, reverse=True)
+
+
+# --- SAMMANFATTNING ---
+
+def _transcript(rows):
+    lines = [f"{'Anders' if r['role'] == 'user' else 'DAA'}: {r['content'] or ''}" for r in rows]
+    text = "\n".join(lines)
+    if len(text) > SUMMARY_MAX_CHARS:
+        half = SUMMARY_MAX_CHARS // 2
+        text = text[:half] + "\n[...]\n" + text[-half:]
+    return text
+
+
+def _extractive_summary(rows):
+    """Utan modell: antal meddelanden och början av användarens frågor."""
+    questions = [(r["content"] or "").strip().replace("\n", " ")[:80] for r in rows if r["role"] == "user" and r["content"]]
+    text = f"{len(rows)} meddelanden."
+    if questions: text += " Frågor: " + " | ".join(questions[:5])
+    return text
+
+
+def _call_summary_model(model_name, prompt, cfg):
+    from app.core.prompts import get_summary_prompt
+    system_prompt = get_summary_prompt()
+    if "gemini" in model_name.lower() and cfg.get("GOOGLE_API_KEY"):
+        import google.generativeai as genai
+        genai.configure(**gemini_options(cfg))
+        return genai.GenerativeModel(model_name, system_instruction=system_prompt).generate_content(prompt).text
+    if "gpt" in model_name.lower() and cfg.get("OPENAI_API_KEY"):
+        from openai import OpenAI
+        client = OpenAI(api_key=cfg["OPENAI_API_KEY"], base_url=cfg.get("OPENAI_BASE_URL") or None)
+        res = client.chat.completions.create(model=model_name, messages=[
+            {"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}])
+        return res.choices[0].message.content
+    raise RuntimeError(f"Ingen API-nyckel för {model_name}")
+
+
+def make_summarizer(models=None):
+    """summarize(rows) -> (text, modell). Faller tillbaka på en enkel sammanfattning om alla modeller fallerar."""
+    cfg = get_config()
+    policy = FallbackPolicy(models or SUMMARY_MODELS, head_start=SUMMARY_HEAD_START)
+
+    def summarize(rows):
+        if len(rows) < MIN_MESSAGES_FOR_MODEL:
+            return _extractive_summary(rows), None
+        try:
+            model, text = policy.call(lambda m: _call_summary_model(m, _transcript(rows), cfg))
+            if text and text.strip(): return text.strip(), model
+        except AllProvidersFailed as e:
+            print(f"[ARCHIVE] Sammanfattning utan modell: {e}")
+        return _extractive_summary(rows), None
+    return summarize
+
+
+# --- ARKIVERING ---
+
+def _retention_days(cfg):
+    try: return int(cfg.get("HISTORY_RETENTION_DAYS") or DEFAULT_RETENTION_DAYS)
+    except (TypeError, ValueError): return DEFAULT_RETENTION_DAYS
+
+
+def _conversations(rows, complete):
+    """Delar raderna (id-ordning) i samtal: samma session och dag. Sista samtalet kan fortsätta i nästa omgång."""
+    groups = {}
+    for r in rows:
+        groups.setdefault((r["session_id"], (r["timestamp"] or "")[:10]), []).append(r)
+    convs = list(groups.values())
+    if not complete and len(convs) > 1:
+        last_day = (rows[-1]["timestamp"] or "")[:10]
+        convs = [c for c in convs if (c[0]["timestamp"] or "")[:10] != last_day] or convs
+    return convs
+
+
+def _write_segments(rows):
+    """Lägger raderna i månadsfilerna. Returnerar segmentposter till archive_segments."""
+    os.makedirs(archive_dir(), exist_ok=True)
+    by_month = {}
+    for r in rows:
+        by_month.setdefault((r["timestamp"] or "0000-00")[:7], []).append(r)
+    segments = []
+    for month, items in by_month.items():
+        raw = "".join(json.dumps(dict(r), ensure_ascii=False, separators=(",", ":")) + "\n" for r in items).encode("utf-8")
+        ext, data = _compress(raw)
+        path = os.path.join(archive_dir(), f"history-{month}.jsonl.{ext}")
+        with open(path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        segments.append((month, os.path.basename(path), items[0]["id"], items[-1]["id"], len(items), len(raw), len(data), time.time()))
+    return segments
+
+
+def _vacuum():
+    """
+    Frigör utrymmet. Databaser skapade före incremental auto_vacuum görs om
+    med en full VACUUM en gång, därefter räcker incremental_vacuum.
+    """
+    with get_db_connection() as conn:
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        before = conn.execute("PRAGMA page_count").fetchone()[0]
+        if mode != 2:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        else:
+            # Via execute frigörs bara en sida, executescript kör pragman till slut
+            conn.executescript("PRAGMA incremental_vacuum;")
+        conn.commit()
+        after = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return max(0, before - after) * page_size
+
+
+@timed("tool")
+def archive_history(retention_days=None, summarizer=None, progress=None, now=None, max_summaries=MAX_SUMMARIES_PER_RUN):
+    """
+    Arkiverar allt äldre än retention_days. Returnerar statistik (dict).
+    Filerna skrivs (fsync) innan raderna tas bort i samma transaktion som
+    sammanfattningarna sparas, så att inget försvinner om körningen avbryts.
+    """
+    cfg = get_config()
+    days = _retention_days(cfg) if retention_days is None else retention_days
+    stats = {"archived": 0, "conversations": 0, "model_summaries": 0, "files": set(), "freed_bytes": 0}
+    if days <= 0:
+        return {**stats, "files": [], "disabled": True}
+    if not _run_lock.acquire(blocking=False):
+        return {**stats, "files": [], "busy": True}
+    try:
+        _ensure_schema()
+        cutoff = ((now or datetime.now(timezone.utc)) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+        with get_db_connection() as conn:
+            total = conn.execute("SELECT COUNT(*) FROM history WHERE timestamp < ?", (cutoff,)).fetchone()[0]
+        summarize = summarizer or make_summarizer()
+        last_id = 0
+        while stats["model_summaries"] < max_summaries:
+            with get_db_connection() as conn:
+                rows = [dict(r) for r in conn.execute(
+                    "SELECT id, session_id, role, content, image, timestamp FROM history WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, BATCH_ROWS)).fetchall()]
+            old = []
+            for r in rows:
+                # id följer tiden: första nyare raden avslutar arkiveringen
+                if not r["timestamp"] or r["timestamp"] >= cutoff: break
+                old.append(r)
+            if not old: break
+            complete = len(old) < len(rows) or len(rows) < BATCH_ROWS
+            summaries, done = [], []
+            for conv in _conversations(old, complete):
+                text, model = summarize(conv)
+                if model: stats["model_summaries"] += 1
+                summaries.append((conv[0]["session_id"], (conv[0]["timestamp"] or "")[:10], conv[0]["id"], conv[-1]["id"],
+                                  len(conv), text, model, time.time()))
+                done.extend(conv)
+                if stats["model_summaries"] >= max_summaries: break
+            capped = stats["model_summaries"] >= max_summaries
+            done.sort(key=lambda r: r["id"])
+            segments = _write_segments(done)
+            with get_db_connection() as conn:
+                conn.executemany('''INSERT INTO history_summaries (session_id, day, first_id, last_id, messages, summary, model, created_at)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', summaries)
+                conn.executemany('''INSERT INTO archive_segments (month, file, first_id, last_id, rows, raw_bytes, stored_bytes, created_at)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', segments)
+                conn.executemany("DELETE FROM history WHERE id = ?", [(r["id"],) for r in done])
+                conn.commit()
+            last_id = done[-1]["id"]
+            stats["archived"] += len(done)
+            stats["conversations"] += len(summaries)
+            stats["files"].update(s[1] for s in segments)
+            if progress: progress(stats["archived"] / max(total, 1), f"Arkiverat {stats['archived']}/{total} meddelanden")
+            if capped or complete: break
+        if stats["archived"]:
+            stats["freed_bytes"] = _vacuum()
+        stats["remaining"] = max(0, total - stats["archived"])
+        stats["files"] = sorted(stats["files"])
+        return stats
+    finally:
+        _run_lock.release()
+
+
+def format_result(stats):
+    if stats.get("disabled"): return "Arkivering av historiken är avstängd (HISTORY_RETENTION_DAYS = 0)."
+    if stats.get("busy"): return "Arkiveringen körs redan."
+    if not stats["archived"]: return "Inga meddelanden att arkivera."
+    text = (f"Arkiverade {stats['archived']} meddelanden ({stats['conversations']} samtal sammanfattade) "
+            f"till {len(stats['files'])} filer, {round(stats['freed_bytes'] / 1048576, 1)} MB frigjort.")
+    if stats.get("remaining"): text += f" {stats['remaining']} återstår till nästa körning."
+    return text
+
+
+def archive_stats():
+    """Status för /api/history/archive."""
+    _ensure_schema()
+    with get_db_connection() as conn:
+        live = conn.execute("SELECT COUNT(*), MIN(timestamp) FROM history").fetchone()
+        summaries = conn.execute("SELECT COUNT(*) FROM history_summaries").fetchone()[0]
+        seg = conn.execute("SELECT COUNT(*), COALESCE(SUM(rows), 0), COALESCE(SUM(raw_bytes), 0), COALESCE(SUM(stored_bytes), 0), MAX(created_at) FROM archive_segments").fetchone()
+        pragma = {k: conn.execute(f"PRAGMA {k}").fetchone()[0] for k in ("auto_vacuum", "page_count", "freelist_count", "page_size")}
+    return {
+        "retention_days": _retention_days(get_config()),
+        "history_rows": live[0], "oldest": live[1],
+        "summaries": summaries,
+        "archived_rows": seg[1], "archive_files": sum(len(f) for f in _segment_files().values()),
+        "archive_mb": round(seg[3] / 1048576, 2), "compression": round(seg[2] / seg[3], 1) if seg[3] else None,
+        "last_run": seg[4],
+        "db_mb": round(pragma["page_count"] * pragma["page_size"] / 1048576, 2),
+        "free_mb": round(pragma["freelist_count"] * pragma["page_size"] / 1048576, 2),
+        "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(pragma["auto_vacuum"]),
+    }
+
+
+# --- SÖK ---
+
+def _like(query):
+    return "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+@timed("db")
+def search_history(query, session_id=None, limit=20, include_archive=True):
+    """
+    Söker (skiftlägesokänsligt) i history, sammanfattningarna och, om det
+    inte räcker, i arkivfilerna (nyaste först). Bilder tas inte med.
+    """
+    query = (query or "").strip()
+    if not query: return []
+    _ensure_schema()
+    needle = query.casefold()
+    results = []
+    with get_db_connection() as conn:
+        params = [_like(query)] + ([session_id] if session_id else []) + [limit]
+        for r in conn.execute(f"""SELECT id, session_id, role, content, timestamp FROM history
+                                  WHERE content LIKE ? ESCAPE '\\' {'AND session_id = ?' if session_id else ''}
+                                  ORDER BY id DESC LIMIT ?""", params):
+            results.append({"source": "history", **dict(r)})
+        if len(results) < limit:
+            for r in conn.execute(f"""SELECT id, session_id, day, messages, summary, model FROM history_summaries
+                                      WHERE summary LIKE ? ESCAPE '\\' {'AND session_id = ?' if session_id else ''}
+                                      ORDER BY id DESC LIMIT ?""", params):
+                results.append({"source": "summary", **dict(r)})
+    if include_archive and len(results) < limit:
+        for r in iter_archive():
+            if session_id and r.get("session_id") != session_id: continue
+            if needle in (r.get("content") or "").casefold():
+                results.append({"source": "archive", "id": r.get("id"), "session_id": r.get("session_id"), "role": r.get("role"),
+                                "content": r.get("content"), "timestamp": r.get("timestamp"), "image": bool(r.get("image"))})
+                if len(results) >= limit: break
+    return results[:limit]
+
+
+# --- SCHEMA ---
+
+class ArchiveScheduler:
+    """Lägger ett arkiveringsjobb i jobbkön FIRST_RUN_DELAY efter start och sedan en gång per RUN_INTERVAL."""
+    def __init__(self, queue, first_delay=FIRST_RUN_DELAY, interval=RUN_INTERVAL):
+        self.queue = queue
+        self.first_delay = first_delay
+        self.interval = interval
+        self._task = None
+
+    async def _run(self):
+        await asyncio.sleep(self.first_delay)
+        while True:
+            try: await asyncio.to_thread(self.queue.submit, "archive_history")
+            except Exception as e: print(f"[ARCHIVE] Kunde inte schemalägga: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if not self._task: self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,224 @@
+"""
+==============================================================================
+FILE: app/services/job_queue.py
+DESCRIPTION: Lokal, persistent jobbkö (SQLite) för långsamma verktyg som
+             kodanalysen. Verktyget får ett jobb-id direkt, arbetet körs av en
+             liten worker-pool, förlopp och resultat publiceras via lyssnare
+             (server.py skickar dem som Socket.IO-händelser). Identiska jobb
+             slås ihop och oavslutade jobb tas upp igen efter omstart.
+==============================================================================
+"""
+import json
+import time
+import asyncio
+import threading
+from app.core.database import get_db_connection
+
+DEFAULT_WORKERS = 2
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _ensure_schema():
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready: return
+        with get_db_connection() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, args TEXT, dedupe_key TEXT,
+                status TEXT, progress REAL DEFAULT 0, message TEXT, result TEXT, error TEXT,
+                created_at REAL, updated_at REAL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs (dedupe_key, status)')
+            conn.commit()
+        _schema_ready = True
+
+
+def _row_to_job(row):
+    if not row: return None
+    job = dict(row)
+    job["args"] = json.loads(job["args"] or "{}")
+    return job
+
+
+class JobQueue:
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = workers
+        self.handlers = {}
+        self.listeners = []
+        self.loop = None
+        self._wake = None
+        self._tasks = []
+        self._db_lock = threading.Lock()
+
+    # --- KONFIGURATION ---
+
+    def register(self, kind, handler):
+        """handler(args, progress) körs i en tråd. progress(andel 0-1, text) rapporterar förlopp."""
+        self.handlers[kind] = handler
+
+    def add_listener(self, callback):
+        """callback(event, job) anropas i event-loopen. event: queued, progress, done, failed."""
+        self.listeners.append(callback)
+
+    @property
+    def running(self):
+        return self.loop is not None
+
+    # --- LIVSCYKEL ---
+
+    async def start(self):
+        if self.running: return
+        self.loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        resumed = await asyncio.to_thread(self._requeue_unfinished)
+        if resumed: print(f"[JOBS] Återupptar {resumed} jobb efter omstart.")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._wake.set()
+
+    async def stop(self):
+        for task in self._tasks: task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.loop = None
+
+    def _requeue_unfinished(self):
+        _ensure_schema()
+        with self._db_lock, get_db_connection() as conn:
+            conn.execute("UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running'", (time.time(),))
+            conn.commit()
+            return conn.execute("SELECT COUNT(*) AS n FROM jobs WHERE status = 'queued'").fetchone()["n"]
+
+    # --- PUBLIKT API (trådsäkert) ---
+
+    def submit(self, kind, args=None, dedupe_key=None):
+        """
+        Lägger ett jobb i kön. Finns redan ett köat/pågående jobb med samma nyckel
+        återanvänds det. Returnerar (jobb-id, True om det var ett befintligt jobb).
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Okänd jobbtyp: {kind}")
+        args = args or {}
+        dedupe_key = dedupe_key or f"{kind}:{json.dumps(args, sort_keys=True)}"
+        _ensure_schema()
+        with self._db_lock, get_db_connection() as conn:
+            row = conn.execute("SELECT id FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running') ORDER BY id LIMIT 1",
+                               (dedupe_key,)).fetchone()
+            if row:
+                return row["id"], True
+            now = time.time()
+            cur = conn.execute('''INSERT INTO jobs (kind, args, dedupe_key, status, created_at, updated_at)
+                                  VALUES (?, ?, ?, 'queued', ?, ?)''', (kind, json.dumps(args), dedupe_key, now, now))
+            conn.commit()
+            job_id = cur.lastrowid
+        self._publish("queued", self.get(job_id))
+        if self.loop: self.loop.call_soon_threadsafe(self._wake.set)
+        return job_id, False
+
+    def get(self, job_id):
+        _ensure_schema()
+        with get_db_connection() as conn:
+            return _row_to_job(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def recent(self, limit=10):
+        _ensure_schema()
+        with get_db_connection() as conn:
+            return [_row_to_job(r) for r in conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()]
+
+    # --- INTERNT ---
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        with self._db_lock, get_db_connection() as conn:
+            conn.execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+            conn.commit()
+
+    def _claim_next(self):
+        """Tar nästa köade jobb och markerar det som pågående (atomiskt)."""
+        with self._db_lock, get_db_connection() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if not row: return None
+            conn.execute("UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?", (time.time(), row["id"]))
+            conn.commit()
+        job = _row_to_job(row)
+        job["status"] = "running"
+        return job
+
+    def _publish(self, event, job):
+        if not job or not self.listeners: return
+
+        def deliver():
+            for cb in self.listeners:
+                try: cb(event, job)
+                except Exception as e: print(f"[JOBS] Lyssnarfel: {e}")
+
+        if self.loop is None: return
+        try:
+            if asyncio.get_running_loop() is self.loop:
+                deliver()
+                return
+        except RuntimeError:
+            pass
+        self.loop.call_soon_threadsafe(deliver)
+
+    async def _worker(self, idx):
+        while True:
+            job = await asyncio.to_thread(self._claim_next)
+            if job is None:
+                self._wake.clear()
+                # Kolla en gång till så att vi inte missar ett jobb som kom under clear()
+                job = await asyncio.to_thread(self._claim_next)
+                if job is None:
+                    await self._wake.wait()
+                    continue
+            self._wake.set()  # Väck nästa worker om fler jobb väntar
+            await self._run(job)
+
+    async def _run(self, job):
+        handler = self.handlers.get(job["kind"])
+        print(f"[JOBS] Startar jobb #{job['id']} ({job['kind']})")
+        self._publish("started", job)
+
+        def progress(fraction, message=""):
+            self._update(job["id"], progress=round(float(fraction), 3), message=message)
+            self._publish("progress", {**job, "progress": fraction, "message": message})
+
+        try:
+            if handler is None: raise ValueError(f"Okänd jobbtyp: {job['kind']}")
+            result = await asyncio.to_thread(handler, job["args"], progress)
+            await asyncio.to_thread(self._update, job["id"], status="done", progress=1.0, result=str(result))
+            print(f"[JOBS] Jobb #{job['id']} klart.")
+            self._publish("done", {**job, "status": "done", "result": str(result)})
+        except asyncio.CancelledError:
+            # Avstängning: jobbet lämnas som 'running' och köas om vid nästa start
+            raise
+        except Exception as e:
+            await asyncio.to_thread(self._update, job["id"], status="failed", error=str(e))
+            print(f"[JOBS] Jobb #{job['id']} misslyckades: {e}")
+            self._publish("failed", {**job, "status": "failed", "error": str(e)})
+
+
+# --- STANDARDJOBB ---
+
+def _analyze_code_job(args, progress):
+    from app.tools.code_auditor import run_code_audit
+    return run_code_audit(args.get("model"), on_progress=lambda done, total: progress(done / max(total, 1), f"Kodanalys {done}/{total}"))
+
+
+def _archive_history_job(args, progress):
+    from app.services.history_archive import archive_history, format_result
+    return format_result(archive_history(args.get("retention_days"), progress=progress))
+
+
+_queue = None
+
+
+def get_job_queue():
+    global _queue
+    if _queue is None:
+        _queue = JobQueue()
+        _queue.register("analyze_code", _analyze_code_job)
+        _queue.register("archive_history", _archive_history_job)
+    return _queue
@@ -2,58 +2,91 @@ import google.generativeai as genai
 import httpx
 import json
 import asyncio
+import weakref
 import traceback
 from openai import AsyncOpenAI
 from anthropic import AsyncAnthropic
-from config.settings import get_config
+from config.settings import get_config, gemini_options
 from mem0 import AsyncMemoryClient
 
 # Importera verktyg
 from app.tools import (
     get_calendar_events, 
+    get_calendar_agenda,
     get_sensor_data, 
     control_vacuum, 
     get_ha_state, 
     control_light,
-    get_weather,
+    control_entities,
+    get_weather_sync,
     run_code_audit
 )
 # Importera prompt-funktioner och variabel
-from app.core.prompts import get_system_prompt, ANALYZE_CODE_TOOL_DESC
+from app.core.prompts import get_system_prompt, get_audit_tool_desc
+from app.utils.http_pool import run_sync
+from app.core.blob_store import load_image
+from app.services.job_queue import get_job_queue
+from app.utils.metrics import span, inc, timed_stream
+from app.utils import tracing
 
 # --- VERKTYGS-WRAPPERS ---
 
 def tool_analyze_code():
     # Beskrivningen sätts dynamiskt nedanför
-    print("[DAA] 🛠️  Startar kodanalys...")
-    try: 
-        result = run_code_audit()
-        print("[DAA] ✅ Kodanalys klar!")
-        return result
-    except Exception as e: 
+    queue = get_job_queue()
+    if not queue.running:
+        # Ingen jobbkö (t.ex. fristående api.py): kör direkt som förut
+        print("[DAA] 🛠️  Startar kodanalys...")
+        try:
+            result = run_code_audit()
+            print("[DAA] ✅ Kodanalys klar!")
+            return result
+        except Exception as e:
+            return f"Fel vid kodanalys: {e}"
+    try:
+        job_id, existing = queue.submit("analyze_code")
+    except Exception as e:
         return f"Fel vid kodanalys: {e}"
+    if existing:
+        return f"Kodanalysen pågår redan (jobb #{job_id}). Resultatet publiceras när den är klar."
+    return f"Kodanalysen har startats i bakgrunden (jobb #{job_id}). Resultatet publiceras när den är klar."
 
 # HÄR sätter vi beskrivningen från databasen (via prompts.py)
-tool_analyze_code.__doc__ = ANALYZE_CODE_TOOL_DESC
+tool_analyze_code.__doc__ = get_audit_tool_desc()
+
+def tool_get_job_status(job_id: int):
+    """Hämtar status och resultat för ett bakgrundsjobb (t.ex. kodanalys) via dess jobb-id."""
+    job = get_job_queue().get(int(job_id))
+    if not job: return f"Hittade inget jobb #{job_id}."
+    if job["status"] == "done": return f"Jobb #{job_id} är klart: {job['result']}"
+    if job["status"] == "failed": return f"Jobb #{job_id} misslyckades: {job['error']}"
+    return f"Jobb #{job_id} {'pågår' if job['status'] == 'running' else 'väntar i kö'} ({round((job['progress'] or 0) * 100)} %)."
 
 def tool_get_weather():
-    """Hämtar väderprognos."""
-    try: return asyncio.run(get_weather())
+    """Hämtar väder just nu, timprognos, regnrisk ikväll/inatt och de kommande dagarna."""
+    try: return get_weather_sync(detail=True)
     except: return "Kunde inte hämta väder."
 
 def tool_control_light(entity_id: str, action: str):
     """Styr belysning (on/off)."""
-    try: return asyncio.run(control_light(entity_id, action))
+    try: return run_sync(control_light(entity_id, action))
     except: return "Kunde inte styra lampan."
 
 def tool_control_vacuum(entity_id: str, action: str):
     """Styr dammsugare (start/stop/dock)."""
-    try: return asyncio.run(control_vacuum(entity_id, action))
+    try: return run_sync(control_vacuum(entity_id, action))
     except: return "Kunde inte styra dammsugaren."
 
+def tool_control_entities(action: str, entity_ids: list[str] = None, area_ids: list[str] = None, domain: str = "light"):
+    """Styr flera enheter samtidigt i ett anrop, t.ex. alla lampor i ett rum.
+    action: on/off/toggle (lampor, brytare) eller start/stop/pause/dock (dammsugare).
+    entity_ids: lista med entity_id. area_ids: Home Assistant-områden (area_id), då anger domain vilken typ (t.ex. light)."""
+    try: return run_sync(control_entities(action, entity_ids, area_ids, domain))
+    except: return "Kunde inte styra enheterna."
+
 def tool_get_ha_state(entity_id: str):
     """Hämtar status för en enhet."""
-    try: return asyncio.run(get_ha_state(entity_id))
+    try: return run_sync(get_ha_state(entity_id))
     except: return "Kunde inte hämta status."
 
 def tool_get_sensor(friendly_name: str):
@@ -68,17 +101,75 @@ def tool_analyze_health_data():
 # Lista med verktyg
 daa_tools = [
     get_calendar_events,
+    get_calendar_agenda,
     tool_get_sensor,
     tool_control_vacuum,
     tool_get_ha_state,
     tool_control_light,
+    tool_control_entities,
     tool_get_weather,
     tool_analyze_health_data,
-    tool_analyze_code
+    tool_analyze_code,
+    tool_get_job_status
 ]
 
+# --- KLIENTER ---
+# Återanvänds mellan frågor (anslutningarna hålls varma). Som i http_pool är
+# de asynkrona klienterna bundna till den loop de skapades i.
+_clients = weakref.WeakKeyDictionary()
+
+def _loop_clients():
+    return _clients.setdefault(asyncio.get_running_loop(), {})
+
+def get_openai_client(api_key, base_url=None):
+    clients = _loop_clients()
+    key = ("openai", api_key, base_url)
+    if key not in clients:
+        clients[key] = AsyncOpenAI(api_key=api_key, base_url=base_url)
+    return clients[key]
+
+def get_mem0_client(api_key):
+    clients = _loop_clients()
+    key = ("mem0", api_key)
+    if key not in clients:
+        clients[key] = AsyncMemoryClient(api_key=api_key)
+    return clients[key]
+
+async def warm_providers():
+    """Konfigurerar Gemini och skapar klienterna för de nycklar som finns (vid start)."""
+    cfg = get_config()
+    ready = []
+    if cfg.get("GOOGLE_API_KEY"):
+        genai.configure(**gemini_options(cfg))
+        ready.append("google")
+    if cfg.get("OPENAI_API_KEY"):
+        get_openai_client(cfg["OPENAI_API_KEY"], cfg.get("OPENAI_BASE_URL") or None)
+        ready.append("openai")
+    mem0_key = cfg.get("MEM0_API_KEY")
+    if mem0_key and len(mem0_key) > 5:
+        # mem0 validerar nyckeln med ett blockerande anrop när klienten skapas
+        client = await asyncio.to_thread(AsyncMemoryClient, api_key=mem0_key)
+        _loop_clients().setdefault(("mem0", mem0_key), client)
+        ready.append("mem0")
+    return ready
+
 # --- HUVUDFUNKTION FÖR STREAMING ---
-async def stream_response(model_id, history, new_message, image_data=None, system_injection=None):
+def stream_response(model_id, history, new_message, image_data=None, system_injection=None, tools=True):
+    """
+    Strömmar svaret. Tid till första token och total tid mäts (response_*, se /metrics).
+    tools=False: inga verktyg (hem, jobb), för anrop som kan köra parallellt med ett annat.
+    """
+    return timed_stream("response", _stream_response(model_id, history, new_message, image_data, system_injection, tools), model=model_id)
+
+async def _provider_stream(provider, model_id, stream):
+    """En leverantörs ström med mätning (llm_* i /metrics) och eget steg i turens spårning."""
+    with tracing.stage("llm", provider=provider, model=model_id) as entry:
+        trace = tracing.current()
+        async for chunk in timed_stream("llm", stream, provider=provider, model=model_id):
+            if trace and chunk and "first_token_ms" not in entry: entry["first_token_ms"] = trace.ms()
+            yield chunk
+
+async def _stream_response(model_id, history, new_message, image_data=None, system_injection=None, tools=True):
     cfg = get_config()
     base_system_prompt = get_system_prompt() # Hämtas från DB + Tid
     
@@ -87,9 +178,10 @@ async def stream_response(model_id, history, new_message, image_data=None, syste
     mem0_client = None
     if mem0_key and len(mem0_key) > 5:
         try:
-            mem0_client = AsyncMemoryClient(api_key=mem0_key)
+            mem0_client = get_mem0_client(mem0_key)
             try:
-                relevant_memories = await mem0_client.search(new_message, user_id="Anders")
+                with tracing.stage("memory_search"), span("memory", op="search"):
+                    relevant_memories = await mem0_client.search(new_message, user_id="Anders")
                 mem_text = ""
                 for mem in relevant_memories:
                     mem_text += f"- {mem['memory']}\n"
@@ -100,37 +192,40 @@ async def stream_response(model_id, history, new_message, image_data=None, syste
     # --- LIVE DATA ---
     if system_injection:
         base_system_prompt += f"\n\n--- REALTIDSDATA ---\n{system_injection}"
+    tracing.annotate(system_prompt_chars=len(base_system_prompt), history_messages=len(history),
+                     history_chars=sum(len(m.get("content") or "") for m in history))
 
     model_lower = model_id.lower()
     full_response_text = ""
 
     # --- VÄLJ MODELL ---
     if "gemini" in model_lower or "google" in model_lower:
-        if cfg.get("GOOGLE_API_KEY"): genai.configure(api_key=cfg["GOOGLE_API_KEY"])
-        async for chunk in stream_gemini(model_id, history, new_message, image_data, base_system_prompt):
+        if cfg.get("GOOGLE_API_KEY"): genai.configure(**gemini_options(cfg))
+        async for chunk in _provider_stream("gemini", model_id, stream_gemini(model_id, history, new_message, image_data, base_system_prompt, tools)):
             full_response_text += chunk
             yield chunk
     elif "gpt" in model_lower:
         api_key = cfg.get("OPENAI_API_KEY")
         if not api_key: yield "⚠️ Ingen API-nyckel."; return
-        async for chunk in stream_openai_compatible(api_key, None, model_id, history, new_message, base_system_prompt):
+        async for chunk in _provider_stream("openai", model_id, stream_openai_compatible(api_key, cfg.get("OPENAI_BASE_URL") or None, model_id, history, new_message, base_system_prompt)):
             full_response_text += chunk
             yield chunk
     elif "ollama" in model_lower: # Förenklat för exempel
-         async for chunk in stream_ollama(model_id, history, new_message, base_system_prompt):
+         async for chunk in _provider_stream("ollama", model_id, stream_ollama(model_id, history, new_message, base_system_prompt)):
             full_response_text += chunk
             yield chunk
     else: # Fallback till Ollama eller annan logik
-         async for chunk in stream_ollama(model_id, history, new_message, base_system_prompt):
+         async for chunk in _provider_stream("ollama", model_id, stream_ollama(model_id, history, new_message, base_system_prompt)):
             full_response_text += chunk
             yield chunk
 
     # --- SPARA TILL MINNE ---
     if mem0_client and full_response_text:
-        try: await mem0_client.add([{"role": "user", "content": new_message},{"role": "assistant", "content": full_response_text}], user_id="Anders")
+        try:
+            with span("memory", op="add"): await mem0_client.add([{"role": "user", "content": new_message},{"role": "assistant", "content": full_response_text}], user_id="Anders")
         except: pass
 
-async def stream_gemini(model_id, history, new_message, image_data=None, system_prompt=None):
+async def stream_gemini(model_id, history, new_message, image_data=None, system_prompt=None, tools=True):
     try:
         clean_model_id = model_id.replace("Google: ", "").strip()
         if not clean_model_id: clean_model_id = "gemini-1.5-flash"
@@ -138,16 +233,20 @@ async def stream_gemini(model_id, history, new_message, image_data=None, system_
         # Stäng av filter
         safety = [{"category": c, "threshold": "BLOCK_NONE"} for c in ["HARM_CATEGORY_HARASSMENT", "HARM_CATEGORY_HATE_SPEECH", "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_DANGEROUS_CONTENT"]]
 
-        model = genai.GenerativeModel(model_name=clean_model_id, tools=daa_tools, system_instruction=system_prompt, safety_settings=safety)
+        model = genai.GenerativeModel(model_name=clean_model_id, tools=daa_tools if tools else None,
+                                      system_instruction=system_prompt, safety_settings=safety)
         
         chat_history = [{"role": "user" if m["role"] == "user" else "model", "parts": [m["content"]]} for m in history]
-        chat = model.start_chat(history=chat_history, enable_automatic_function_calling=True)
+        chat = model.start_chat(history=chat_history, enable_automatic_function_calling=tools)
         
         parts = [new_message]
-        if image_data: parts.append({"mime_type": "image/jpeg", "data": image_data})
+        if image_data:
+            # Referenser (blob_store) läses från disk först här
+            data, mime = await asyncio.to_thread(load_image, image_data)
+            parts.append({"mime_type": mime if mime.startswith("image/") else "image/jpeg", "data": data})
 
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, lambda: chat.send_message(parts))
+        # to_thread (inte run_in_executor) så att verktygsanropen hamnar i turens spårning
+        response = await asyncio.to_thread(chat.send_message, parts)
         
         final_text = ""
         try: final_text = response.text
@@ -161,12 +260,15 @@ async def stream_gemini(model_id, history, new_message, image_data=None, system_
             yield final_text[i:i+chunk_size]
             await asyncio.sleep(0.01)
 
-    except Exception as e: yield f"⚠️ Error: {str(e)}"
+    except Exception as e:
+        # Felet visas som text i chatten, räknas ändå som fel i /metrics
+        inc("llm_errors_total", provider="gemini", model=model_id)
+        yield f"⚠️ Error: {str(e)}"
 
 # Behåll helper-funktioner för OpenAI/Ollama här (de var korrekta i förra versionen)
 async def stream_openai_compatible(api_key, base_url, model_id, history, new_message, system_prompt=None):
     clean_model_id = model_id.split(": ")[-1] if ": " in model_id else model_id
-    client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+    client = get_openai_client(api_key, base_url)
     messages = [{"role": "system", "content": system_prompt}] + history + [{"role": "user", "content": new_message}]
     stream = await client.chat.completions.create(model=clean_model_id, messages=messages, stream=True)
     async for chunk in stream:
@@ -0,0 +1,57 @@
+"""
+==============================================================================
+FILE: app/services/model_catalog.py
+DESCRIPTION: Listan med tillgängliga modeller (Google, OpenAI, Ollama) som
+             visas i frontendens modellväljare. Hämtas vid uppvärmningen och
+             cachas, så att en ny Socket.IO-anslutning inte behöver fråga
+             Google och Ollama varje gång.
+==============================================================================
+"""
+import time
+import threading
+import requests
+from config.settings import get_config, gemini_options
+
+CATALOG_TTL = 300
+# Inställningar som påverkar listan (se invalidate_models)
+CATALOG_SETTINGS = ("GOOGLE_API_KEY", "OPENAI_API_KEY", "OLLAMA_URL")
+
+_cache = {"models": None, "at": 0.0}
+_lock = threading.Lock()
+
+
+def fetch_models():
+    """Frågar leverantörerna (blockerande)."""
+    conf = get_config()
+    models = []
+    if conf.get("GOOGLE_API_KEY"):
+        try:
+            import google.generativeai as genai
+            genai.configure(**gemini_options(conf))
+            for m in genai.list_models():
+                if 'generateContent' in m.supported_generation_methods:
+                    clean_id = m.name.replace("models/", "")
+                    models.append({'id': clean_id, 'name': f"Google: {getattr(m, 'display_name', clean_id)}"})
+        except: models.append({'id': 'gemini-2.0-flash-exp', 'name': 'Google: Gemini 2.0 Flash (Fallback)'})
+    if conf.get("OPENAI_API_KEY"): models.append({'id': 'gpt-4o', 'name': 'OpenAI: GPT-4o'})
+    ollama_url = conf.get("OLLAMA_URL", "http://127.0.0.1:11434")
+    try:
+        resp = requests.get(f"{ollama_url}/api/tags", timeout=1)
+        if resp.status_code == 200:
+            for m in resp.json().get('models', []):
+                models.append({'id': m.get('name'), 'name': f"Ollama: {m.get('name')}"})
+    except: pass
+    if not models: models.append({'id': 'error', 'name': '⚠️ No Models Found'})
+    return models
+
+
+def invalidate_models():
+    _cache["models"] = None
+
+
+def get_available_models(refresh=False):
+    """Cachad modellista. Samtidiga anrop väntar på samma hämtning."""
+    with _lock:
+        if refresh or _cache["models"] is None or time.monotonic() - _cache["at"] > CATALOG_TTL:
+            _cache.update(models=fetch_models(), at=time.monotonic())
+        return list(_cache["models"])
@@ -0,0 +1,319 @@
+"""
+==============================================================================
+FILE: app/services/response_cache.py
+DESCRIPTION: Skydd mot att upprepade frågor multiplicerar modellkostnaden.
+             Identiska samtidiga frågor delar på en enda generering
+             (coalescing) och svar på idempotenta frågor (väder, kalender)
+             återanvänds ordagrant under en kort TTL. Den semantiska cachen
+             känner igen omformulerade frågor ("hur sov jag?") så länge den
+             injicerade realtidsdatan är oförändrad.
+==============================================================================
+"""
+import re
+import json
+import math
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from app.services.context_providers import keyword_scorer
+
+MAX_ENTRIES = 256
+SEMANTIC_MAX_ENTRIES = 512
+# Cosinuslikhet (tecken-trigram) som krävs för att två frågor ska räknas som samma
+SIMILARITY_THRESHOLD = 0.85
+EMBED_DIM = 1024
+# Hur länge ett svar får återanvändas, per realtidskälla. Kortast vinner.
+SOURCE_TTLS = {"weather": 600, "garmin": 900, "strava": 900, "withings": 3600, "calendar": 120, "ha": 30}
+DEFAULT_SOURCE_TTL = 300
+# Kommandon ska alltid nå modellen (verktygsanrop får inte hoppas över)
+ACTION_PATTERN = re.compile(r"\b(tänd|släck|sätt|starta|stoppa|stäng|öppna|lås|dammsug|skapa|boka|lägg|ta bort|"
+                            r"skicka|spela|pausa|analysera|ändra|höj|sänk|dimma|kör)", re.IGNORECASE)
+
+# Ord som trigramlikheten inte ser skillnad på ("klockan 18"/"klockan 21",
+# "måndag"/"tisdag", "två"/"tre veckor"). De måste stämma exakt för en träff.
+ANCHOR_PATTERN = re.compile(
+    r"^(\d+|(mån|tis|ons|tors|fre|lör|sön)dag\w*|januari|februari|mars|april|maj|juni|juli|augusti|september|"
+    r"oktober|november|december|idag|igår|imorgon|ikväll|inatt|övermorgon|förrgår|morgon\w*|morse|kväll\w*|"
+    r"natt\w*|förmiddag\w*|eftermiddag\w*|helg\w*|veck\w*|månad\w*|år|året|åren|dag|dagen|dagar|timm\w*|"
+    r"nästa|förra|förrförra|senaste|kommande|sist|"
+    r"noll|två|tre|fyra|fem|sex|sju|åtta|nio|tio|elva|tolv|tretton|fjorton|femton|sexton|sjutton|arton|nitton|"
+    r"tjugo\w*|trettio\w*|fyrtio\w*|femtio\w*|hundra\w*|tusen\w*|första|andra|tredje|fjärde|femte|sjätte|"
+    r"halv\w*|kvart\w*|today|tomorrow|yesterday|tonight|week\w*|month\w*|year\w*|"
+    r"(mon|tues|wednes|thurs|fri|satur|sun)day|one|two|three|four|five|six|seven|eight|nine|ten)$")
+
+
+def query_anchors(query):
+    """Siffror, veckodagar, månader, relativa tidsord och räkneord i frågan, i ordning."""
+    return tuple(w for w in normalize_query(query).split() if ANCHOR_PATTERN.match(w))
+
+
+def last_turn(history):
+    """Föregående fråga och svar. Följdfrågor ("och imorgon?") betyder olika saker efter olika samtal."""
+    return "\n".join(f"{m.get('role')}: {m.get('content')}" for m in (history or [])[-2:])
+
+
+# Följdfrågor: börjar som en fortsättning eller syftar tillbaka på föregående svar.
+# ("det" räknas inte, "vad är det för väder?" är en fristående fråga.)
+FOLLOW_UP_START = re.compile(r"^(och|men|än|samt|också|då|sen|sedan|hur är det med|hur blir det med|vad sägs om|"
+                             r"varför|and|but|what about|how about)\b")
+FOLLOW_UP_WORDS = {"den", "dem", "dess", "där", "dit", "därför", "samma", "igen", "också", "fortfarande", "it", "that", "those"}
+FOLLOW_UP_MAX_WORDS = 3
+
+
+def is_follow_up(query):
+    """Kort fråga, fortsättning ("och imorgon?") eller tillbakasyftning ("är den på?")."""
+    words = normalize_query(query).split()
+    if len(words) <= FOLLOW_UP_MAX_WORDS: return True
+    return bool(FOLLOW_UP_START.match(" ".join(words))) or any(w in FOLLOW_UP_WORDS for w in words)
+
+
+def conversation_key(query, history):
+    """Del av cachenyckeln: föregående tur bara för följdfrågor. Fristående frågor träffar oavsett samtal."""
+    return last_turn(history) if is_follow_up(query) else ""
+
+
+# Frågor vars svar bara beror på data som ändras långsamt. TTL i sekunder.
+IDEMPOTENT_TOPICS = {
+    "weather": (300, keyword_scorer({"väder": 1, "vädr": 1, "regn": 1, "snö": 1, "temperatur": 1, "grader": 0.6,
+                                     "prognos": 1, "blås": 0.6, "vind": 0.6, "weather": 1, "forecast": 1})),
+    "calendar": (120, keyword_scorer({"kalender": 1, "möte": 1, "möten": 1, "bokning": 1, "schema": 0.6,
+                                      "händelse": 0.6, "calendar": 1, "agenda": 1})),
+}
+
+
+def request_key(model, messages):
+    """Nyckel för en exakt fråga: modell + hela meddelandelistan."""
+    raw = json.dumps({"model": model, "messages": messages}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def idempotent_ttl(message, threshold=1.0):
+    """TTL för frågan om den gäller ett idempotent ämne, annars None."""
+    ttls = [ttl for ttl, scorer in IDEMPOTENT_TOPICS.values() if scorer(message) >= threshold]
+    return min(ttls) if ttls else None
+
+
+def is_cacheable(text):
+    """Fel och tomma svar ska aldrig återanvändas."""
+    return bool(text and text.strip()) and not text.startswith(("Fel:", "⚠️"))
+
+
+class ExactCache:
+    """LRU med TTL per post. Används bara från event-loopen."""
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.entries = OrderedDict()   # key -> (utgår, text)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.time():
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry: del self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, text, ttl):
+        self.entries[key] = (time.time() + ttl, text)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+class SharedStream:
+    """En pågående generering som flera klienter kan läsa från, även de som kommer in sent."""
+    def __init__(self, chunks):
+        self.buffer = []
+        self.finished = False
+        self.changed = asyncio.Condition()
+        self.task = asyncio.ensure_future(self._pump(chunks))
+
+    async def _pump(self, chunks):
+        try:
+            async for chunk in chunks:
+                async with self.changed:
+                    self.buffer.append(chunk)
+                    self.changed.notify_all()
+        finally:
+            async with self.changed:
+                self.finished = True
+                self.changed.notify_all()
+
+    async def read(self):
+        """Spelar upp det som redan kommit och följer sedan strömmen."""
+        pos = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: pos < len(self.buffer) or self.finished)
+                new, done = self.buffer[pos:], self.finished
+            pos += len(new)
+            for chunk in new:
+                yield chunk
+            if done and pos >= len(self.buffer):
+                return
+
+    def text(self):
+        return "".join(self.buffer)
+
+
+class Coalescer:
+    """Identiska samtidiga frågor -> en generering. Lyckade idempotenta svar cachas."""
+    def __init__(self, cache=None):
+        self.cache = cache or ExactCache()
+        self.inflight = {}
+        self.coalesced = 0
+
+    def stream(self, key, factory, ttl=None):
+        """
+        factory() -> async iterator med textbitar. Returnerar en async iterator
+        för den här klienten. ttl: cachetid om svaret får återanvändas.
+        """
+        if ttl:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return _replay(cached)
+        shared = self.inflight.get(key)
+        if shared is not None:
+            self.coalesced += 1
+        else:
+            shared = SharedStream(factory())
+            self.inflight[key] = shared
+            shared.task.add_done_callback(lambda _: self._finish(key, shared, ttl))
+        return shared.read()
+
+    def _finish(self, key, shared, ttl):
+        if self.inflight.get(key) is shared:
+            del self.inflight[key]
+        if ttl and is_cacheable(shared.text()):
+            self.cache.put(key, shared.text(), ttl)
+
+    def stats(self):
+        return {**self.cache.stats(), "inflight": len(self.inflight), "coalesced": self.coalesced}
+
+
+# --- SEMANTISK CACHE ---
+
+def normalize_query(text):
+    """Gemener, utan skiljetecken och med enkla mellanslag."""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def embed(text):
+    """
+    Billig inbäddning utan modellanrop: tecken-trigram hashade till EMBED_DIM
+    dimensioner, normerad. Glesa dict-vektorer räcker för korta frågor.
+    """
+    padded = f" {normalize_query(text)} "
+    vec = {}
+    for i in range(len(padded) - 2):
+        idx = int(hashlib.md5(padded[i:i + 3].encode("utf-8")).hexdigest()[:8], 16) % EMBED_DIM
+        vec[idx] = vec.get(idx, 0) + 1
+    norm = math.sqrt(sum(v * v for v in vec.values())) or 1.0
+    return {k: v / norm for k, v in vec.items()}
+
+
+def similarity(a, b):
+    if len(a) > len(b): a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+def context_fingerprint(*parts):
+    """Hash av den injicerade realtidsdatan. Ändras datan blir det en miss."""
+    return hashlib.sha256("\n".join(p or "" for p in parts).encode("utf-8")).hexdigest()
+
+
+class SemanticCache:
+    """
+    Svar nycklade på (modell, fingerprint) + inbäddningen av frågan. En träff
+    kräver samma realtidsdata (och för följdfrågor föregående tur, se
+    conversation_key), samma ankarord (query_anchors) och en fråga som är
+    tillräckligt lik.
+    """
+    def __init__(self, max_entries=SEMANTIC_MAX_ENTRIES, threshold=SIMILARITY_THRESHOLD):
+        self.entries = OrderedDict()   # id -> dict
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._next_id = 0
+
+    @staticmethod
+    def accepts(query):
+        """Frågor får cachas, kommandon inte."""
+        return not ACTION_PATTERN.search(query)
+
+    @staticmethod
+    def ttl_for(sources):
+        return min((SOURCE_TTLS.get(s, DEFAULT_SOURCE_TTL) for s in sources), default=DEFAULT_SOURCE_TTL)
+
+    def lookup(self, model, query, fingerprint):
+        now = time.time()
+        vec = embed(query)
+        anchors = query_anchors(query)
+        best, best_score = None, self.threshold
+        for entry_id, entry in list(self.entries.items()):
+            if entry["expires"] <= now:
+                del self.entries[entry_id]
+                continue
+            if entry["model"] != model or entry["fingerprint"] != fingerprint or entry["anchors"] != anchors: continue
+            score = similarity(vec, entry["vector"])
+            if score >= best_score:
+                best, best_score = entry_id, score
+        if best is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(best)
+        self.hits += 1
+        return self.entries[best]["text"]
+
+    def store(self, model, query, fingerprint, text, ttl):
+        # Svar med datorstyrningstaggar ([DO:...]) måste köras på nytt varje gång
+        if not is_cacheable(text) or "[DO:" in text: return
+        self._next_id += 1
+        self.entries[self._next_id] = {"model": model, "fingerprint": fingerprint, "vector": embed(query),
+                                       "anchors": query_anchors(query), "query": query, "text": text, "expires": time.time() + ttl}
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def bypass(self):
+        self.bypassed += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses, "bypassed": self.bypassed,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+
+async def _replay(text):
+    yield text
+
+
+_coalescer = None
+
+
+_semantic_cache = None
+
+
+def get_coalescer():
+    global _coalescer
+    if _coalescer is None:
+        _coalescer = Coalescer()
+    return _coalescer
+
+
+def get_semantic_cache():
+    global _semantic_cache
+    if _semantic_cache is None:
+        _semantic_cache = SemanticCache()
+    return _semantic_cache
@@ -0,0 +1,184 @@
+"""
+==============================================================================
+FILE: app/services/strava_sync.py
+DESCRIPTION: Inkrementell synk av Strava-aktiviteter till en lokal tabell.
+             Bara pass nyare än senast synkade start_date hämtas (after=),
+             och tempo samt vecko-/månadstotaler räknas ut vid synken så att
+             chatten kan svara direkt från databasen.
+==============================================================================
+"""
+import time
+import asyncio
+import datetime
+from app.core.database import get_db_connection
+from app.tools.strava_core import StravaTool, format_pace
+
+# Synka inte oftare än så här när chatten frågar (sekunder)
+SYNC_INTERVAL = 300
+PAGE_SIZE = 100
+
+_schema_ready = False
+
+
+def _ensure_schema():
+    global _schema_ready
+    if _schema_ready: return
+    with get_db_connection() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS strava_activities (
+            id INTEGER PRIMARY KEY, name TEXT, type TEXT,
+            start_date TEXT, start_date_local TEXT, start_ts INTEGER,
+            week_key TEXT, month_key TEXT,
+            distance_m REAL, moving_time_s INTEGER, elevation_m REAL,
+            avg_hr REAL, max_hr REAL, suffer_score REAL,
+            avg_speed_ms REAL, pace_text TEXT)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_strava_start ON strava_activities (start_ts)')
+        conn.execute('''CREATE TABLE IF NOT EXISTS strava_totals (
+            period TEXT, period_key TEXT, type TEXT,
+            count INTEGER, distance_m REAL, moving_time_s INTEGER, elevation_m REAL,
+            PRIMARY KEY (period, period_key, type))''')
+        conn.commit()
+    _schema_ready = True
+
+
+def _period_keys(date_local):
+    """('2026-W42', '2026-10') för ett lokalt startdatum."""
+    day = datetime.date.fromisoformat(date_local[:10])
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}", day.strftime("%Y-%m")
+
+
+def _to_row(act):
+    start_utc = act.get("start_date", "")
+    start_local = act.get("start_date_local", "") or start_utc
+    start_ts = int(datetime.datetime.fromisoformat(start_utc.replace("Z", "+00:00")).timestamp()) if start_utc else 0
+    week_key, month_key = _period_keys(start_local) if start_local else ("", "")
+    return (
+        act.get("id"), act.get("name", "Namnlöst pass"), act.get("type", "Okänd"),
+        start_utc, start_local, start_ts, week_key, month_key,
+        act.get("distance", 0), act.get("moving_time", 0), act.get("total_elevation_gain", 0),
+        act.get("average_heartrate"), act.get("max_heartrate"), act.get("suffer_score"),
+        act.get("average_speed", 0), format_pace(act.get("average_speed", 0), act.get("type")),
+    )
+
+
+def _store_activities(activities):
+    """Upsert av aktiviteter + omräkning av totaler för berörda perioder."""
+    rows = [_to_row(a) for a in activities if a.get("id") is not None]
+    if not rows: return 0
+    weeks = {r[6] for r in rows}
+    months = {r[7] for r in rows}
+    with get_db_connection() as conn:
+        conn.executemany('''INSERT OR REPLACE INTO strava_activities
+            (id, name, type, start_date, start_date_local, start_ts, week_key, month_key,
+             distance_m, moving_time_s, elevation_m, avg_hr, max_hr, suffer_score, avg_speed_ms, pace_text)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+        for period, column, keys in (("week", "week_key", weeks), ("month", "month_key", months)):
+            marks = ",".join("?" * len(keys))
+            conn.execute(f"DELETE FROM strava_totals WHERE period = ? AND period_key IN ({marks})", (period, *keys))
+            conn.execute(f'''INSERT INTO strava_totals
+                SELECT ?, {column}, type, COUNT(*), SUM(distance_m), SUM(moving_time_s), SUM(elevation_m)
+                FROM strava_activities WHERE {column} IN ({marks}) GROUP BY {column}, type''', (period, *keys))
+        conn.commit()
+    return len(rows)
+
+
+def _latest_start_ts():
+    _ensure_schema()
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT MAX(start_ts) AS ts FROM strava_activities").fetchone()
+    return row["ts"] if row and row["ts"] else None
+
+
+class StravaSync:
+    def __init__(self, tool=None):
+        self.tool = tool or StravaTool()
+        self.last_sync = 0
+        self._sync_lock = asyncio.Lock()
+
+    @property
+    def configured(self):
+        return bool(self.tool.refresh_token)
+
+    async def sync(self):
+        """Hämtar alla pass nyare än det senast sparade. Returnerar antal nya pass."""
+        async with self._sync_lock:
+            after = await asyncio.to_thread(_latest_start_ts)
+            total = 0
+            page = 1
+            while True:
+                # Utan historik hämtas bara första sidan (de senaste passen)
+                batch = await self.tool.fetch_activities(after=after, page=page, per_page=PAGE_SIZE)
+                if not batch: break
+                total += await asyncio.to_thread(_store_activities, batch)
+                if after is None or len(batch) < PAGE_SIZE: break
+                page += 1
+            self.last_sync = time.time()
+            if total: print(f">> [STRAVA] Synkade {total} nya pass.")
+            return total
+
+    async def ensure_synced(self, max_age=SYNC_INTERVAL):
+        """Synkar om det var längre sedan än `max_age` sekunder. Fel loggas men stoppar inte chatten."""
+        if not self.configured or time.time() - self.last_sync < max_age:
+            return
+        try: await self.sync()
+        except Exception as e: print(f">> [STRAVA] Synkfel: {e}")
+
+
+def get_recent_activities(limit=5):
+    """De senaste passen från den lokala tabellen, i samma format som StravaTool."""
+    _ensure_schema()
+    with get_db_connection() as conn:
+        rows = conn.execute("SELECT * FROM strava_activities ORDER BY start_ts DESC LIMIT ?", (limit,)).fetchall()
+    return [{
+        "id": r["id"],
+        "namn": r["name"],
+        "typ": r["type"],
+        "datum": (r["start_date_local"] or "")[:16].replace('T', ' '),
+        "distans": f"{round((r['distance_m'] or 0) / 1000, 2)} km",
+        "tid": f"{round((r['moving_time_s'] or 0) / 60, 0)} min",
+        "puls_snitt": r["avg_hr"] if r["avg_hr"] is not None else 'N/A',
+        "puls_max": r["max_hr"] if r["max_hr"] is not None else 'N/A',
+        "höjdmeter": f"{r['elevation_m'] or 0} m",
+        "tempo": r["pace_text"],
+        "ansträngning": r["suffer_score"] if r["suffer_score"] is not None else 'N/A',
+    } for r in rows]
+
+
+def get_period_summary(period="week", date=None):
+    """Förberäknade totaler per typ för veckan/månaden som innehåller `date`."""
+    _ensure_schema()
+    week_key, month_key = _period_keys((date or datetime.date.today()).isoformat())
+    key = week_key if period == "week" else month_key
+    with get_db_connection() as conn:
+        rows = conn.execute("SELECT * FROM strava_totals WHERE period = ? AND period_key = ? ORDER BY distance_m DESC",
+                            (period, key)).fetchall()
+    return {
+        "period": key,
+        "typer": [{
+            "typ": r["type"],
+            "antal": r["count"],
+            "distans_km": round((r["distance_m"] or 0) / 1000, 1),
+            "tid_h": round((r["moving_time_s"] or 0) / 3600, 1),
+            "höjdmeter": round(r["elevation_m"] or 0),
+        } for r in rows],
+    }
+
+
+def format_summary(summary):
+    if not summary["typer"]:
+        return f"   - {summary['period']}: Inga pass."
+    return "\n".join(
+        f"   - {summary['period']} {t['typ']}: {t['antal']} pass, {t['distans_km']} km, {t['tid_h']} h, {t['höjdmeter']} höjdmeter"
+        for t in summary["typer"]
+    )
+
+
+_sync = None
+
+
+def get_strava_sync():
+    """Delad instans (en synk och ett token-lås för hela backend)."""
+    global _sync
+    if _sync is None:
+        _sync = StravaSync()
+    return _sync
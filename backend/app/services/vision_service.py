@@ -0,0 +1,174 @@
+"""
+==============================================================================
+FILE: app/services/vision_service.py
+DESCRIPTION: Gestyrning som delsystem i server.py. En kameratråd läser
+             bilder och behåller bara den senaste, en analystråd kör
+             gestmotorn på den, och en asyncio-dispatcher skickar gesterna
+             till Home Assistant via den delade HTTP-klienten (med debounce)
+             och publicerar dem som händelser (Socket.IO i server.py).
+==============================================================================
+"""
+import time
+import asyncio
+import threading
+from config.settings import get_config
+
+# Gest -> (entity_id, åtgärd). Entiteterna kan ändras i inställningarna.
+DEFAULT_ACTIONS = {
+    "open_hand": ("VISION_VACUUM_ENTITY", "vacuum.roborock_s5_f528_robot_cleaner", "dock"),
+    "point": ("VISION_LIGHT_ENTITY", "light.kontor_2", "on"),
+}
+CAMERA_INDEXES = [0, 1, -1, 2]
+# Samma gest måste ses i så här många analyserade bilder i rad
+CONFIRM_FRAMES = 2
+# Minsta tid mellan två åtgärder för samma gest (sekunder)
+COOLDOWN = 4.0
+
+
+def open_camera(indexes=CAMERA_INDEXES):
+    import cv2
+    for idx in indexes:
+        cap = cv2.VideoCapture(idx)
+        if cap.isOpened():
+            print(f"[VISION] Kamera hittad på index {idx}")
+            return cap
+        cap.release()
+    return None
+
+
+def gesture_actions(cfg=None):
+    cfg = cfg or get_config()
+    return {g: (cfg.get(key) or default, action) for g, (key, default, action) in DEFAULT_ACTIONS.items()}
+
+
+class LatestFrame:
+    """En plats för den senaste bilden. Äldre bilder skrivs över (ingen kö som växer)."""
+    def __init__(self):
+        self._frame = None
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def put(self, frame):
+        with self._cond:
+            self._frame = frame
+            self._seq += 1
+            self._cond.notify()
+
+    def get(self, after_seq, timeout=1.0):
+        """Väntar på en bild nyare än after_seq. Returnerar (bild, seq) eller (None, after_seq)."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > after_seq, timeout):
+                return None, after_seq
+            return self._frame, self._seq
+
+
+class VisionService:
+    def __init__(self, on_event=None, camera_factory=open_camera):
+        self.on_event = on_event          # async (händelse-dict) -> None
+        self.camera_factory = camera_factory
+        self.latest = LatestFrame()
+        self.running = False
+        self.loop = None
+        self.queue = None
+        self._threads = []
+        self._dispatcher = None
+        self.stats = {"captured": 0, "analyzed": 0, "gestures": 0, "actions": 0}
+
+    # --- LIVSCYKEL ---
+
+    async def start(self):
+        if self.running: return
+        cap = await asyncio.to_thread(self.camera_factory)
+        if cap is None:
+            raise RuntimeError("Ingen kamera hittad. Är USB-kameran i?")
+        self.running = True
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self._threads = [
+            threading.Thread(target=self._capture, args=(cap,), name="vision-capture", daemon=True),
+            threading.Thread(target=self._process, name="vision-process", daemon=True),
+        ]
+        for t in self._threads: t.start()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        print("[VISION] Gestyrning startad.")
+
+    async def stop(self):
+        if not self.running: return
+        self.running = False
+        if self._dispatcher: self._dispatcher.cancel()
+        await asyncio.gather(*(asyncio.to_thread(t.join, 2.0) for t in self._threads))
+        self._threads = []
+        print("[VISION] Gestyrning stoppad.")
+
+    # --- TRÅDAR ---
+
+    def _capture(self, cap):
+        """Läser i kamerans egen takt. Analysen hämtar alltid den nyaste bilden."""
+        try:
+            while self.running:
+                ret, frame = cap.read()
+                if not ret:
+                    time.sleep(1)
+                    continue
+                self.stats["captured"] += 1
+                self.latest.put(frame)
+        finally:
+            cap.release()
+
+    def _process(self):
+        from app.tools.gesture_engine import GestureEngine
+        engine = GestureEngine()
+        seq, candidate, streak = 0, None, 0
+        while self.running:
+            frame, seq = self.latest.get(seq)
+            if frame is None: continue
+            analyzed_before = engine.analyzed
+            try:
+                gesture, fingers = engine.process(frame)
+            except Exception as e:
+                print(f"[VISION] Analysfel: {e}")
+                time.sleep(1)
+                continue
+            self.stats["analyzed"] = engine.analyzed
+            # Debounce: samma gest i flera analyserade bilder i rad (stilla bilder ändrar inget)
+            if engine.analyzed != analyzed_before:
+                streak = streak + 1 if gesture and gesture == candidate else (1 if gesture else 0)
+                candidate = gesture
+                if candidate and streak == CONFIRM_FRAMES:
+                    self.stats["gestures"] += 1
+                    self.loop.call_soon_threadsafe(self.queue.put_nowait, {"gesture": candidate, "fingers": fingers, "ts": time.time()})
+            time.sleep(engine.next_interval())
+
+    # --- ÅTGÄRDER (event-loopen) ---
+
+    async def _dispatch(self):
+        from app.tools.ha_core import run_batch
+        last_action = {}
+        while True:
+            event = await self.queue.get()
+            if event["ts"] - last_action.get(event["gesture"], 0) < COOLDOWN: continue
+            last_action[event["gesture"]] = event["ts"]
+            entity_id, action = (await asyncio.to_thread(gesture_actions)).get(event["gesture"], (None, None))
+            if entity_id:
+                try:
+                    result = (await run_batch([{"entity_id": entity_id, "action": action}]))[0]
+                except Exception as e:
+                    result = {"id": entity_id, "action": action, "ok": False, "error": str(e)}
+                self.stats["actions"] += 1
+                event.update({"entity_id": entity_id, "action": action, "ok": result.get("ok"), "error": result.get("error")})
+                print(f"[VISION] {event['gesture']} ({event['fingers']}) -> {entity_id} {action}: {'OK' if result.get('ok') else result.get('error')}")
+            if self.on_event:
+                try: await self.on_event(event)
+                except Exception as e: print(f"[VISION] Händelsefel: {e}")
+
+
+_service = None
+
+
+def get_vision_service(on_event=None):
+    global _service
+    if _service is None:
+        _service = VisionService(on_event)
+    elif on_event:
+        _service.on_event = on_event
+    return _service
@@ -0,0 +1,125 @@
+"""
+==============================================================================
+FILE: app/services/warmup.py
+DESCRIPTION: Uppvärmning när servern startar. Databasen öppnas först, sedan
+             värms inställningar/prompter, modell-SDK:erna (llm_handler och
+             klienterna) och modellistan parallellt i bakgrunden. Varje del
+             rapporterar status och tid, vilket /health och /ready i
+             server.py visar (Electron väntar på /ready).
+==============================================================================
+"""
+import time
+import asyncio
+import importlib
+
+PENDING, RUNNING, READY, FAILED = "pending", "running", "ready", "failed"
+# /ready väntar högst så här länge (sekunder) på de valfria komponenterna
+OPTIONAL_GRACE = 10.0
+
+
+def _warm_database():
+    from app.core.database import init_db, get_db_connection
+    init_db()
+    with get_db_connection() as conn:
+        conn.execute("SELECT 1").fetchone()
+
+
+def _warm_config():
+    from config.settings import get_config
+    from app.core.database import get_db_prompts
+    get_config()
+    get_db_prompts()
+
+
+async def _warm_providers():
+    # Importen (alla SDK:er och verktyg) körs i en tråd, klienterna skapas i loopen
+    handler = await asyncio.to_thread(importlib.import_module, "app.services.llm_handler")
+    return await handler.warm_providers()
+
+
+def _migrate_images():
+    # Äldre rader med bilden inline (base64) i history.image
+    from app.core.blob_store import migrate_inline_images
+    return migrate_inline_images() or None
+
+
+def _warm_models():
+    from app.services.model_catalog import get_available_models
+    return len(get_available_models())
+
+
+class Warmup:
+    """
+    Komponenter: (namn, funktion, krävs för /ready). Funktionerna är
+    synkrona (körs i en tråd) eller async. Valfria komponenter som
+    misslyckas rapporteras men hindrar inte /ready.
+    """
+    def __init__(self, components=None):
+        self.components = components or [
+            ("database", _warm_database, True),
+            ("config", _warm_config, True),
+            ("providers", _warm_providers, False),
+            ("models", _warm_models, False),
+            ("blobs", _migrate_images, False),
+        ]
+        self.state = {name: {"status": PENDING, "required": required} for name, _, required in self.components}
+        self.started_at = None
+        self.finished_at = None
+        self._task = None
+
+    async def _run_one(self, name, fn):
+        entry = self.state[name]
+        entry["status"] = RUNNING
+        t0 = time.perf_counter()
+        try:
+            result = await fn() if asyncio.iscoroutinefunction(fn) else await asyncio.to_thread(fn)
+            entry["status"] = READY
+            if result is not None and result is not True: entry["detail"] = result
+        except Exception as e:
+            entry["status"] = FAILED
+            entry["error"] = str(e)
+            print(f"[WARMUP] {name} misslyckades: {e}")
+        entry["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+    async def _run_rest(self, rest):
+        await asyncio.gather(*(self._run_one(name, fn) for name, fn, _ in rest))
+        self.finished_at = time.time()
+        timings = ", ".join(f"{n} {self.state[n].get('ms')} ms" for n, _, _ in self.components)
+        print(f"[WARMUP] Klar på {round((self.finished_at - self.started_at) * 1000)} ms ({timings})")
+
+    async def start(self):
+        """Kör första komponenten (databasen) direkt och resten i bakgrunden."""
+        if self.started_at: return
+        self.started_at = time.time()
+        first, *rest = self.components
+        await self._run_one(first[0], first[1])
+        self._task = asyncio.create_task(self._run_rest(rest))
+
+    async def wait(self, timeout=None):
+        if self._task: await asyncio.wait_for(asyncio.shield(self._task), timeout)
+
+    @property
+    def ready(self):
+        """Alla nödvändiga delar klara, och de valfria klara eller OPTIONAL_GRACE passerad."""
+        if not self.started_at: return False
+        if not all(c["status"] == READY for c in self.state.values() if c["required"]): return False
+        return self.finished_at is not None or time.time() - self.started_at > OPTIONAL_GRACE
+
+    def report(self):
+        return {
+            "ready": self.ready,
+            "warming": self.started_at is not None and self.finished_at is None,
+            "uptime_s": round(time.time() - self.started_at, 1) if self.started_at else 0,
+            "warmup_ms": round((self.finished_at - self.started_at) * 1000, 1) if self.finished_at else None,
+            "components": {name: dict(entry) for name, entry in self.state.items()},
+        }
+
+
+_warmup = None
+
+
+def get_warmup():
+    global _warmup
+    if _warmup is None:
+        _warmup = Warmup()
+    return _warmup
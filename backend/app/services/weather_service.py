@@ -0,0 +1,199 @@
+"""
+==============================================================================
+FILE: app/services/weather_service.py
+DESCRIPTION: Cachad väderprognos från Open-Meteo per (lat, lon). Cachen går
+             ut i takt med Open-Meteos uppdateringar (var 15:e minut),
+             samtidiga anrop delar på samma förfrågan och prognosen förnyas i
+             bakgrunden strax innan den går ut. Timvis och dygnsvis data
+             ingår så att följdfrågor ("regnar det ikväll?") inte kostar nya
+             anrop. Fungerar från alla event-loopar och trådar.
+==============================================================================
+"""
+import time
+import asyncio
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+
+API_URL = "https://api.open-meteo.com/v1/forecast"
+REQUEST_TIMEOUT = 10.0
+
+# Open-Meteo räknar om "current" var 15:e minut och publicerar strax efter
+UPDATE_INTERVAL = 900
+PUBLISH_DELAY = 120
+# Förnya i bakgrunden så här långt innan cachen går ut
+PREFETCH_MARGIN = 60
+# Bakgrundsförnyelsen fortsätter bara om prognosen använts nyligen
+KEEP_WARM = 3600
+FORECAST_DAYS = 3
+
+CURRENT_VARS = "temperature_2m,apparent_temperature,weather_code,wind_speed_10m,precipitation"
+HOURLY_VARS = "temperature_2m,precipitation_probability,precipitation,weather_code,wind_speed_10m"
+DAILY_VARS = ("weather_code,temperature_2m_max,temperature_2m_min,precipitation_sum,"
+              "precipitation_probability_max,sunrise,sunset")
+
+
+def next_update(now, interval=UPDATE_INTERVAL, delay=PUBLISH_DELAY):
+    """Tidpunkt då Open-Meteo har nästa uppdatering publicerad."""
+    return ((now - delay) // interval + 1) * interval + delay
+
+
+def _columns(block):
+    """{"time": [...], "x": [...]} -> [{"time": ..., "x": ...}, ...]"""
+    if not block or "time" not in block: return []
+    keys = [k for k in block if isinstance(block[k], list)]
+    return [{k: block[k][i] for k in keys} for i in range(len(block["time"]))]
+
+
+class Forecast:
+    def __init__(self, data, fetched_at, expires_at):
+        self.data = data
+        self.fetched_at = fetched_at
+        self.expires_at = expires_at
+        self.current = data.get("current", {})
+        self.hourly = _columns(data.get("hourly"))   # lokal tid, "2026-10-19T18:00"
+        self.daily = _columns(data.get("daily"))     # "2026-10-19"
+
+    def fresh(self, now=None):
+        return (now or time.time()) < self.expires_at
+
+    def local_now(self):
+        """Platsens lokala tid enligt Open-Meteo (timezone=auto)."""
+        try: return datetime.datetime.fromisoformat(self.current["time"])
+        except Exception: return datetime.datetime.now()
+
+    def hours(self, start=None, count=24):
+        """Timvärden från och med `start` (lokal datetime, standard: nu)."""
+        start = (start or self.local_now()).replace(minute=0, second=0, microsecond=0)
+        key = start.strftime("%Y-%m-%dT%H:%M")
+        return [h for h in self.hourly if h["time"] >= key][:count]
+
+    def window(self, start_hour, end_hour, day_offset=0):
+        """Timvärden mellan två klockslag (end exklusiv), t.ex. kvällen 18-24."""
+        day = (self.local_now() + datetime.timedelta(days=day_offset)).date().isoformat()
+        return [h for h in self.hourly
+                if h["time"][:10] == day and start_hour <= int(h["time"][11:13]) < end_hour]
+
+    def rain_outlook(self, start_hour, end_hour, day_offset=0):
+        """(högsta regnrisk i %, summa nederbörd i mm) för ett tidsfönster, None om det redan passerat."""
+        now_key = self.local_now().strftime("%Y-%m-%dT%H:00")
+        hours = [h for h in self.window(start_hour, end_hour, day_offset) if h["time"] >= now_key]
+        if not hours: return None
+        prob = max((h.get("precipitation_probability") or 0) for h in hours)
+        amount = round(sum((h.get("precipitation") or 0) for h in hours), 1)
+        return prob, amount
+
+
+class WeatherService:
+    def __init__(self):
+        self._entries = {}      # (lat, lon) -> Forecast
+        self._inflight = {}     # (lat, lon) -> concurrent.futures.Future
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="weather")
+        self._client = None
+
+    @staticmethod
+    def _key(lat, lon):
+        return (round(float(lat), 4), round(float(lon), 4))
+
+    def _http(self):
+        if self._client is None:
+            self._client = httpx.Client(timeout=REQUEST_TIMEOUT)
+        return self._client
+
+    # --- HÄMTNING ---
+
+    def _fetch(self, key):
+        lat, lon = key
+        params = {
+            "latitude": lat, "longitude": lon, "timezone": "auto", "wind_speed_unit": "ms",
+            "forecast_days": FORECAST_DAYS, "current": CURRENT_VARS, "hourly": HOURLY_VARS, "daily": DAILY_VARS,
+        }
+        try:
+            response = self._http().get(API_URL, params=params)
+            if response.status_code != 200:
+                raise RuntimeError(f"Felkod: {response.status_code}")
+            data = response.json()
+            now = time.time()
+            interval = data.get("current", {}).get("interval") or UPDATE_INTERVAL
+            forecast = Forecast(data, now, next_update(now, interval))
+            with self._lock:
+                self._entries[key] = forecast
+            self._schedule_prefetch(key, forecast)
+            return forecast
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _start_fetch(self, key):
+        """Samma pågående förfrågan delas av alla anropare. Anropas med låset taget."""
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = self._inflight[key] = self._pool.submit(self._fetch, key)
+        return fut
+
+    def _schedule_prefetch(self, key, forecast):
+        delay = forecast.expires_at - PREFETCH_MARGIN - time.time()
+
+        def refresh():
+            with self._lock:
+                if self._entries.get(key) is not forecast: return   # redan förnyad
+                if time.time() - self._last_used.get(key, 0) > KEEP_WARM: return
+                self._start_fetch(key)
+
+        timer = threading.Timer(max(delay, 0), refresh)
+        timer.daemon = True
+        timer.start()
+
+    def _lookup(self, lat, lon):
+        """(Forecast eller None, Future eller None). Färsk cache ger ingen Future."""
+        key = self._key(lat, lon)
+        now = time.time()
+        with self._lock:
+            self._last_used[key] = now
+            entry = self._entries.get(key)
+            if entry and entry.fresh(now):
+                if entry.expires_at - now < PREFETCH_MARGIN:
+                    self._start_fetch(key)
+                return entry, None
+            return entry, self._start_fetch(key)
+
+    # --- PUBLIKT API ---
+
+    def get(self, lat, lon):
+        """Prognos (blockerande). Misslyckas hämtningen används en äldre prognos om den finns."""
+        entry, fut = self._lookup(lat, lon)
+        if fut is None: return entry
+        try:
+            return fut.result(timeout=REQUEST_TIMEOUT + 5)
+        except Exception as e:
+            if entry:
+                print(f"[WEATHER] Använder äldre prognos: {e}")
+                return entry
+            raise
+
+    async def get_async(self, lat, lon):
+        entry, fut = self._lookup(lat, lon)
+        if fut is None: return entry
+        try:
+            # shield: en avbruten anropare ska inte avbryta hämtningen för de andra
+            return await asyncio.shield(asyncio.wrap_future(fut))
+        except Exception as e:
+            if entry:
+                print(f"[WEATHER] Använder äldre prognos: {e}")
+                return entry
+            raise
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_weather_service():
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = WeatherService()
+        return _service
@@ -0,0 +1,154 @@
+"""
+==============================================================================
+FILE: app/services/withings_service.py
+DESCRIPTION: Lokal historik för Withings. Mätgrupper och aktiviteter sparas
+             i SQLite och hämtas inkrementellt med `lastupdate`, så att trender
+             (vikt, fett %, blodtryck) kan besvaras utan nätverksanrop.
+==============================================================================
+"""
+import time
+import json
+import asyncio
+import datetime
+from app.core.database import get_db_connection
+from app.tools.withings_core import WithingsTool, MEASURE_KEYS
+
+SYNC_INTERVAL = 900
+
+# Namn i trendfrågor -> Withings measure-typ
+TREND_TYPES = {"vikt": 1, "fett": 6, "muskler": 76, "blodtryck_sys": 10, "blodtryck_dia": 9, "puls": 11}
+
+_schema_ready = False
+
+
+def _ensure_schema():
+    global _schema_ready
+    if _schema_ready: return
+    with get_db_connection() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS withings_series (
+            grpid INTEGER, type INTEGER, ts INTEGER, value REAL,
+            PRIMARY KEY (grpid, type))''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_withings_series_type_ts ON withings_series (type, ts)')
+        conn.execute('''CREATE TABLE IF NOT EXISTS withings_activity (
+            date TEXT PRIMARY KEY, steps INTEGER, totalcalories REAL, active INTEGER,
+            hr_average INTEGER, payload TEXT)''')
+        conn.execute('CREATE TABLE IF NOT EXISTS withings_sync (key TEXT PRIMARY KEY, value INTEGER)')
+        conn.commit()
+    _schema_ready = True
+
+
+def _get_lastupdate(key):
+    _ensure_schema()
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT value FROM withings_sync WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else None
+
+
+def _store(groups, activities, synced_at):
+    """Sparar allt i en transaktion och flyttar fram lastupdate för båda serierna."""
+    series = []
+    for grp in groups:
+        for m in grp.get('measures', []):
+            series.append((grp['grpid'], m['type'], grp['date'], m['value'] * (10 ** m['unit'])))
+    acts = [(a['date'], a.get('steps', 0), a.get('totalcalories', 0), a.get('active', 0),
+             a.get('hr_average'), json.dumps(a)) for a in activities if a.get('date')]
+    with get_db_connection() as conn:
+        conn.executemany("INSERT OR REPLACE INTO withings_series (grpid, type, ts, value) VALUES (?, ?, ?, ?)", series)
+        conn.executemany('''INSERT OR REPLACE INTO withings_activity (date, steps, totalcalories, active, hr_average, payload)
+                            VALUES (?, ?, ?, ?, ?, ?)''', acts)
+        conn.executemany("INSERT OR REPLACE INTO withings_sync (key, value) VALUES (?, ?)",
+                         [("measures", synced_at), ("activity", synced_at)])
+        conn.commit()
+    return len(series), len(acts)
+
+
+class WithingsService:
+    def __init__(self, tool=None):
+        self.tool = tool or WithingsTool()
+        self.last_sync = 0
+        self._sync_lock = asyncio.Lock()
+
+    @property
+    def configured(self):
+        return bool(self.tool.refresh_token)
+
+    async def sync(self):
+        """Hämtar mätningar och aktiviteter parallellt, bara det som ändrats sedan förra synken."""
+        async with self._sync_lock:
+            meas_since = await asyncio.to_thread(_get_lastupdate, "measures")
+            act_since = await asyncio.to_thread(_get_lastupdate, "activity")
+            # Första gången: ett år bakåt så att trenderna har något att visa
+            year_ago = int(time.time()) - 365 * 86400
+            started = int(time.time())
+            groups, activities = await asyncio.gather(
+                self.tool.get_measure_groups(lastupdate=meas_since or year_ago),
+                self.tool.get_activities(lastupdate=act_since or year_ago),
+            )
+            n_meas, n_act = await asyncio.to_thread(_store, groups, activities, started)
+            self.last_sync = time.time()
+            if n_meas or n_act: print(f">> [Withings] Synkade {n_meas} mätvärden och {n_act} aktivitetsdagar.")
+
+    async def ensure_synced(self, max_age=SYNC_INTERVAL):
+        if not self.configured or time.time() - self.last_sync < max_age:
+            return
+        try: await self.sync()
+        except Exception as e: print(f">> [Withings] Synkfel: {e}")
+
+
+def get_latest_report():
+    """Senaste värdet per mättyp och dagens aktivitet, direkt från den lokala tabellen."""
+    _ensure_schema()
+    report = {}
+    with get_db_connection() as conn:
+        rows = conn.execute('''SELECT s.type, s.value, s.ts FROM withings_series s
+            JOIN (SELECT type, MAX(ts) AS ts FROM withings_series GROUP BY type) latest
+            ON s.type = latest.type AND s.ts = latest.ts''').fetchall()
+        act = conn.execute("SELECT * FROM withings_activity ORDER BY date DESC LIMIT 1").fetchone()
+    if rows:
+        report['mätning_datum'] = datetime.datetime.fromtimestamp(max(r["ts"] for r in rows)).strftime("%Y-%m-%d %H:%M")
+    for r in rows:
+        key = MEASURE_KEYS.get(r["type"])
+        if key: report[key] = int(r["value"]) if r["type"] in (9, 10, 11) else round(r["value"], 1)
+    if act:
+        report['aktivitet_datum'] = act["date"]
+        report['steg_withings'] = act["steps"]
+        report['kalorier_total'] = act["totalcalories"]
+        report['aktiv_tid'] = round((act["active"] or 0) / 60, 0)
+        if act["hr_average"] is not None: report['snittpuls'] = act["hr_average"]
+    return report
+
+
+def get_trend(metric, weeks=8):
+    """
+    Veckosnitt för en mätserie de senaste `weeks` veckorna.
+    metric: vikt, fett, muskler, blodtryck_sys, blodtryck_dia eller puls.
+    Returnerar [{"vecka": "2026-W42", "snitt": 81.2, "min": ..., "max": ..., "antal": 3}, ...].
+    """
+    mtype = TREND_TYPES.get(metric)
+    if mtype is None: return []
+    _ensure_schema()
+    since = int(time.time()) - weeks * 7 * 86400
+    with get_db_connection() as conn:
+        rows = conn.execute("SELECT ts, value FROM withings_series WHERE type = ? AND ts >= ? ORDER BY ts",
+                            (mtype, since)).fetchall()
+    buckets = {}
+    for r in rows:
+        year, week, _ = datetime.date.fromtimestamp(r["ts"]).isocalendar()
+        buckets.setdefault(f"{year}-W{week:02d}", []).append(r["value"])
+    return [{"vecka": k, "snitt": round(sum(v) / len(v), 1), "min": round(min(v), 1), "max": round(max(v), 1), "antal": len(v)}
+            for k, v in buckets.items()]
+
+
+def format_trend(metric, trend):
+    if not trend: return ""
+    return f"   - {metric}: " + ", ".join(f"{t['vecka']} {t['snitt']}" for t in trend)
+
+
+_service = None
+
+
+def get_withings_service():
+    global _service
+    if _service is None:
+        _service = WithingsService()
+    return _service
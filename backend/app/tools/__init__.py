@@ -1,6 +1,24 @@
-from .gcal_core import create_calendar_event, get_calendar_events
-from .z2m_core import get_sensor_data
-from .ha_core import control_vacuum, get_ha_state, control_light
-from .weather_core import get_weather
-from .withings_core import WithingsTool
-from .code_auditor import run_code_audit
\ No newline at end of file
+"""
+Verktygen laddas först när de används (PEP 562), så att t.ex. paho,
+googleapiclient och OpenCV inte importeras när servern startar.
+"""
+import importlib
+
+_EXPORTS = {
+    "create_calendar_event": "gcal_core", "get_calendar_events": "gcal_core", "get_calendar_agenda": "gcal_core",
+    "get_sensor_data": "z2m_core",
+    "control_vacuum": "ha_core", "get_ha_state": "ha_core", "control_light": "ha_core", "control_entities": "ha_core",
+    "get_weather": "weather_core", "get_weather_sync": "weather_core",
+    "WithingsTool": "withings_core",
+    "run_code_audit": "code_auditor",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,189 @@
+"""
+==============================================================================
+FILE: app/tools/audit_engine.py
+DESCRIPTION: Inkrementell kodanalys. Ett manifest med filernas innehållshash
+             gör att bara ändrade filer analyseras. Filerna delas i bitar med
+             begränsad storlek som skickas parallellt till modellen, och
+             fynden per fil cachas på disk (nyckel = innehållshash).
+==============================================================================
+"""
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from config.settings import BASE_DIR
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../"))
+AUDIT_DIR = os.path.join(BASE_DIR, "logs", "audit")
+MANIFEST_FILE = os.path.join(AUDIT_DIR, "manifest.json")
+FINDINGS_DIR = os.path.join(AUDIT_DIR, "findings")
+
+IGNORED_DIRS = {
+    'venv', 'node_modules', '.git', '__pycache__', 'logs', 'dist', 'build',
+    'garmin_tokens', '.vscode', 'assets', 'site-packages', '__init__', 'frontend'
+}
+ALLOWED_EXTENSIONS = {'.py', '.js', '.jsx', '.html', '.css', '.bat', '.json'}
+IGNORED_FILES = {'package-lock.json', 'service_account.json', 'daa_memory.db', 'DAA_CODE_REVIEW.md'}
+
+# Ungefär 4 tecken per token. Håller varje anrop väl under modellernas gränser.
+MAX_CHUNK_TOKENS = 6000
+CHARS_PER_TOKEN = 4
+MAX_WORKERS = 4
+
+SEPARATOR = "---RAPPORT_START---"
+NO_FINDINGS = "Inga anmärkningar."
+FILE_INSTRUCTION = (
+    "Analysera ENDAST koden nedan (en fil eller en del av en fil). "
+    "Lista konkreta fynd som Markdown-punkter under rubrikerna Säkerhet, Optimering och Förbättringar. "
+    "Märk allvarliga problem med 🔴 och mindre med 🟡. "
+    f"Om det inte finns något att anmärka, svara exakt: {NO_FINDINGS}"
+)
+
+
+def _read_json(path, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return default
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def scan_project(root=PROJECT_ROOT):
+    """{relativ sökväg: absolut sökväg} för alla filer som ska granskas."""
+    files = {}
+    for subdir, dirs, names in os.walk(root):
+        dirs[:] = [d for d in dirs if d not in IGNORED_DIRS]
+        for name in names:
+            if os.path.splitext(name)[1] in ALLOWED_EXTENSIONS and name not in IGNORED_FILES:
+                path = os.path.join(subdir, name)
+                files[os.path.relpath(path, root).replace("\\", "/")] = path
+    return dict(sorted(files.items()))
+
+
+def hash_file(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def chunk_text(rel_path, text, max_tokens=MAX_CHUNK_TOKENS):
+    """Delar en fil på radgränser i bitar om högst ~max_tokens tokens."""
+    limit = max_tokens * CHARS_PER_TOKEN
+    chunks, current, size = [], [], 0
+    for line in text.splitlines(keepends=True):
+        # Extremt långa rader (minifierad kod) delas hårt
+        while len(line) > limit:
+            if current:
+                chunks.append("".join(current)); current, size = [], 0
+            chunks.append(line[:limit]); line = line[limit:]
+        if size + len(line) > limit and current:
+            chunks.append("".join(current)); current, size = [], 0
+        current.append(line); size += len(line)
+    if current: chunks.append("".join(current))
+    total = len(chunks)
+    return [f"--- FIL: {rel_path} (del {i}/{total}) ---\n{c}" for i, c in enumerate(chunks, 1)] or [f"--- FIL: {rel_path} (tom) ---\n"]
+
+
+def _findings_path(content_hash):
+    return os.path.join(FINDINGS_DIR, f"{content_hash}.md")
+
+
+def load_findings(content_hash):
+    try:
+        with open(_findings_path(content_hash), "r", encoding="utf-8") as f:
+            return f.read()
+    except Exception:
+        return None
+
+
+def save_findings(content_hash, text):
+    os.makedirs(FINDINGS_DIR, exist_ok=True)
+    with open(_findings_path(content_hash), "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def analyze_files(paths_by_hash, analyze_fn, max_workers=MAX_WORKERS, on_progress=None):
+    """
+    Analyserar filerna parallellt bit för bit.
+    paths_by_hash: {hash: (rel_path, abs_path)}. analyze_fn(prompt) -> str.
+    Returnerar {hash: fynd} för filer där alla bitar lyckades.
+    """
+    jobs = []
+    for content_hash, (rel, path) in paths_by_hash.items():
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            for idx, chunk in enumerate(chunk_text(rel, f.read())):
+                jobs.append((content_hash, idx, chunk))
+
+    parts, failed = {}, set()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="audit") as pool:
+        futures = {pool.submit(analyze_fn, f"{FILE_INSTRUCTION}\n\n{chunk}"): (h, idx) for h, idx, chunk in jobs}
+        done = 0
+        for fut, (content_hash, idx) in futures.items():
+            try:
+                parts.setdefault(content_hash, {})[idx] = (fut.result() or "").strip()
+            except Exception as e:
+                print(f"[AUDIT] Misslyckades: {paths_by_hash[content_hash][0]} del {idx + 1}: {e}")
+                failed.add(content_hash)
+            done += 1
+            if on_progress: on_progress(done, len(jobs))
+
+    results = {}
+    for content_hash, chunk_results in parts.items():
+        if content_hash in failed: continue
+        texts = [chunk_results[i] for i in sorted(chunk_results) if chunk_results[i] and chunk_results[i] != NO_FINDINGS]
+        findings = "\n\n".join(texts) or NO_FINDINGS
+        save_findings(content_hash, findings)
+        results[content_hash] = findings
+    return results
+
+
+def build_report(manifest, findings_by_path, changed):
+    """Sammanfogar fynden per fil till en rapport med sammanfattning + separator."""
+    with_findings = {p: f for p, f in findings_by_path.items() if f and f != NO_FINDINGS}
+    serious = sum(f.count("🔴") for f in with_findings.values())
+    minor = sum(f.count("🟡") for f in with_findings.values())
+    summary = [
+        f"* Granskade filer: {len(manifest)} (nyanalyserade denna körning: {len(changed)})",
+        f"* Filer med anmärkningar: {len(with_findings)}",
+        f"* Allvarliga fynd (🔴): {serious}, mindre fynd (🟡): {minor}",
+    ]
+    top = sorted(with_findings, key=lambda p: (-with_findings[p].count("🔴"), p))[:5]
+    if top:
+        summary.append("* Mest att åtgärda: " + ", ".join(f"`{p}`" for p in top))
+    sections = [f"## `{p}`\n\n{with_findings[p]}" for p in sorted(with_findings)]
+    return "\n".join(summary) + f"\n\n{SEPARATOR}\n\n# DAA Kodgranskning\n\n" + "\n\n".join(sections) + "\n"
+
+
+def run_incremental_audit(analyze_fn, root=PROJECT_ROOT, on_progress=None, force_report=False):
+    """
+    Kör en inkrementell granskning.
+    Returnerar (rapport, antal filer, antal analyserade filer, antal misslyckade).
+    Rapporten är None om inget har ändrats sedan förra körningen.
+    """
+    files = scan_project(root)
+    manifest = {rel: hash_file(path) for rel, path in files.items()}
+    previous = _read_json(MANIFEST_FILE, {})
+
+    cached = {h: load_findings(h) for h in set(manifest.values())}
+    todo = {h: (rel, files[rel]) for rel, h in manifest.items() if cached.get(h) is None}
+
+    if not todo and manifest == previous and not force_report:
+        return None, len(manifest), 0, 0
+
+    print(f"[AUDIT] {len(manifest)} filer, {len(todo)} nya/ändrade skickas till AI...")
+    fresh = analyze_files(todo, analyze_fn, on_progress=on_progress) if todo else {}
+    cached.update(fresh)
+
+    findings_by_path = {rel: cached.get(h) for rel, h in manifest.items()}
+    failed = [rel for rel, h in manifest.items() if cached.get(h) is None]
+    # Misslyckade filer sparas inte i manifestet så att de försöks igen nästa gång
+    _write_json(MANIFEST_FILE, {rel: h for rel, h in manifest.items() if rel not in failed})
+    changed = [rel for rel, h in manifest.items() if h in fresh]
+    return build_report(manifest, findings_by_path, changed), len(manifest), len(fresh), len(failed)
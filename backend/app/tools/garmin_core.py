@@ -1,7 +1,21 @@
 import os
+import time
 import datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from garminconnect import Garmin
 from config.settings import get_config, BASE_DIR
+from app.utils.metrics import timed
+
+# Metric -> metod på garminconnect-klienten (alla tar ett datum "YYYY-MM-DD")
+ENDPOINTS = {
+    "summary": "get_user_summary",
+    "sleep": "get_sleep_data",
+    "body_battery": "get_body_battery",
+    "hrv": "get_hrv_data",
+}
+FETCH_TIMEOUT = 30   # s per anrop, räknat från att anropet startar (inte från kön)
+
+_fetch_pool = ThreadPoolExecutor(max_workers=len(ENDPOINTS), thread_name_prefix="garmin")
 
 class GarminCoach:
     def __init__(self):
@@ -34,124 +48,167 @@ class GarminCoach:
             print(f">> [Garmin] Login Error: {e}")
             self.client = None
 
-    def get_health_report(self):
+    @timed("tool", op="garmin.fetch_day")
+    def fetch_day(self, date_str, executor=None):
+        """
+        Hämtar rådata för ett datum. Endpoints anropas parallellt i en trådpool
+        eftersom garminconnect-klienten är blockerande.
+        Returnerar {metric: json}. Anrop som misslyckades (fel eller timeout)
+        saknas i resultatet, ett anrop som lyckades utan data ger None.
+        """
+        pool = executor or _fetch_pool
+        started = {}
+
+        def call(metric, method):
+            started[metric] = time.monotonic()
+            return getattr(self.client, method)(date_str)
+
+        futures = {metric: pool.submit(call, metric, method) for metric, method in ENDPOINTS.items()}
+        raw = {}
+        for metric, fut in futures.items():
+            try:
+                raw[metric] = self._wait(fut, started, metric)
+            except Exception as e:
+                print(f">> [GARMIN] {metric} fel: {e}")
+        return raw
+
+    @staticmethod
+    def _wait(fut, started, metric):
+        """Väntar på ett anrop. Tiden i poolens kö räknas inte in i FETCH_TIMEOUT."""
+        while True:
+            start = started.get(metric)
+            left = FETCH_TIMEOUT if start is None else start + FETCH_TIMEOUT - time.monotonic()
+            try:
+                return fut.result(timeout=max(left, 0))
+            except FutureTimeout:
+                if metric in started and time.monotonic() - started[metric] >= FETCH_TIMEOUT:
+                    raise TimeoutError(f"inget svar på {FETCH_TIMEOUT}s")
+
+    @timed("tool", op="garmin.get_health_report")
+    def get_health_report(self, date_str=None):
         if not self.client:
             if self.email and self.password: self._login()
             if not self.client: return {"fel": "Ej inloggad på Garmin."}
 
         try:
-            today_str = datetime.date.today().isoformat()
-            print(f">> [GARMIN] Hämtar ALL data för: {today_str}")
-            
-            # --- 1. DAGLIG SAMMANFATTNING (Steg, Puls, Kalorier) ---
-            stats = self.client.get_user_summary(today_str)
-            
-            # --- 2. DETALJERAD SÖMN & SÖMNPOÄNG ---
-            sleep_str = "0h"
-            rem_str = "0h"
-            deep_str = "0h"
-            sleep_score = "N/A"
-            try:
-                sleep_data = self.client.get_sleep_data(today_str)
-                if sleep_data and 'dailySleepDTO' in sleep_data:
-                    dto = sleep_data['dailySleepDTO']
-                    total_sleep_sec = dto.get('sleepTimeSeconds', 0)
-                    # Fallback om detaljerad tid saknas
-                    if total_sleep_sec == 0: total_sleep_sec = stats.get("sleepingSeconds", 0)
-
-                    sleep_str = f"{int(total_sleep_sec // 3600)}h {int((total_sleep_sec % 3600) // 60)}m"
-                    rem_str = f"{round(dto.get('remSleepSeconds', 0) / 3600, 1)}h"
-                    deep_str = f"{round(dto.get('deepSleepSeconds', 0) / 3600, 1)}h"
-                    
-                    # Hämta Sleep Score (Kvalitet)
-                    if 'sleepScores' in dto and dto['sleepScores']:
-                        sleep_score = dto['sleepScores'].get('overall', {}).get('value', 'N/A')
-            except Exception as e:
-                print(f">> [GARMIN] Sömnfel: {e}")
+            date_str = date_str or datetime.date.today().isoformat()
+            print(f">> [GARMIN] Hämtar ALL data för: {date_str}")
+            return build_health_report(date_str, self.fetch_day(date_str))
+        except Exception as e:
+            print(f">> [Garmin] Fetch Error: {e}")
+            return {"fel": f"Systemfel: {e}"}
 
-            # --- 3. BODY BATTERY (Energi) ---
-            bb_now = "N/A"
-            bb_high = "N/A"
-            bb_low = "N/A"
-            try:
-                bb_data = self.client.get_body_battery(today_str)
-                # Kollar om vi fick en lista direkt eller en lista inuti en dict (som din logg visade)
-                if bb_data:
-                    values = []
-                    # Fall A: Din loggstruktur (lista inuti dict)
-                    if isinstance(bb_data, list) and len(bb_data) > 0 and 'bodyBatteryValuesArray' in bb_data[0]:
-                         values = [pair[1] for pair in bb_data[0]['bodyBatteryValuesArray'] if pair and len(pair) > 1]
-                    # Fall B: Vanlig lista (om formatet varierar)
-                    elif isinstance(bb_data, list):
-                         values = [x['value'] for x in bb_data if isinstance(x, dict) and x.get('value') is not None]
-
-                    if values:
-                        bb_now = values[-1]  # Sista värdet = Nu
-                        bb_high = max(values)
-                        bb_low = min(values)
-                        print(f">> [GARMIN] Body Battery: {bb_now}")
-            except Exception as e:
-                print(f">> [GARMIN] Body Battery fel: {e}")
 
-            # --- 4. HRV STATUS (FIXAD) ---
-            hrv_status = "N/A"
-            try:
-                hrv = self.client.get_hrv_data(today_str)
-                if hrv and 'hrvSummary' in hrv:
-                    summary = hrv['hrvSummary']
-                    status = summary.get('status') # T.ex "BALANCED"
-                    avg = summary.get('weeklyAvg') # <-- RÄTT NYCKEL HÄR (Var weeklyAverage)
-                    last = summary.get('lastNightAvg') # Vi lägger till nattens värde också!
-                    
-                    if status:
-                        hrv_text = status
-                        if last: hrv_text += f" (I natt: {last} ms"
-                        if avg: hrv_text += f", Snitt: {avg} ms)"
-                        else: hrv_text += ")"
-                        hrv_status = hrv_text
-                        print(f">> [GARMIN] HRV: {hrv_status}")
-            except Exception as e:
-                print(f">> [GARMIN] HRV Fel: {e}")
+def build_health_report(today_str, raw):
+    """Bygger den sammanställda hälsorapporten från rådata (se GarminCoach.fetch_day)."""
+    try:
+        # --- 1. DAGLIG SAMMANFATTNING (Steg, Puls, Kalorier) ---
+        stats = raw.get("summary") or {}
 
-            if not stats:
-                return {"fel": "Ingen data från Garmin idag (synka klockan)."}
+        # --- 2. DETALJERAD SÖMN & SÖMNPOÄNG ---
+        sleep_str = "0h"
+        rem_str = "0h"
+        deep_str = "0h"
+        sleep_score = "N/A"
+        try:
+            sleep_data = raw.get("sleep")
+            if sleep_data and 'dailySleepDTO' in sleep_data:
+                dto = sleep_data['dailySleepDTO']
+                total_sleep_sec = dto.get('sleepTimeSeconds', 0)
+                # Fallback om detaljerad tid saknas
+                if total_sleep_sec == 0: total_sleep_sec = stats.get("sleepingSeconds", 0)
 
-            # --- SAMMANSTÄLLNING ---
-            data = {
-                "datum": today_str,
-                "steg": stats.get("totalSteps", 0),
-                "mål_steg": stats.get("dailyStepGoal", 0),
-                "distans_km": round(stats.get("totalDistanceMeters", 0) / 1000, 2),
-                
-                # Hjärta & Stress
-                "vilopuls": stats.get("restingHeartRate", "N/A"),
-                "stress_snitt": stats.get("averageStressLevel", "N/A"),
-                "stress_max": stats.get("maxStressLevel", "N/A"),
-                "hrv_status": hrv_status,
-                
-                # Energi (Body Battery)
-                "body_battery_nu": bb_now,
-                "body_battery_högst": bb_high,
-                "body_battery_lägst": bb_low,
+                sleep_str = f"{int(total_sleep_sec // 3600)}h {int((total_sleep_sec % 3600) // 60)}m"
+                rem_str = f"{round(dto.get('remSleepSeconds', 0) / 3600, 1)}h"
+                deep_str = f"{round(dto.get('deepSleepSeconds', 0) / 3600, 1)}h"
                 
-                # Sömn
-                "sömn_timmar": sleep_str,
-                "sömn_poäng": sleep_score, 
-                "rem_sömn": rem_str,
-                "djup_sömn": deep_str,
+                # Hämta Sleep Score (Kvalitet)
+                if 'sleepScores' in dto and dto['sleepScores']:
+                    sleep_score = dto['sleepScores'].get('overall', {}).get('value', 'N/A')
+        except Exception as e:
+            print(f">> [GARMIN] Sömnfel: {e}")
+
+        # --- 3. BODY BATTERY (Energi) ---
+        bb_now = "N/A"
+        bb_high = "N/A"
+        bb_low = "N/A"
+        try:
+            bb_data = raw.get("body_battery")
+            # Kollar om vi fick en lista direkt eller en lista inuti en dict (som din logg visade)
+            if bb_data:
+                values = []
+                # Fall A: Din loggstruktur (lista inuti dict)
+                if isinstance(bb_data, list) and len(bb_data) > 0 and 'bodyBatteryValuesArray' in bb_data[0]:
+                     values = [pair[1] for pair in bb_data[0]['bodyBatteryValuesArray'] if pair and len(pair) > 1]
+                # Fall B: Vanlig lista (om formatet varierar)
+                elif isinstance(bb_data, list):
+                     values = [x['value'] for x in bb_data if isinstance(x, dict) and x.get('value') is not None]
+
+                if values:
+                    bb_now = values[-1]  # Sista värdet = Nu
+                    bb_high = max(values)
+                    bb_low = min(values)
+        except Exception as e:
+            print(f">> [GARMIN] Body Battery fel: {e}")
+
+        # --- 4. HRV STATUS (FIXAD) ---
+        hrv_status = "N/A"
+        try:
+            hrv = raw.get("hrv")
+            if hrv and 'hrvSummary' in hrv:
+                summary = hrv['hrvSummary']
+                status = summary.get('status') # T.ex "BALANCED"
+                avg = summary.get('weeklyAvg') # <-- RÄTT NYCKEL HÄR (Var weeklyAverage)
+                last = summary.get('lastNightAvg') # Vi lägger till nattens värde också!
                 
-                # Kalorier & Aktivitet
-                "kalorier_totalt": stats.get("totalKilocalories", 0),
-                "intensiva_minuter": stats.get("activeSeconds", 0) / 60,
-                "spo2_snitt": stats.get("averageSpO2Value", "N/A"),
-            }
+                if status:
+                    hrv_text = status
+                    if last: hrv_text += f" (I natt: {last} ms"
+                    if avg: hrv_text += f", Snitt: {avg} ms)"
+                    else: hrv_text += ")"
+                    hrv_status = hrv_text
+        except Exception as e:
+            print(f">> [GARMIN] HRV Fel: {e}")
+
+        if not stats:
+            return {"fel": "Ingen data från Garmin idag (synka klockan)."}
+
+        # --- SAMMANSTÄLLNING ---
+        data = {
+            "datum": today_str,
+            "steg": stats.get("totalSteps", 0),
+            "mål_steg": stats.get("dailyStepGoal", 0),
+            "distans_km": round(stats.get("totalDistanceMeters", 0) / 1000, 2),
+            
+            # Hjärta & Stress
+            "vilopuls": stats.get("restingHeartRate", "N/A"),
+            "stress_snitt": stats.get("averageStressLevel", "N/A"),
+            "stress_max": stats.get("maxStressLevel", "N/A"),
+            "hrv_status": hrv_status,
+            
+            # Energi (Body Battery)
+            "body_battery_nu": bb_now,
+            "body_battery_högst": bb_high,
+            "body_battery_lägst": bb_low,
             
-            # Korrigera intensiva minuter om detaljerad info finns
-            if "moderateIntensityMinutes" in stats and "vigorousIntensityMinutes" in stats:
-                data["intensiva_minuter"] = stats["moderateIntensityMinutes"] + (stats["vigorousIntensityMinutes"] * 2)
+            # Sömn
+            "sömn_timmar": sleep_str,
+            "sömn_poäng": sleep_score, 
+            "rem_sömn": rem_str,
+            "djup_sömn": deep_str,
+            
+            # Kalorier & Aktivitet
+            "kalorier_totalt": stats.get("totalKilocalories", 0),
+            "intensiva_minuter": stats.get("activeSeconds", 0) / 60,
+            "spo2_snitt": stats.get("averageSpO2Value", "N/A"),
+        }
+        
+        # Korrigera intensiva minuter om detaljerad info finns
+        if "moderateIntensityMinutes" in stats and "vigorousIntensityMinutes" in stats:
+            data["intensiva_minuter"] = stats["moderateIntensityMinutes"] + (stats["vigorousIntensityMinutes"] * 2)
 
-            return data
+        return data
 
-        except Exception as e:
-            print(f">> [Garmin] Fetch Error: {e}")
-            return {"fel": f"Systemfel: {e}"}
\ No newline at end of file
+    except Exception as e:
+        print(f">> [Garmin] Parse Error: {e}")
+        return {"fel": f"Systemfel: {e}"}
\ No newline at end of file
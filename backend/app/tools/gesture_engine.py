@@ -0,0 +1,155 @@
+"""
+==============================================================================
+FILE: app/tools/gesture_engine.py
+DESCRIPTION: Handgester från kamerabilder. Fingrar räknas med convexity
+             defects där vinklarna beräknas med NumPy för alla defekter på en
+             gång. Bildrutor där rutan i mitten (ROI) inte ändrats hoppas
+             över, och bildfrekvensen sänks när inget händer.
+==============================================================================
+"""
+import time
+import cv2
+import numpy as np
+
+ROI_SIZE = 300
+# Hudfärg i HSV. Justera om handen inte syns (standard för rumsbelysning).
+SKIN_LOWER = np.array([0, 20, 70], dtype=np.uint8)
+SKIN_UPPER = np.array([20, 255, 255], dtype=np.uint8)
+# Motsvarar den tidigare 4 x dilate (3x3) + GaussianBlur (5x5): en enda
+# rektangulär dilate som OpenCV kör separabelt (rad + kolumn).
+MASK_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (13, 13))
+MIN_HAND_AREA = 10000
+MAX_GAP_ANGLE = 90  # grader, skarpare vinkel = mellanrum mellan fingrar
+
+# Frame differencing: medelförändring (0-255) i nedskalad gråskala-ROI
+MOTION_SIZE = (64, 64)
+MOTION_THRESHOLD = 4.0
+# Även en stillastående bild analyseras så här ofta (sekunder)
+MAX_STATIC_SKIP = 2.0
+
+# Adaptiv bildfrekvens
+ACTIVE_FPS = 15
+IDLE_FPS = 3
+IDLE_AFTER = 3.0  # sekunder utan rörelse/hand innan vi går ner i takt
+
+GESTURES = {"open_hand": "🖐️ Öppen hand", "point": "☝️ Peka"}
+
+
+def extract_roi(frame, size=ROI_SIZE):
+    """Kvadratisk ruta i mitten av bilden (minskar felkällor från bakgrunden)."""
+    h, w = frame.shape[:2]
+    size = min(size, h, w)
+    x, y = (w - size) // 2, (h - size) // 2
+    return frame[y:y + size, x:x + size]
+
+
+def skin_mask(roi):
+    hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, SKIN_LOWER, SKIN_UPPER)
+    return cv2.dilate(mask, MASK_KERNEL)
+
+
+def find_hand(mask, min_area=MIN_HAND_AREA):
+    """Största yttre konturen om den är stor nog, annars None."""
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours: return None
+    areas = [cv2.contourArea(c) for c in contours]
+    best = int(np.argmax(areas))
+    return contours[best] if areas[best] > min_area else None
+
+
+def defect_angles(contour, defects):
+    """Vinkeln (grader) vid varje defekt, beräknad för alla defekter samtidigt."""
+    # reshape: formen skiljer mellan OpenCV-versioner ((N, 1, 4) eller (N, 4))
+    idx = defects.reshape(-1, 4)[:, :3]
+    pts = contour.reshape(-1, 2).astype(np.float32)
+    start, end, far = pts[idx[:, 0]], pts[idx[:, 1]], pts[idx[:, 2]]
+    a = np.linalg.norm(end - start, axis=1)
+    b = np.linalg.norm(far - start, axis=1)
+    c = np.linalg.norm(end - far, axis=1)
+    denom = 2 * b * c
+    # Degenererad defekt (sida med längd 0): 180 grader, räknas aldrig som mellanrum (som den gamla loopen)
+    cos = np.divide(b * b + c * c - a * a, denom, out=np.full_like(denom, -1.0), where=denom > 0)
+    return np.degrees(np.arccos(np.clip(cos, -1.0, 1.0)))
+
+
+def count_fingers(contour):
+    """Antal fingrar (mellanrum + 1), None om konturen saknar defekter."""
+    hull = cv2.convexHull(contour, returnPoints=False)
+    if hull is None or len(hull) < 3: return None
+    try:
+        defects = cv2.convexityDefects(contour, hull)
+    except cv2.error:
+        # Händer för självkorsande konturer
+        return None
+    if defects is None: return None
+    return int(np.count_nonzero(defect_angles(contour, defects) <= MAX_GAP_ANGLE)) + 1
+
+
+def classify(fingers):
+    if fingers is None: return None
+    if fingers >= 4: return "open_hand"
+    if fingers in (1, 2): return "point"
+    # 0 fingrar (knytnäve) går inte att skilja ut med den här metoden
+    return None
+
+
+class MotionGate:
+    """Säger om ROI:n ändrats sedan senast analyserade bild."""
+    def __init__(self, threshold=MOTION_THRESHOLD, max_skip=MAX_STATIC_SKIP):
+        self.threshold = threshold
+        self.max_skip = max_skip
+        self.previous = None
+        self.last_pass = 0.0
+        self.moved = False   # verklig rörelse (inte bara en tvingad kontroll)
+
+    def changed(self, roi, now=None):
+        now = now or time.monotonic()
+        small = cv2.resize(cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY), MOTION_SIZE, interpolation=cv2.INTER_AREA)
+        self.moved = self.previous is None or float(cv2.absdiff(small, self.previous).mean()) > self.threshold
+        if self.moved or now - self.last_pass > self.max_skip:
+            self.previous = small
+            self.last_pass = now
+            return True
+        return False
+
+
+class AdaptiveRate:
+    """Full takt när något händer, låg takt när bilden är stilla och ingen hand syns."""
+    def __init__(self, active_fps=ACTIVE_FPS, idle_fps=IDLE_FPS, idle_after=IDLE_AFTER):
+        self.active_interval = 1.0 / active_fps
+        self.idle_interval = 1.0 / idle_fps
+        self.idle_after = idle_after
+        self.last_activity = time.monotonic()
+
+    def interval(self, active, now=None):
+        now = now or time.monotonic()
+        if active: self.last_activity = now
+        return self.active_interval if now - self.last_activity < self.idle_after else self.idle_interval
+
+
+class GestureEngine:
+    """process(frame) -> (gest eller None, antal fingrar eller None). next_interval() ger väntetiden."""
+    def __init__(self, use_motion_gate=True, adaptive=True):
+        self.gate = MotionGate() if use_motion_gate else None
+        self.rate = AdaptiveRate() if adaptive else None
+        self.frames = 0
+        self.analyzed = 0
+        self.active = True
+
+    def process(self, frame):
+        self.frames += 1
+        roi = extract_roi(frame)
+        if self.gate and not self.gate.changed(roi):
+            self.active = False
+            return None, None
+        self.analyzed += 1
+        hand = find_hand(skin_mask(roi))
+        fingers = count_fingers(hand) if hand is not None else None
+        self.active = (self.gate is None or self.gate.moved) or fingers is not None
+        return classify(fingers), fingers
+
+    def next_interval(self):
+        """Väntetid till nästa bild: kort när något händer, längre när det är stilla."""
+        if self.rate is None: return 0.0
+        return self.rate.interval(self.active)
@@ -1,6 +1,9 @@
+import asyncio
 import httpx
 from config.settings import get_config
+from app.utils.http_pool import get_http_client
 from .formatter import format_temp_for_speech
+from app.utils.metrics import timed
 
 """
 ==============================================================================
@@ -12,56 +15,156 @@ cfg = get_config()
 HA_URL = cfg.get("HA_BASE_URL")
 HA_TOKEN = cfg.get("HA_TOKEN")
 
+# Översättning från DAA:s enkla kommandon till Home Assistant-tjänster
+SWITCH_SERVICES = {"on": "turn_on", "off": "turn_off", "toggle": "toggle"}
+VACUUM_SERVICES = {"dock": "return_to_base"}
+
+# Hur en utförd åtgärd läses upp i svaret
+ACTION_WORDS = {"on": "tänd", "off": "släckt", "toggle": "växlad", "start": "startad",
+                "stop": "stoppad", "pause": "pausad", "dock": "på väg hem"}
+
+
+def _headers():
+    return {"Authorization": f"Bearer {HA_TOKEN}", "Content-Type": "application/json"}
+
+
+def _resolve_service(domain, action):
+    """Mappar t.ex. ('light', 'on') -> 'turn_on' och ('vacuum', 'dock') -> 'return_to_base'."""
+    if domain == "vacuum":
+        return VACUUM_SERVICES.get(action, action)
+    return SWITCH_SERVICES.get(action, action)
+
+
+@timed("tool")
 async def get_ha_state(entity_id: str):
     """
     Hämtar status från Home Assistant och formaterar temperaturer för tal.
     """
     url = f"{HA_URL}/api/states/{entity_id}"
-    headers = {
-        "Authorization": f"Bearer {HA_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, headers=headers, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                state = data.get("state")
-                unit = data.get("attributes", {}).get("unit_of_measurement", "")
-
-                # Om det är en temperatur, formatera för tal
-                if unit == "°C" or "temperature" in entity_id.lower():
-                    return f"Status för {entity_id} är {format_temp_for_speech(state)}."
-                
-                return f"Status för {entity_id} är {state} {unit}."
-            return f"Kunde inte hitta status för {entity_id}."
-        except Exception as e:
-            return f"Fel vid anrop till HA: {str(e)}"
+    client = get_http_client()
+    try:
+        response = await client.get(url, headers=_headers(), timeout=5)
+        if response.status_code == 200:
+            data = response.json()
+            state = data.get("state")
+            unit = data.get("attributes", {}).get("unit_of_measurement", "")
+
+            # Om det är en temperatur, formatera för tal
+            if unit == "°C" or "temperature" in entity_id.lower():
+                return f"Status för {entity_id} är {format_temp_for_speech(state)}."
 
+            return f"Status för {entity_id} är {state} {unit}."
+        return f"Kunde inte hitta status för {entity_id}."
+    except Exception as e:
+        return f"Fel vid anrop till HA: {str(e)}"
+
+@timed("tool")
 async def control_vacuum(entity_id: str, action: str):
     """Styr dammsugaren: start, stop, pause, dock."""
     url = f"{HA_URL}/api/services/vacuum/{action}"
-    headers = {"Authorization": f"Bearer {HA_TOKEN}"}
-    data = {"entity_id": entity_id}
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            await client.post(url, headers=headers, json=data, timeout=5)
-            return f"Dammsugaren {action} utförd."
-        except:
-            return "Kunde inte styra dammsugaren."
+    client = get_http_client()
+    try:
+        await client.post(url, headers=_headers(), json={"entity_id": entity_id}, timeout=5)
+        return f"Dammsugaren {action} utförd."
+    except:
+        return "Kunde inte styra dammsugaren."
 
+@timed("tool")
 async def control_light(entity_id: str, action: str):
     """Styr belysning: on, off."""
     service = "turn_on" if action == "on" else "turn_off"
     url = f"{HA_URL}/api/services/light/{service}"
-    headers = {"Authorization": f"Bearer {HA_TOKEN}"}
-    data = {"entity_id": entity_id}
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            await client.post(url, headers=headers, json=data, timeout=5)
-            return f"Ljuset är nu {action}."
-        except:
-            return "Kunde inte styra ljuset."
\ No newline at end of file
+    client = get_http_client()
+    try:
+        await client.post(url, headers=_headers(), json={"entity_id": entity_id}, timeout=5)
+        return f"Ljuset är nu {action}."
+    except:
+        return "Kunde inte styra ljuset."
+
+# --- BATCH-STYRNING ---
+
+async def _call_service(domain, service, target):
+    """Ett enda tjänsteanrop mot HA. Returnerar listan med ändrade states."""
+    url = f"{HA_URL}/api/services/{domain}/{service}"
+    response = await get_http_client().post(url, headers=_headers(), json=target, timeout=5)
+    response.raise_for_status()
+    try: return response.json()
+    except: return []
+
+@timed("tool")
+async def run_batch(actions):
+    """
+    Utför flera åtgärder på en gång.
+    actions: lista av {"entity_id": ..., "action": ...} eller
+             {"area_id": ..., "domain": ..., "action": ...}.
+    Enheter med samma domän och tjänst slås ihop till ETT anrop med en
+    entity-lista, och alla grupper skickas parallellt.
+    Returnerar en lista med resultat per enhet/område.
+    """
+    groups = {}
+    for item in actions:
+        action = str(item.get("action", "")).lower()
+        if item.get("area_id"):
+            domain = item.get("domain") or "light"
+            key = (domain, _resolve_service(domain, action), "area_id")
+            groups.setdefault(key, {"action": action, "ids": []})["ids"].append(item["area_id"])
+        elif item.get("entity_id"):
+            domain = item["entity_id"].split(".", 1)[0]
+            key = (domain, _resolve_service(domain, action), "entity_id")
+            groups.setdefault(key, {"action": action, "ids": []})["ids"].append(item["entity_id"])
+
+    keys = list(groups.keys())
+    calls = [_call_service(domain, service, {target: groups[(domain, service, target)]["ids"]})
+             for domain, service, target in keys]
+    responses = await asyncio.gather(*calls, return_exceptions=True)
+
+    results = []
+    for (domain, service, target), resp in zip(keys, responses):
+        group = groups[(domain, service, target)]
+        if isinstance(resp, Exception):
+            error = f"HTTP {resp.response.status_code}" if isinstance(resp, httpx.HTTPStatusError) else str(resp)
+            for target_id in group["ids"]:
+                results.append({"id": target_id, "action": group["action"], "ok": False, "error": error})
+            continue
+        if target == "area_id":
+            # HA svarar med de states som ändrades, dvs. vilka enheter området innehöll
+            changed = [s.get("entity_id") for s in resp if isinstance(s, dict)] if isinstance(resp, list) else []
+            for area in group["ids"]:
+                results.append({"id": area, "action": group["action"], "ok": True, "entities": changed})
+        else:
+            for entity_id in group["ids"]:
+                results.append({"id": entity_id, "action": group["action"], "ok": True})
+    return results
+
+def format_batch_results(results):
+    """Slår ihop resultaten per enhet till ett kort, talvänligt svar."""
+    if not results:
+        return "Inga enheter angavs."
+    ok = [r for r in results if r["ok"]]
+    failed = [r for r in results if not r["ok"]]
+    parts = []
+    if ok:
+        done = []
+        for r in ok:
+            word = ACTION_WORDS.get(r["action"], r["action"])
+            if "entities" in r:
+                done.append(f"området {r['id']} {word} ({len(r['entities'])} enheter)")
+            else:
+                done.append(f"{r['id']} {word}")
+        parts.append(f"Utfört {len(ok)} av {len(results)}: " + ", ".join(done) + ".")
+    if failed:
+        parts.append("Misslyckades: " + ", ".join(f"{r['id']} ({r['error']})" for r in failed) + ".")
+    return " ".join(parts)
+
+@timed("tool")
+async def control_entities(action: str, entity_ids=None, area_ids=None, domain: str = "light"):
+    """
+    Styr många enheter eller hela områden med samma åtgärd i ett svep,
+    t.ex. "släck alla lampor på nedervåningen".
+    """
+    actions = [{"entity_id": e, "action": action} for e in (entity_ids or [])]
+    actions += [{"area_id": a, "domain": domain, "action": action} for a in (area_ids or [])]
+    try:
+        return format_batch_results(await run_batch(actions))
+    except Exception as e:
+        return f"Fel vid anrop till HA: {str(e)}"
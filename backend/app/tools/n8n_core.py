@@ -3,10 +3,12 @@ import json
 import asyncio
 import logging
 from config.settings import get_config
+from app.utils.metrics import timed
 
 # Vi sätter upp loggning så det syns i terminalen
 logger = logging.getLogger(__name__)
 
+@timed("tool")
 async def trigger_n8n_webhook(webhook_slug: str, payload_str: str = "{}"):
     """
     Anropar en n8n webhook (POST).
@@ -1,9 +1,49 @@
-import httpx
+import asyncio
 import time
 from config.settings import get_config
 from app.core.database import save_db_setting
+from app.utils.http_pool import get_http_client
+from app.utils.metrics import timed
+
+API_BASE = "https://www.strava.com/api/v3"
+
+
+def format_pace(speed_ms, act_type):
+    """Tempo som text: min/km för löpning, km/h för allt annat."""
+    if not speed_ms or speed_ms <= 0:
+        return "0 km/h"
+    if act_type == 'Run':
+        # Min/km för löpning
+        pace_decimal = 16.666666666667 / speed_ms
+        p_min = int(pace_decimal)
+        p_sec = int((pace_decimal - p_min) * 60)
+        return f"{p_min}:{p_sec:02d} min/km"
+    # Km/h för cykling/annat
+    return f"{round(speed_ms * 3.6, 1)} km/h"
+
+
+def format_activity(act):
+    """Gör om en aktivitet från Strava-API:t till DAA:s format."""
+    return {
+        "id": act.get('id'),
+        "namn": act.get('name', 'Namnlöst pass'),
+        "typ": act.get('type', 'Okänd'),
+        "datum": act.get('start_date_local', '')[:16].replace('T', ' '),
+        "distans": f"{round(act.get('distance', 0) / 1000, 2)} km",
+        "tid": f"{round(act.get('moving_time', 0) / 60, 0)} min",
+        "puls_snitt": act.get('average_heartrate', 'N/A'),
+        "puls_max": act.get('max_heartrate', 'N/A'),
+        "höjdmeter": f"{act.get('total_elevation_gain', 0)} m",
+        "tempo": format_pace(act.get('average_speed', 0), act.get('type')),
+        "ansträngning": act.get('suffer_score', 'N/A')
+    }
+
 
 class StravaTool:
+    # Delas av alla instanser: Strava roterar refresh-token vid varje förnyelse,
+    # så två samtidiga förnyelser skulle annars skriva över varandras token.
+    _refresh_lock = asyncio.Lock()
+
     def __init__(self):
         cfg = get_config()
         self.client_id = cfg.get("STRAVA_CLIENT_ID")
@@ -17,94 +57,77 @@ class StravaTool:
         if time.time() < self.expires_at and self.access_token:
             return True
 
-        url = "https://www.strava.com/api/v3/oauth/token"
-        payload = {
-            'client_id': self.client_id,
-            'client_secret': self.client_secret,
-            'refresh_token': self.refresh_token,
-            'grant_type': 'refresh_token'
-        }
-        
-        try:
-            print(f">> [STRAVA] Försöker förnya token...")
-            async with httpx.AsyncClient() as client:
-                r = await client.post(url, data=payload)
+        async with self._refresh_lock:
+            # Någon annan kan ha förnyat medan vi väntade på låset
+            if time.time() < self.expires_at and self.access_token:
+                return True
+            # ...eller en annan instans kan ha roterat refresh-tokenet i DB
+            self.refresh_token = get_config().get("STRAVA_REFRESH_TOKEN") or self.refresh_token
+
+            url = f"{API_BASE}/oauth/token"
+            payload = {
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'refresh_token': self.refresh_token,
+                'grant_type': 'refresh_token'
+            }
+
+            try:
+                print(f">> [STRAVA] Försöker förnya token...")
+                r = await get_http_client().post(url, data=payload)
                 data = r.json()
-                
+
                 if r.status_code == 200:
                     self.access_token = data['access_token']
                     self.expires_at = data['expires_at']
                     self.refresh_token = data['refresh_token']
-                    
+
                     # VIKTIGT: Spara nya refresh token till DB så vi inte blir utloggade
-                    save_db_setting("STRAVA_REFRESH_TOKEN", self.refresh_token)
+                    await asyncio.to_thread(save_db_setting, "STRAVA_REFRESH_TOKEN", self.refresh_token)
                     print(f">> [STRAVA] Token förnyad och sparad.")
                     return True
                 else:
                     print(f">> [STRAVA] Token Error: {data}")
                     return False
-        except Exception as e:
-            print(f">> [STRAVA] Connection Error: {e}")
-            return False
+            except Exception as e:
+                print(f">> [STRAVA] Connection Error: {e}")
+                return False
+
+    @timed("tool", op="strava.fetch_activities")
+    async def fetch_activities(self, after=None, page=1, per_page=100):
+        """
+        Hämtar en sida råa aktiviteter. Med `after` (unix-tid) returneras bara
+        pass som startat efter den tidpunkten, äldst först.
+        Kastar RuntimeError om inloggning eller anrop misslyckas.
+        """
+        if not await self._refresh_access_token():
+            raise RuntimeError("Kunde inte logga in på Strava. Kontrollera Client ID/Secret.")
 
+        params = {"per_page": per_page, "page": page}
+        if after is not None:
+            params["after"] = int(after)
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        r = await get_http_client().get(f"{API_BASE}/athlete/activities", headers=headers, params=params)
+        if r.status_code != 200:
+            raise RuntimeError(f"Strava API svarade {r.status_code}")
+        return r.json()
+
+    @timed("tool", op="strava.get_health_report")
     async def get_health_report(self, limit=5):
         """Hämtar detaljerad data om de senaste träningspassen."""
         if not self.refresh_token: 
             return {"error": "Ingen Strava-nyckel konfigurerad."}
 
-        if not await self._refresh_access_token():
-            return {"error": "Kunde inte logga in på Strava. Kontrollera Client ID/Secret."}
-
         try:
-            url = "https://www.strava.com/api/v3/athlete/activities"
-            headers = {"Authorization": f"Bearer {self.access_token}"}
-            params = {"per_page": limit}
-            
             print(f">> [STRAVA] Hämtar aktiviteter...")
-            async with httpx.AsyncClient() as client:
-                r = await client.get(url, headers=headers, params=params)
-                
-            if r.status_code == 200:
-                activities = r.json()
-                if not activities:
-                    return {"error": "Inga aktiviteter hittades på Strava."}
-                    
-                output = []
-                for act in activities:
-                    # Beräkna tempo/hastighet
-                    speed_ms = act.get('average_speed', 0)
-                    speed_str = "0 km/h"
-                    if speed_ms > 0:
-                        if act.get('type') == 'Run':
-                            # Min/km för löpning
-                            pace_decimal = 16.666666666667 / speed_ms
-                            p_min = int(pace_decimal)
-                            p_sec = int((pace_decimal - p_min) * 60)
-                            speed_str = f"{p_min}:{p_sec:02d} min/km"
-                        else:
-                            # Km/h för cykling/annat
-                            speed_str = f"{round(speed_ms * 3.6, 1)} km/h"
-
-                    item = {
-                        "id": act.get('id'),
-                        "namn": act.get('name', 'Namnlöst pass'),
-                        "typ": act.get('type', 'Okänd'),
-                        "datum": act.get('start_date_local', '')[:16].replace('T', ' '),
-                        "distans": f"{round(act.get('distance', 0) / 1000, 2)} km",
-                        "tid": f"{round(act.get('moving_time', 0) / 60, 0)} min",
-                        "puls_snitt": act.get('average_heartrate', 'N/A'),
-                        "puls_max": act.get('max_heartrate', 'N/A'),
-                        "höjdmeter": f"{act.get('total_elevation_gain', 0)} m",
-                        "tempo": speed_str,
-                        "ansträngning": act.get('suffer_score', 'N/A')
-                    }
-                    output.append(item)
-                
-                print(f">> [STRAVA] Hämtade {len(output)} pass.")
-                return output
-            else:
-                return {"error": f"Strava API svarade {r.status_code}"}
-                
+            activities = await self.fetch_activities(per_page=limit)
+            if not activities:
+                return {"error": "Inga aktiviteter hittades på Strava."}
+
+            output = [format_activity(act) for act in activities]
+            print(f">> [STRAVA] Hämtade {len(output)} pass.")
+            return output
+
         except Exception as e:
             print(f">> [STRAVA] Fetch Error: {e}")
-            return {"error": f"Systemfel: {e}"}
\ No newline at end of file
+            return {"error": f"Systemfel: {e}"}
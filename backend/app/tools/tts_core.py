@@ -1,7 +1,9 @@
 import os
 import requests
 from config.settings import get_config
+from app.utils.metrics import timed
 
+@timed("tool")
 def generate_elevenlabs_audio(text):
     """
     Genererar ljud via ElevenLabs API.
@@ -19,7 +21,8 @@ def generate_elevenlabs_audio(text):
         print("[TTS] Error: Ingen ElevenLabs API-nyckel i inställningarna.")
         return None
 
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+    base_url = (cfg.get("ELEVENLABS_BASE_URL") or "https://api.elevenlabs.io").rstrip("/")
+    url = f"{base_url}/v1/text-to-speech/{voice_id}"
 
     headers = {
         "Accept": "audio/mpeg",
@@ -1,6 +1,7 @@
-import httpx
 import asyncio
 from config.settings import get_config
+from app.services.weather_service import get_weather_service
+from app.utils.metrics import timed
 
 # Enklare mappning av WMO-koder till text
 WEATHER_CODES = {
@@ -12,58 +13,89 @@ WEATHER_CODES = {
     85: "Lätt snöby", 86: "Kraftig snöby", 95: "Åska", 96: "Åska med hagel"
 }
 
-async def get_weather():
-    """
-    Hämtar väder från OpenMeteo API (Kräver ingen API-nyckel).
-    """
+MISSING_COORDS = "⚠️ Saknar GPS-koordinater. Fyll i LATITUDE och LONGITUDE i inställningarna (Kugghjulet)."
+
+# Tidsfönster (timmar) för "ikväll" och "inatt"
+EVENING = (18, 24)
+NIGHT = (0, 6)
+DAY_NAMES = ["Idag", "Imorgon", "I övermorgon"]
+
+
+def _coords():
     cfg = get_config()
-    lat = cfg.get("LATITUDE")
-    lon = cfg.get("LONGITUDE")
+    return cfg.get("LATITUDE"), cfg.get("LONGITUDE")
+
+
+def _rain_text(outlook):
+    prob, amount = outlook
+    if prob < 20 and amount < 0.2: return "troligen uppehåll"
+    return f"regnrisk {prob} %, cirka {amount} mm"
+
+
+def format_report(forecast, detail=False):
+    """Väderrapport från en cachad prognos. detail ger närmaste timmarna, kvällen och kommande dagar."""
+    curr = forecast.current
+    desc = WEATHER_CODES.get(curr.get("weather_code", 0), "Okänt väder")
+    today = forecast.daily[0] if forecast.daily else {}
+    report = (
+        f"Just nu är det {desc} och {curr.get('temperature_2m', 'N/A')}°C. "
+        f"Vinden ligger på {curr.get('wind_speed_10m', 0)} m/s. "
+        f"Idag förväntas en högsta temperatur på {today.get('temperature_2m_max', 'N/A')}°C "
+        f"och lägsta på {today.get('temperature_2m_min', 'N/A')}°C."
+    )
+    if not detail: return report
+
+    lines = [report]
+    upcoming = forecast.hours(count=12)[1::3]
+    if upcoming:
+        lines.append("Närmaste timmarna: " + ", ".join(
+            f"{h['time'][11:16]} {h.get('temperature_2m')}°C {WEATHER_CODES.get(h.get('weather_code'), '').lower()}"
+            f" ({h.get('precipitation_probability') or 0} % regnrisk)" for h in upcoming))
+    evening = forecast.rain_outlook(*EVENING)
+    if evening: lines.append(f"Ikväll (18-24): {_rain_text(evening)}.")
+    night = forecast.rain_outlook(*NIGHT, day_offset=1)
+    if night: lines.append(f"Inatt (00-06): {_rain_text(night)}.")
+    for name, day in zip(DAY_NAMES[1:], forecast.daily[1:]):
+        lines.append(
+            f"{name}: {WEATHER_CODES.get(day.get('weather_code'), 'Okänt väder')}, "
+            f"{day.get('temperature_2m_min')} till {day.get('temperature_2m_max')}°C, "
+            f"nederbörd {day.get('precipitation_sum') or 0} mm (risk {day.get('precipitation_probability_max') or 0} %).")
+    return "\n".join(lines)
 
-    if not lat or not lon:
-        return "⚠️ Saknar GPS-koordinater. Fyll i LATITUDE och LONGITUDE i inställningarna (Kugghjulet)."
 
-    url = "https://api.open-meteo.com/v1/forecast"
-    params = {
-        "latitude": lat,
-        "longitude": lon,
-        "current": "temperature_2m,weather_code,wind_speed_10m",
-        "daily": "temperature_2m_max,temperature_2m_min",
-        "timezone": "auto"
-    }
+async def get_forecast():
+    """Cachad prognos (Forecast) för de inställda koordinaterna, None om de saknas."""
+    lat, lon = _coords()
+    if not lat or not lon: return None
+    return await get_weather_service().get_async(lat, lon)
 
+
+@timed("tool")
+async def get_weather(detail=False):
+    """
+    Hämtar väder från OpenMeteo API (Kräver ingen API-nyckel).
+    Svaret cachas och delas mellan alla anropare.
+    """
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params, timeout=10.0)
-            
-            if response.status_code != 200:
-                return f"Kunde inte hämta väder (Felkod: {response.status_code})"
-
-            data = response.json()
-            
-            # Nuvarande väder
-            curr = data.get("current", {})
-            temp = curr.get("temperature_2m", "N/A")
-            wind = curr.get("wind_speed_10m", 0)
-            code = curr.get("weather_code", 0)
-            desc = WEATHER_CODES.get(code, "Okänt väder")
-
-            # Prognos för idag (Max/Min)
-            daily = data.get("daily", {})
-            max_temp = daily.get("temperature_2m_max", ["N/A"])[0]
-            min_temp = daily.get("temperature_2m_min", ["N/A"])[0]
-
-            report = (
-                f"Just nu är det {desc} och {temp}°C. "
-                f"Vinden ligger på {wind} m/s. "
-                f"Idag förväntas en högsta temperatur på {max_temp}°C och lägsta på {min_temp}°C."
-            )
-                
-            return report
+        forecast = await get_forecast()
+        if forecast is None: return MISSING_COORDS
+        return format_report(forecast, detail)
+    except Exception as e:
+        print(f"[WEATHER] Error: {e}")
+        return "Systemfel vid hämtning av väderdata."
+
 
+@timed("tool")
+def get_weather_sync(detail=False):
+    """Samma som get_weather men blockerande, för verktyg som körs i trådar."""
+    lat, lon = _coords()
+    if not lat or not lon: return MISSING_COORDS
+    try:
+        return format_report(get_weather_service().get(lat, lon), detail)
     except Exception as e:
         print(f"[WEATHER] Error: {e}")
         return "Systemfel vid hämtning av väderdata."
 
+
 if __name__ == "__main__":
-    print(asyncio.run(get_weather()))
\ No newline at end of file
+    print(asyncio.run(get_weather(detail=True)))
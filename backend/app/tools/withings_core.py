@@ -1,10 +1,26 @@
-import requests
+import asyncio
 import time
 import datetime
 from config.settings import get_config
 from app.core.database import save_db_setting
+from app.utils.http_pool import get_http_client
+from app.utils.metrics import timed
+
+API_BASE = "https://wbsapi.withings.net"
+REQUEST_TIMEOUT = 10.0
+
+# Type: 1=Vikt, 4=Längd, 6=Fett%, 76=Muskelmassa, 77=Vatten, 88=Benmassa, 9=Diastoliskt, 10=Systoliskt, 11=Puls
+MEASURE_KEYS = {
+    1: "vikt", 6: "fett_procent", 76: "muskelmassa_kg", 77: "vatten_kg",
+    88: "benmassa_kg", 9: "blodtryck_dia", 10: "blodtryck_sys", 11: "puls_vid_vägning",
+}
+ACTIVITY_FIELDS = 'steps,distance,elevation,soft,moderate,intense,active,calories,totalcalories,hr_average,hr_min,hr_max'
+
 
 class WithingsTool:
+    # Ett lås för alla instanser, refresh-tokenet roteras vid varje förnyelse
+    _refresh_lock = asyncio.Lock()
+
     def __init__(self):
         cfg = get_config()
         self.client_id = cfg.get("WITHINGS_CLIENT_ID")
@@ -13,94 +29,111 @@ class WithingsTool:
         self.access_token = None
         self.expires_at = 0
 
-    def _refresh_access_token(self):
+    async def _refresh_access_token(self):
         if time.time() < self.expires_at and self.access_token:
             return
 
-        url = "https://wbsapi.withings.net/v2/oauth2"
-        payload = {
-            'action': 'requesttoken',
-            'grant_type': 'refresh_token',
-            'client_id': self.client_id,
-            'client_secret': self.client_secret,
-            'refresh_token': self.refresh_token
-        }
-        
-        try:
-            response = requests.post(url, data=payload)
-            data = response.json()
-            
-            if data.get('status') == 0:
-                body = data['body']
-                self.access_token = body['access_token']
-                self.expires_at = time.time() + body['expires_in'] - 60 
-                self.refresh_token = body['refresh_token']
-                save_db_setting("WITHINGS_REFRESH_TOKEN", self.refresh_token)
-            else:
-                print(f">> [Withings] Token Refresh Error: {data}")
-        except Exception as e:
-            print(f">> [Withings] Connection Error: {e}")
+        async with self._refresh_lock:
+            if time.time() < self.expires_at and self.access_token:
+                return
 
-    def get_health_report(self):
-        if not self.refresh_token: return None
-        self._refresh_access_token()
-        if not self.access_token: return "Ingen åtkomst till Withings."
+            payload = {
+                'action': 'requesttoken',
+                'grant_type': 'refresh_token',
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'refresh_token': self.refresh_token
+            }
+
+            try:
+                response = await get_http_client().post(f"{API_BASE}/v2/oauth2", data=payload, timeout=REQUEST_TIMEOUT)
+                data = response.json()
 
+                if data.get('status') == 0:
+                    body = data['body']
+                    self.access_token = body['access_token']
+                    self.expires_at = time.time() + body['expires_in'] - 60
+                    self.refresh_token = body['refresh_token']
+                    await asyncio.to_thread(save_db_setting, "WITHINGS_REFRESH_TOKEN", self.refresh_token)
+                else:
+                    print(f">> [Withings] Token Refresh Error: {data}")
+            except Exception as e:
+                print(f">> [Withings] Connection Error: {e}")
+
+    async def _call(self, path, params):
+        """Ett API-anrop. Returnerar body-delen eller kastar RuntimeError."""
+        await self._refresh_access_token()
+        if not self.access_token:
+            raise RuntimeError("Ingen åtkomst till Withings.")
         headers = {'Authorization': f'Bearer {self.access_token}'}
-        report = {}
+        r = await get_http_client().post(f"{API_BASE}{path}", headers=headers, data=params, timeout=REQUEST_TIMEOUT)
+        data = r.json()
+        if data.get('status') != 0:
+            raise RuntimeError(f"Withings svarade status {data.get('status')}")
+        return data.get('body', {})
 
-        try:
+    async def _paged(self, path, params, list_key, max_pages=None):
+        """Följer more/offset tills allt är hämtat (eller max_pages sidor)."""
+        items = []
+        params = dict(params)
+        pages = 0
+        while True:
+            body = await self._call(path, params)
+            items += body.get(list_key, [])
+            pages += 1
+            if not body.get('more') or (max_pages and pages >= max_pages): break
+            params['offset'] = body.get('offset')
+        return items
+
+    @timed("tool", op="withings.get_measure_groups")
+    async def get_measure_groups(self, lastupdate=None):
+        """
+        Kroppsmätningar (category 1 = riktiga mätningar). Med lastupdate bara det som
+        ändrats sedan dess, annars bara senaste mätningen (en sida, inte hela historiken).
+        """
+        params = {'action': 'getmeas', 'category': 1}
+        if lastupdate:
+            return await self._paged("/measure", params | {'lastupdate': int(lastupdate)}, 'measuregrps')
+        return await self._paged("/measure", params | {'limit': 1}, 'measuregrps', max_pages=1)
+
+    @timed("tool", op="withings.get_activities")
+    async def get_activities(self, lastupdate=None):
+        """Dagliga aktivitetssammanfattningar (steg, kalorier, puls)."""
+        params = {'action': 'getactivity', 'data_fields': ACTIVITY_FIELDS}
+        if lastupdate:
+            params['lastupdate'] = int(lastupdate)
+        else:
             today = datetime.date.today().strftime("%Y-%m-%d")
-            # Hämta data för senaste veckan för att vara säker på att hitta mätvärden
-            start_date = (datetime.date.today() - datetime.timedelta(days=7)).strftime("%Y-%m-%d")
-            
-            # --- 1. AKTIVITET (Steg, Kalorier m.m.) ---
-            act_url = "https://wbsapi.withings.net/v2/measure"
-            act_params = {
-                'action': 'getactivity',
-                'startdateymd': today, # Försök bara med idag först för aktivitet
-                'enddateymd': today,
-                'data_fields': 'steps,distance,elevation,soft,moderate,intense,active,calories,totalcalories,hr_average,hr_min,hr_max'
-            }
-            r_act = requests.post(act_url, headers=headers, data=act_params)
-            act_data = r_act.json()
-            
-            if act_data.get('status') == 0 and 'activities' in act_data['body']:
-                latest = act_data['body']['activities'][-1]
-                report['steg_withings'] = latest.get('steps', 0)
-                report['kalorier_total'] = latest.get('totalcalories', 0)
-                report['aktiv_tid'] = round(latest.get('active', 0) / 60, 0) # Minuter
-                if 'hr_average' in latest:
-                    report['snittpuls'] = latest['hr_average']
-
-            # --- 2. KROPPSMÄTNINGAR (Vikt, Fett, Muskler, Vatten, Ben) ---
-            # Type: 1=Vikt, 4=Längd, 6=Fett%, 76=Muskelmassa, 77=Vatten, 88=Benmassa, 9=Diastoliskt, 10=Systoliskt
-            meas_url = "https://wbsapi.withings.net/measure"
-            meas_params = { 
-                'action': 'getmeas', 
-                'category': 1, 
-                'limit': 1  # Hämta bara det allra senaste mättillfället
-            }
-            r_meas = requests.post(meas_url, headers=headers, data=meas_params)
-            meas_data = r_meas.json()
-            
-            if meas_data.get('status') == 0 and 'measuregrps' in meas_data['body']:
-                grp = meas_data['body']['measuregrps'][0]
-                report['mätning_datum'] = datetime.datetime.fromtimestamp(grp['date']).strftime("%Y-%m-%d %H:%M")
-                
-                for m in grp['measures']:
-                    val = m['value'] * (10 ** m['unit'])
-                    t = m['type']
-                    
-                    if t == 1: report['vikt'] = round(val, 1)
-                    elif t == 6: report['fett_procent'] = round(val, 1)
-                    elif t == 76: report['muskelmassa_kg'] = round(val, 1)
-                    elif t == 77: report['vatten_kg'] = round(val, 1)
-                    elif t == 88: report['benmassa_kg'] = round(val, 1)
-                    elif t == 9: report['blodtryck_dia'] = int(val)
-                    elif t == 10: report['blodtryck_sys'] = int(val)
-                    elif t == 11: report['puls_vid_vägning'] = int(val)
-
-            return report
+            params['startdateymd'] = today
+            params['enddateymd'] = today
+        return await self._paged("/v2/measure", params, 'activities')
+
+    @timed("tool", op="withings.get_health_report")
+    async def get_health_report(self):
+        if not self.refresh_token: return None
+
+        try:
+            # Båda anropen parallellt över den delade anslutningspoolen
+            activities, groups = await asyncio.gather(self.get_activities(), self.get_measure_groups())
         except Exception as e:
-            return f"Fel vid Withings-hämtning: {e}"
\ No newline at end of file
+            return f"Fel vid Withings-hämtning: {e}"
+
+        report = {}
+        if activities:
+            latest = activities[-1]
+            report['steg_withings'] = latest.get('steps', 0)
+            report['kalorier_total'] = latest.get('totalcalories', 0)
+            report['aktiv_tid'] = round(latest.get('active', 0) / 60, 0) # Minuter
+            if 'hr_average' in latest:
+                report['snittpuls'] = latest['hr_average']
+
+        if groups:
+            grp = max(groups, key=lambda g: g['date'])
+            report['mätning_datum'] = datetime.datetime.fromtimestamp(grp['date']).strftime("%Y-%m-%d %H:%M")
+            for m in grp['measures']:
+                key = MEASURE_KEYS.get(m['type'])
+                if not key: continue
+                val = m['value'] * (10 ** m['unit'])
+                report[key] = int(val) if m['type'] in (9, 10, 11) else round(val, 1)
+
+        return report
@@ -3,25 +3,51 @@ app/tools/z2m_core.py
 """
 import json
 import asyncio
-import paho.mqtt.subscribe as subscribe
+import threading
 from config.settings import get_config
+from app.utils.metrics import timed
 
-cfg = get_config()
+READ_TIMEOUT = 2.0
 
+
+def _read_once(topic, host, port, timeout=READ_TIMEOUT):
+    """
+    Första meddelandet på topic, eller None efter timeout. subscribe.simple()
+    saknar timeout och blockerar sin tråd för alltid om inget kommer, här
+    stängs klienten alltid så att tråden blir ledig igen.
+    """
+    import paho.mqtt.client as mqtt
+    api = getattr(mqtt, "CallbackAPIVersion", None)   # paho 2.x
+    client = mqtt.Client(api.VERSION2) if api else mqtt.Client()
+    received = []
+    done = threading.Event()
+
+    def on_message(c, userdata, msg):
+        received.append(msg)
+        done.set()
+    client.on_connect = lambda c, *args: c.subscribe(topic)
+    client.on_message = on_message
+    if hasattr(client, "connect_timeout"): client.connect_timeout = timeout
+    try:
+        client.connect_async(host, port, keepalive=max(5, int(timeout * 2)))
+        client.loop_start()
+        done.wait(timeout)
+    finally:
+        client.disconnect()
+        client.loop_stop()
+    return received[0] if received else None
+
+
+@timed("tool")
 async def get_sensor_data(friendly_name: str):
     """Hämtar sensorvärden (temp, fukt etc) via Zigbee2MQTT."""
+    # paho och inställningarna laddas först när en sensor efterfrågas
+    cfg = get_config()
     topic = f"{cfg['MQTT_TOPIC_BASE']}/{friendly_name}"
     print(f"[Z2M] Läser: {topic}")
 
     try:
-        # Kör den blockerande subscribe-funktionen i en executor (tråd)
-        loop = asyncio.get_event_loop()
-        msg = await loop.run_in_executor(None, lambda: subscribe.simple(
-            topic, 
-            hostname=cfg['MQTT_BROKER_IP'], 
-            port=cfg['MQTT_PORT'], 
-            timeout=2.0
-        ))
+        msg = await asyncio.to_thread(_read_once, topic, cfg['MQTT_BROKER_IP'], cfg['MQTT_PORT'])
 
         if not msg: return f"Inget svar från {friendly_name}"
         
@@ -0,0 +1,46 @@
+"""
+==============================================================================
+FILE: app/utils/http_pool.py
+DESCRIPTION: Delad httpx-klient per event loop så att verktygen återanvänder
+             anslutningar istället för att skapa en ny klient per anrop.
+==============================================================================
+"""
+import asyncio
+import weakref
+import httpx
+
+DEFAULT_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+DEFAULT_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+
+# En klient per loop: httpx-klienter är bundna till den loop de skapades i.
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_http_client():
+    """Returnerar den delade AsyncClient-instansen för loopen som körs just nu."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(timeout=DEFAULT_TIMEOUT, limits=DEFAULT_LIMITS)
+        _clients[loop] = client
+    return client
+
+
+async def close_http_client():
+    """Stänger klienten som hör till den aktuella loopen (t.ex. vid shutdown)."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client and not client.is_closed:
+        await client.aclose()
+
+
+def run_sync(coro):
+    """
+    Kör en coroutine från synkron kod (t.ex. Geminis verktygstrådar).
+    Loopens klient stängs efteråt så att inga anslutningar lämnas öppna.
+    """
+    async def _runner():
+        try:
+            return await coro
+        finally:
+            await close_http_client()
+    return asyncio.run(_runner())
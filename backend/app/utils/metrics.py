@@ -0,0 +1,242 @@
+"""
+==============================================================================
+FILE: app/utils/metrics.py
+DESCRIPTION: Latensmätning i processen (histogram och räknare) som visas i
+             Prometheus-format på /metrics.
+
+             span("tool", tool="get_weather")   -> with-block (sync och async)
+             @timed("db")                       -> dekorator (sync/async)
+             timed_stream("llm", agen, ...)     -> tid till första token + total
+             inc("cache_hits")                  -> räknare
+
+             Avstängt med DAA_METRICS=0: span/timed_stream gör ingenting och
+             dekoratorerna returnerar funktionen oförändrad (om även
+             spårningen, DAA_TRACE, är avstängd).
+==============================================================================
+"""
+import os
+import time
+import bisect
+import asyncio
+import functools
+import threading
+from app.utils import tracing
+
+ENABLED = os.environ.get("DAA_METRICS", "1").lower() not in ("0", "false", "nej", "off")
+PREFIX = "daa_"
+# Sekunder. Täcker allt från DB-anrop (ms) till långa modellsvar.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_histograms = {}   # (namn, etiketter) -> [antal per bucket (+Inf sist)..., summa, antal]
+_counters = {}     # (namn, etiketter) -> värde
+_help = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _observe(key, seconds):
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0, 0]
+        h[bisect.bisect_left(BUCKETS, seconds)] += 1
+        h[-2] += seconds
+        h[-1] += 1
+
+
+def observe(name, seconds, **labels):
+    """Lägger ett mätvärde (sekunder) i histogrammet `name`."""
+    if not ENABLED: return
+    _observe(_key(name, labels), seconds)
+
+
+def inc(name, value=1, **labels):
+    if not ENABLED: return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def describe(name, text):
+    """HELP-text för ett mätvärde i /metrics."""
+    _help[name] = text
+
+
+class _Span:
+    __slots__ = ("keys", "start")
+
+    def __init__(self, name, labels=None, keys=None):
+        # keys kan räknas ut i förväg (dekoratorn gör det en gång per funktion)
+        self.keys = keys or _span_keys(name, labels)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _observe(self.keys[0], time.perf_counter() - self.start)
+        if exc_type is not None and not issubclass(exc_type, (asyncio.CancelledError, GeneratorExit)):
+            with _lock:
+                _counters[self.keys[1]] = _counters.get(self.keys[1], 0) + 1
+        return False
+
+
+def _span_keys(name, labels):
+    return _key(f"{name}_seconds", labels), _key(f"{name}_errors_total", labels)
+
+
+class _NoSpan:
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **labels):
+    """with span("db", op="save_message"): ... -> histogram <name>_seconds och <name>_errors_total."""
+    return _Span(name, labels) if ENABLED else _NO_SPAN
+
+
+def timed(name, **labels):
+    """
+    Dekorator för sync- och async-funktioner. Etiketten `op` sätts till
+    funktionens namn om den inte anges. Signatur och docstring behålls
+    (Gemini läser verktygens signaturer). Under en spårad chattur hamnar
+    anropet (med argument) även i turens spårning.
+    """
+    def decorate(fn):
+        if not ENABLED and not tracing.ENABLED: return fn
+        tags = dict(labels)
+        tags.setdefault("op", fn.__name__)
+        keys = _span_keys(name, tags)
+        op = tags["op"]
+
+        def record(trace, start, args, kwargs, error):
+            if trace: trace.call(name, op, args, kwargs, start, time.perf_counter(), error)
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                trace, start, error = tracing.current(), time.perf_counter(), None
+                try:
+                    with (_Span(name, keys=keys) if ENABLED else _NO_SPAN):
+                        return await fn(*args, **kwargs)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    record(trace, start, args, kwargs, error)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            trace, start, error = tracing.current(), time.perf_counter(), None
+            try:
+                with (_Span(name, keys=keys) if ENABLED else _NO_SPAN):
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                record(trace, start, args, kwargs, error)
+        return wrapper
+    return decorate
+
+
+async def timed_stream(name, stream, **labels):
+    """
+    Strömmar vidare från `stream` och mäter <name>_ttft_seconds (första
+    icke-tomma biten), <name>_generation_seconds (hela strömmen),
+    <name>_chunks_total och <name>_errors_total.
+    """
+    if not ENABLED:
+        async for chunk in stream:
+            yield chunk
+        return
+    start = time.perf_counter()
+    first = True
+    chunks = 0
+    try:
+        async for chunk in stream:
+            if first and chunk:
+                observe(f"{name}_ttft_seconds", time.perf_counter() - start, **labels)
+                first = False
+            chunks += 1
+            yield chunk
+    except (asyncio.CancelledError, GeneratorExit):
+        raise
+    except Exception:
+        inc(f"{name}_errors_total", **labels)
+        raise
+    finally:
+        observe(f"{name}_generation_seconds", time.perf_counter() - start, **labels)
+        inc(f"{name}_chunks_total", chunks, **labels)
+
+
+# --- EXPORT ---
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs: return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render():
+    """Alla mätvärden i Prometheus textformat (version 0.0.4)."""
+    with _lock:
+        histograms = {k: list(v) for k, v in _histograms.items()}
+        counters = dict(_counters)
+    lines = []
+    for kind, items in (("histogram", histograms), ("counter", counters)):
+        seen = set()
+        for (name, labels), value in sorted(items.items()):
+            metric = PREFIX + name
+            if name not in seen:
+                seen.add(name)
+                if name in _help: lines.append(f"# HELP {metric} {_help[name]}")
+                lines.append(f"# TYPE {metric} {kind}")
+            if kind == "counter":
+                lines.append(f"{metric}{_fmt_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, value):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_fmt_labels(labels, ('le', str(bound)))} {cumulative}")
+            lines.append(f"{metric}_bucket{_fmt_labels(labels, ('le', '+Inf'))} {value[-1]}")
+            lines.append(f"{metric}_sum{_fmt_labels(labels)} {round(value[-2], 6)}")
+            lines.append(f"{metric}_count{_fmt_labels(labels)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    """Antal och medel per histogram (för loggar och benchmarks)."""
+    with _lock:
+        return {f"{name}{dict(labels) if labels else ''}": {"count": h[-1], "avg_s": round(h[-2] / h[-1], 4) if h[-1] else None}
+                for (name, labels), h in _histograms.items()}
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+describe("turn_ttft_seconds", "Tid till första bit för en hel chattur (historik, kontext, cache, modell)")
+describe("llm_ttft_seconds", "Tid till första token per modell/leverantör")
+describe("llm_generation_seconds", "Total tid för ett modellsvar")
+describe("response_ttft_seconds", "Tid till första token i stream_response (inkl. minne och prompt)")
+describe("tool_seconds", "Verktygens latens")
+describe("tool_errors_total", "Verktygsanrop som kastade ett undantag")
+describe("db_seconds", "Latens för databasanrop")
+describe("live_send_seconds", "Skicka ljud till Gemini Live")
+describe("live_turn_seconds", "Gemini Live: första svar till turn_complete")
+describe("history_dropped_total", "Chattmeddelanden som write-behind-kön inte lyckades spara")
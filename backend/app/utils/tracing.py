@@ -0,0 +1,230 @@
+"""
+==============================================================================
+FILE: app/utils/tracing.py
+DESCRIPTION: Spårning per chattur. Varje tur (Socket.IO, /api/chat, /v1)
+             får en post med promptstorlek, start/slut för varje steg
+             (historik, datakällor, minne, modell...), verktygsanrop med
+             argument och tider samt vilken modell som svarade. Posterna
+             skrivs av en bakgrundstråd som kompakt JSONL till
+             logs/traces/turns.jsonl, som roteras vid TRACE_MAX_BYTES.
+             Spela upp dem offline med benchmarks/replay_trace.py.
+
+             Avstängt med DAA_TRACE=0, annan katalog med DAA_TRACE_DIR.
+==============================================================================
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from config.settings import BASE_DIR
+
+ENABLED = os.environ.get("DAA_TRACE", "1").lower() not in ("0", "false", "nej", "off")
+TRACE_DIR = os.environ.get("DAA_TRACE_DIR") or os.path.join(BASE_DIR, "logs", "traces")
+TRACE_FILE = "turns.jsonl"
+TRACE_MAX_BYTES = 5 * 1024 * 1024
+TRACE_BACKUPS = 5
+# Argument till verktyg kortas av (spårningen ska vara liten)
+MAX_ARG_CHARS = 200
+# Argument sparas bara för verktyg (DB-anropen skulle annars spara hela chatten)
+ARG_KINDS = {"tool"}
+
+_current = contextvars.ContextVar("daa_trace", default=None)
+
+
+def _short(value):
+    text = value if isinstance(value, str) else repr(value)
+    return text if len(text) <= MAX_ARG_CHARS else text[:MAX_ARG_CHARS] + "…"
+
+
+class Trace:
+    def __init__(self, source, **attrs):
+        self.id = uuid.uuid4().hex[:12]
+        self.ts = time.time()
+        self.t0 = time.perf_counter()
+        self.source = source
+        self.attrs = attrs
+        self.stages = []
+        self.calls = []
+
+    def ms(self, t=None):
+        """Millisekunder från turens start till t (perf_counter)."""
+        return round(((t or time.perf_counter()) - self.t0) * 1000, 2)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    @contextmanager
+    def stage(self, name, **attrs):
+        entry = {"name": name, "start_ms": self.ms(), **attrs}
+        self.stages.append(entry)
+        try:
+            yield entry
+        except Exception as e:
+            entry["error"] = _short(str(e))
+            raise
+        finally:
+            entry["end_ms"] = self.ms()
+
+    def call(self, kind, op, args, kwargs, start, end, error=None):
+        """Ett verktygs- eller DB-anrop (från metrics.timed). Kan anropas från andra trådar."""
+        entry = {"kind": kind, "op": op, "start_ms": self.ms(start), "ms": round((end - start) * 1000, 2)}
+        if kind in ARG_KINDS:
+            if args: entry["args"] = [_short(a) for a in args]
+            if kwargs: entry["kwargs"] = {k: _short(v) for k, v in kwargs.items()}
+        if error is not None: entry["error"] = _short(str(error))
+        self.calls.append(entry)
+
+    def to_dict(self):
+        return {"id": self.id, "ts": round(self.ts, 3), "source": self.source, **self.attrs,
+                "total_ms": self.ms(), "stages": self.stages, "calls": self.calls}
+
+
+def current():
+    """Spårningen för turen som körs just nu (eller None)."""
+    return _current.get()
+
+
+class _NoStage:
+    def __enter__(self): return {}
+    def __exit__(self, *exc): return False
+
+
+def stage(name, **attrs):
+    """with stage("history"): ... -> steg i den aktuella turen. Gör ingenting utan spårning."""
+    trace = _current.get()
+    return trace.stage(name, **attrs) if trace else _NoStage()
+
+
+def annotate(**attrs):
+    trace = _current.get()
+    if trace: trace.set(**attrs)
+
+
+async def traced(name, awaitable, **attrs):
+    """await med ett eget steg, t.ex. för saker som körs parallellt med gather."""
+    with stage(name, **attrs):
+        return await awaitable
+
+
+async def traced_turn(source, make_stream, **attrs):
+    """
+    Kör make_stream() (en async generator med svarets bitar) som en spårad tur.
+    Posten skrivs när strömmen är slut, avbruten eller har kastat ett fel.
+    """
+    if not ENABLED:
+        async for chunk in make_stream():
+            yield chunk
+        return
+    trace = Trace(source, **attrs)
+    token = _current.set(trace)
+    chunks, chars = 0, 0
+    try:
+        # Skapas efter set() så att uppgifter som strömmen startar ärver spårningen
+        async for chunk in make_stream():
+            if not chunks: trace.set(first_chunk_ms=trace.ms())
+            chunks += 1
+            chars += len(chunk)
+            yield chunk
+    except (asyncio.CancelledError, GeneratorExit):
+        trace.set(cancelled=True)
+        raise
+    except Exception as e:
+        trace.set(error=_short(str(e)))
+        raise
+    finally:
+        trace.set(response_chunks=chunks, response_chars=chars)
+        try: _current.reset(token)
+        except ValueError: pass  # avslutad från en annan kontext (t.ex. aclose i en annan task)
+        get_trace_writer().write(trace.to_dict())
+
+
+# --- SKRIVARE ---
+
+class TraceWriter:
+    """Skriver poster från en kö i en egen tråd så att chattflödet aldrig väntar på disken."""
+    def __init__(self, directory=TRACE_DIR, filename=TRACE_FILE, max_bytes=TRACE_MAX_BYTES, backups=TRACE_BACKUPS):
+        self.path = os.path.join(directory, filename)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def write(self, record):
+        self._ensure_thread()
+        self.queue.put(record)
+
+    def _ensure_thread(self):
+        if self._thread and self._thread.is_alive(): return
+        with self._lock:
+            if self._thread and self._thread.is_alive(): return
+            self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try: batch.append(self.queue.get_nowait())
+                except queue.Empty: break
+            stop = None in batch
+            lines = [json.dumps(r, ensure_ascii=False, separators=(",", ":"), default=str) + "\n" for r in batch if r is not None]
+            if lines:
+                try: self._append("".join(lines))
+                except Exception as e:
+                    self.dropped += len(lines)
+                    print(f"[TRACE] Kunde inte skriva spårning: {e}")
+            if stop: return
+
+    def _append(self, text):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try: size = os.path.getsize(self.path)
+        except OSError: size = 0
+        if size and size + len(text) > self.max_bytes:
+            self._rotate()
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(text)
+
+    def _rotate(self):
+        """turns.jsonl -> turns.jsonl.1 -> ... -> turns.jsonl.<backups> (den äldsta tas bort)."""
+        for i in range(self.backups, 0, -1):
+            src = self.path if i == 1 else f"{self.path}.{i - 1}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i}")
+
+    def close(self, timeout=2.0):
+        """Skriver ut det som ligger i kön (vid shutdown)."""
+        if self._thread and self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join(timeout)
+
+
+def read_traces(path=None):
+    """Alla poster, äldst först (roterade filer inräknade)."""
+    path = path or os.path.join(TRACE_DIR, TRACE_FILE)
+    files = [f"{path}.{i}" for i in range(TRACE_BACKUPS, 0, -1)] + [path]
+    for name in files:
+        if not os.path.exists(name): continue
+        with open(name, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    try: yield json.loads(line)
+                    except json.JSONDecodeError: pass
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_trace_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = TraceWriter()
+        return _writer
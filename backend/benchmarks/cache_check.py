@@ -0,0 +1,141 @@
+"""
+==============================================================================
+FILE: benchmarks/cache_check.py
+DESCRIPTION: Kontrollerar att den semantiska cachen (response_cache.py) inte
+             ger fel svar: frågor som bara skiljer sig i en siffra, veckodag
+             eller ett räkneord får aldrig träffa varandra, och en följdfråga
+             efter ett annat samtal (conversation_key) är en miss.
+             Omformuleringar ska fortfarande träffa, och en fristående fråga
+             som upprepas i samma session (hela chat_pipeline, stubbad modell
+             och kontext, tillfällig databas) ska träffa trots att historiken
+             ändrats. Ett svar från reservmodellen sparas inte.
+             Misslyckas (exit 1) om något inte håller.
+
+KÖR:  python benchmarks/cache_check.py
+==============================================================================
+"""
+import os
+import sys
+import asyncio
+import tempfile
+
+# Tillfällig databas och spårning (måste sättas innan config.settings importeras)
+TMP_DIR = tempfile.TemporaryDirectory(prefix="daa_cachecheck_")
+os.environ["DAA_DB_PATH"] = os.path.join(TMP_DIR.name, "cache_check.db")
+os.environ["DAA_TRACE_DIR"] = os.path.join(TMP_DIR.name, "traces")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.services.response_cache import SemanticCache, context_fingerprint, conversation_key, embed, similarity
+
+MODEL = "gemini-2.0-flash-exp"
+CONTEXT = "--- VÄDER ---\nStockholm: 12 grader"
+BROKEN_MODEL = "gpt-4o"   # stubben misslyckas alltid, reservmodellen (MODEL) svarar
+
+# (sparad fråga, ny fråga) som ligger över tröskeln men betyder olika saker
+NEAR_MISSES = [
+    ("vad blir temperaturen klockan 18 idag", "vad blir temperaturen klockan 21 idag"),
+    ("möten på måndag eftermiddag", "möten på tisdag eftermiddag"),
+    ("vägde jag för två veckor sedan", "vägde jag för tre veckor sedan"),
+    ("vädret på lördag förmiddag", "vädret på söndag förmiddag"),
+    ("hur blir vädret idag", "hur blir vädret imorgon"),
+    ("hur många steg gick jag i mars", "hur många steg gick jag i maj"),
+]
+# Samma fråga med annan stavning/ordföljd ska fortfarande vara en träff
+PARAPHRASES = [
+    ("Hur blir vädret imorgon?", "hur blir vädret imorgon"),
+    ("vad blir temperaturen klockan 18 idag?", "Vad blir temperaturen klockan 18 idag"),
+    ("möten på måndag eftermiddag", "mina möten på måndag eftermiddag"),
+]
+
+
+def fresh(query, fingerprint):
+    cache = SemanticCache()
+    cache.store(MODEL, query, fingerprint, f"svar på: {query}", 60)
+    return cache
+
+
+def check_repeat_in_session():
+    """Samma fråga flera gånger i sessionen "hybrid" (delad historik), även efter en annan fråga."""
+    from app.core.database import init_db
+    from app.core.message_writer import get_message_writer
+    from app.services import chat_pipeline
+    from app.services.response_cache import get_semantic_cache
+    init_db()
+    calls = []
+
+    async def build_context(text, with_sources=False):
+        if "sov" in text: return "--- SÖMN ---\n7h 12m", ["garmin"]
+        return CONTEXT, ["weather"]
+
+    def stream_response(model, history, text, image_data=None, system_injection=None, tools=True):
+        async def gen():
+            if model == BROKEN_MODEL: raise RuntimeError("nere")
+            calls.append(text)
+            yield f"Svar på {text} ({len(calls)})"
+        return gen()
+    chat_pipeline.build_context = build_context
+    chat_pipeline._load_stream_response = lambda: stream_response
+
+    async def run(questions, model=MODEL):
+        for q in questions:
+            async for _ in chat_pipeline.run_turn(q, model, session_id="hybrid"): pass
+            await asyncio.to_thread(get_message_writer().flush)
+
+    cache = get_semantic_cache()
+    cache.clear()
+    hits0, misses0 = cache.hits, cache.misses
+    weather = "vad är det för väder?"
+    asyncio.run(run([weather] * 4 + ["hur sov jag?", weather]))
+    hits, misses = cache.hits - hits0, cache.misses - misses0
+    print(f"  samma session: träffar {hits}, missar {misses}, modellanrop {calls}")
+    failures = []
+    # Väder: första frågan missar, resten träffar. Sömnfrågan missar.
+    if (hits, misses) != (4, 2) or calls.count(weather) != 1:
+        failures.append(f"upprepad fråga i samma session: {hits} träffar, {misses} missar (väntat 4/2)")
+
+    # Svarar reservmodellen får svaret inte sparas under den valda modellen
+    cache.clear()
+    del calls[:]
+    asyncio.run(run([weather] * 2, model=BROKEN_MODEL))
+    get_message_writer().close()
+    print(f"  reservmodell: modellanrop {calls}")
+    if len(calls) != 2:
+        failures.append("reservmodellens svar sparades under den valda modellen")
+    return failures
+
+
+def main():
+    failures = []
+    fingerprint = context_fingerprint(CONTEXT, "")
+    for stored, asked in NEAR_MISSES:
+        score = similarity(embed(stored), embed(asked))
+        hit = fresh(stored, fingerprint).lookup(MODEL, asked, fingerprint)
+        print(f"  {score:.3f}  {'TRÄFF' if hit else 'miss '}  {stored!r} -> {asked!r}")
+        if hit: failures.append(f"fel träff: {asked!r} gav svaret på {stored!r}")
+    for stored, asked in PARAPHRASES:
+        if fresh(stored, fingerprint).lookup(MODEL, asked, fingerprint) is None:
+            failures.append(f"omformulering missade: {asked!r}")
+
+    # Följdfråga: samma text, olika föregående tur
+    weather = [{"role": "user", "content": "hur blir vädret idag"}, {"role": "assistant", "content": "Sol."}]
+    meetings = [{"role": "user", "content": "vilka möten har jag idag"}, {"role": "assistant", "content": "Två."}]
+    key = lambda q, h: context_fingerprint(CONTEXT, conversation_key(q, h))
+    cache = fresh("och imorgon?", key("och imorgon?", weather))
+    if cache.lookup(MODEL, "och imorgon?", key("och imorgon?", meetings)) is not None:
+        failures.append("följdfråga träffade efter ett annat samtal")
+    if cache.lookup(MODEL, "och imorgon?", key("och imorgon?", weather)) is None:
+        failures.append("följdfråga missade efter samma samtal")
+    # Fristående fråga: föregående tur ingår inte i nyckeln
+    if key("vad är det för väder i Stockholm?", weather) != key("vad är det för väder i Stockholm?", meetings):
+        failures.append("fristående fråga nycklad på föregående tur")
+
+    failures += check_repeat_in_session()
+
+    if failures:
+        print("\n❌ " + "\n❌ ".join(failures))
+        sys.exit(1)
+    print("\n✅ Semantiska cachen OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+==============================================================================
+FILE: benchmarks/db_bench.py
+DESCRIPTION: Mikrobenchmark för databas- och promptfunktionerna som körs vid
+             varje chattur: get_config, get_system_prompt, get_history och
+             save_message. Syntetiska databaser med 1k-1M rader i history
+             skapas (och kan återanvändas med --keep), varje funktion mäts
+             kall (cacharna tömda före varje anrop) och varm, och
+             allokeringarna mäts med tracemalloc.
+
+             Misslyckas (exit 1) om en varm median växer mer än --max-growth
+             gånger från minsta till största databasen, eller (med --compare)
+             blir mer än --max-regression procent långsammare än en tidigare
+             körning.
+
+KÖR:  python benchmarks/db_bench.py [--sizes 1000,10000,100000,1000000] [--keep DIR]
+                                    [--out result.json] [--compare baseline.json]
+==============================================================================
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import config.settings as settings
+import app.core.database as database
+from app.core.prompts import get_system_prompt
+from app.utils import metrics, tracing
+
+DEFAULT_SIZES = "1000,10000,100000,1000000"
+HISTORY_TURNS = 10          # som chat_pipeline
+BENCH_SESSION = "db_bench"  # save_message skriver hit, raderas efteråt
+# Andel rader med bild (base64 i history.image) och bildens storlek
+IMAGE_RATIO = 0.002
+IMAGE_CHARS = 30_000
+# Mätvärden som jämförs med --compare
+COMPARED = ("warm_us", "cold_us")
+
+
+def use_db(path):
+    """Pekar om settings och database (båda läser DB_PATH) och tömmer cacharna."""
+    settings.DB_PATH = database.DB_PATH = path
+    settings.invalidate_config()
+    database.invalidate_prompts()
+
+
+def generate(path, rows, seed=1):
+    """Syntetisk databas: init_db (inställningar, prompter) + `rows` meddelanden i history."""
+    use_db(path)
+    database.init_db()
+    rng = random.Random(seed)
+    words = ["hej", "lampan", "köket", "temperatur", "Anders", "väder", "imorgon", "träning", "puls", "möte",
+             "verkställer", "grader", "status", "sömn", "kalender", "dammsugaren", "ute", "regn", "löpning", "vecka"]
+    pool = [" ".join(rng.choice(words) for _ in range(rng.randint(3, 120))) for _ in range(500)]
+    image = "A" * IMAGE_CHARS
+    sessions = ["hybrid", "default", "rest", "gateway"]
+
+    def batch():
+        for i in range(rows):
+            yield (rng.choice(sessions), "user" if i % 2 == 0 else "assistant", pool[i % len(pool)],
+                   image if rng.random() < IMAGE_RATIO else None)
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO history (session_id, role, content, image) VALUES (?, ?, ?, ?)", batch())
+    conn.commit()
+    conn.close()
+
+
+def prepare(directory, rows):
+    path = os.path.join(directory, f"history_{rows}.db")
+    if os.path.exists(path):
+        with sqlite3.connect(path) as conn:
+            if conn.execute("SELECT COUNT(*) FROM history WHERE session_id != ?", (BENCH_SESSION,)).fetchone()[0] == rows:
+                return path, 0.0
+        os.remove(path)
+    t0 = time.perf_counter()
+    generate(path, rows)
+    return path, time.perf_counter() - t0
+
+
+def _invalidate():
+    settings.invalidate_config()
+    database.invalidate_prompts()
+
+
+def cases():
+    """(namn, funktion). save_message skriver till en egen session som raderas efter mätningen."""
+    return [
+        ("get_config", settings.get_config),
+        ("get_system_prompt", get_system_prompt),
+        ("get_history", lambda: database.get_history("hybrid", HISTORY_TURNS)),
+        ("save_message", lambda: database.save_message(BENCH_SESSION, "user", "Tänd lampan i köket, tack.")),
+    ]
+
+
+def _timings(fn, repeat, cold):
+    samples = []
+    for _ in range(repeat):
+        if cold: _invalidate()
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1e6)
+    return samples
+
+
+def _allocations(fn, repeat):
+    """Toppallokering per anrop och vad som ligger kvar efter `repeat` anrop (KB)."""
+    tracemalloc.start()
+    try:
+        fn()
+        base = tracemalloc.get_traced_memory()[0]
+        peak = 0
+        for _ in range(repeat):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            fn()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+        retained = tracemalloc.get_traced_memory()[0] - base
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024, 1), round(retained / 1024, 1)
+
+
+def _stats(samples):
+    ordered = sorted(samples)
+    return round(statistics.median(ordered), 1), round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1)
+
+
+def bench_size(path, repeat, alloc_repeat):
+    use_db(path)
+    results = {}
+    for name, fn in cases():
+        fn()  # första anropet (import, sqlite-filen öppnas) räknas inte
+        cold, cold_p95 = _stats(_timings(fn, repeat, cold=True))
+        warm, warm_p95 = _stats(_timings(fn, repeat, cold=False))
+        peak_kb, retained_kb = _allocations(fn, alloc_repeat)
+        results[name] = {"cold_us": cold, "cold_p95_us": cold_p95, "warm_us": warm, "warm_p95_us": warm_p95,
+                         "alloc_peak_kb": peak_kb, "alloc_retained_kb": retained_kb}
+    with database.get_db_connection() as conn:
+        conn.execute("DELETE FROM history WHERE session_id = ?", (BENCH_SESSION,))
+        conn.commit()
+    return results
+
+
+def check_growth(report, max_growth):
+    """Varm median på största DB jämfört med minsta. O(n) i en het väg syns här."""
+    sizes = sorted(report["results"], key=int)
+    if len(sizes) < 2: return []
+    small, large = report["results"][sizes[0]], report["results"][sizes[-1]]
+    failures = []
+    for name in large:
+        base, now = small[name]["warm_us"], large[name]["warm_us"]
+        growth = now / base if base else 1.0
+        report.setdefault("growth", {})[name] = round(growth, 2)
+        if growth > max_growth: failures.append(f"{name} x{growth:.1f} ({sizes[0]} -> {sizes[-1]} rader)")
+    return failures
+
+
+def compare(report, baseline, max_regression, min_delta_us):
+    failures = []
+    print(f"\nJämfört med {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for size, functions in report["results"].items():
+        for name, values in functions.items():
+            old = (baseline.get("results", {}).get(size) or {}).get(name)
+            if not old: continue
+            for key in COMPARED:
+                if not old.get(key): continue
+                change = (values[key] - old[key]) / old[key] * 100
+                # Små absoluta skillnader (cachade anrop på någon µs) är brus
+                slower = change > max_regression and values[key] - old[key] > min_delta_us
+                flag = "  <-- försämring" if slower else ""
+                print(f"  {size:>8} {name:<18} {key:<8} {old[key]:>9.1f} -> {values[key]:>9.1f} µs ({change:+.1f} %){flag}")
+                if flag: failures.append(f"{name}/{size}/{key}")
+    return failures
+
+
+def git_commit():
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip() or None
+    except Exception: return None
+
+
+def print_report(report):
+    print(f"\nDB-benchmark ({report['commit']}), median µs (p95), allokering KB")
+    print(f"  {'rader':>8} {'funktion':<18}{'kall':>16}{'varm':>16}{'topp KB':>10}{'kvar KB':>10}")
+    for size, functions in report["results"].items():
+        for name, r in functions.items():
+            print(f"  {int(size):>8} {name:<18}{r['cold_us']:>8.1f} ({r['cold_p95_us']:>5.0f}){r['warm_us']:>8.1f} ({r['warm_p95_us']:>5.0f})"
+                  f"{r['alloc_peak_kb']:>10.1f}{r['alloc_retained_kb']:>10.1f}")
+    if report.get("growth"):
+        print("  tillväxt (varm, största/minsta): " + ", ".join(f"{k} x{v}" for k, v in report["growth"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mikrobenchmark för DB- och promptfunktionerna i chattflödet")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Antal rader i history (standard {DEFAULT_SIZES})")
+    parser.add_argument("--repeat", type=int, default=200, help="Anrop per mätning")
+    parser.add_argument("--alloc-repeat", type=int, default=50, help="Anrop under tracemalloc")
+    parser.add_argument("--keep", help="Katalog där databaserna sparas och återanvänds (annars tillfälliga)")
+    parser.add_argument("--max-growth", type=float, default=5.0, help="Största tillåtna tillväxt för varm median")
+    parser.add_argument("--out", help="Skriv resultatet som JSON hit")
+    parser.add_argument("--compare", help="Jämför med ett tidigare resultat (JSON)")
+    parser.add_argument("--max-regression", type=float, default=25.0, help="Procent innan --compare ger exit 1")
+    parser.add_argument("--min-delta-us", type=float, default=5.0, help="Försämringar mindre än så här (µs) ignoreras")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    # Mät funktionerna, inte mätningen eller spårningen runt dem
+    metrics.ENABLED = False
+    tracing.ENABLED = False
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    tmp = None if args.keep else tempfile.TemporaryDirectory(prefix="daa_dbbench_")
+    directory = args.keep or tmp.name
+    os.makedirs(directory, exist_ok=True)
+    report = {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+              "sqlite": sqlite3.sqlite_version, "platform": platform.platform(),
+              "config": {"sizes": sizes, "repeat": args.repeat, "alloc_repeat": args.alloc_repeat}, "results": {}, "db_mb": {}}
+    try:
+        for rows in sizes:
+            path, generated = prepare(directory, rows)
+            if generated: print(f"[BENCH] Skapade {rows} rader på {generated:.1f} s", file=sys.stderr)
+            report["db_mb"][str(rows)] = round(os.path.getsize(path) / 1048576, 1)
+            report["results"][str(rows)] = bench_size(path, args.repeat, args.alloc_repeat)
+    finally:
+        if tmp: tmp.cleanup()
+
+    failures = check_growth(report, args.max_growth)
+    if args.json: print(json.dumps(report, ensure_ascii=False, indent=2))
+    else: print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            failures += compare(report, json.load(f), args.max_regression, args.min_delta_us)
+    if failures:
+        print("\n❌ " + "\n❌ ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
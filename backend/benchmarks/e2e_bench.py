@@ -0,0 +1,356 @@
+"""
+==============================================================================
+FILE: benchmarks/e2e_bench.py
+DESCRIPTION: End-to-end-benchmark av hela backend. server.py startas med
+             uvicorn i en egen process mot en tillfällig databas vars
+             inställningar pekar på de falska tjänsterna i fakes.py (LLM,
+             Home Assistant, MQTT, ElevenLabs). N samtidiga Socket.IO-klienter
+             skickar user_message som frontend gör och mäter tid till första
+             ai_chunk (TTFC), hela svaret, genomströmning och serverns minne.
+
+             Resultatet skrivs som JSON (--out) med commit, så att körningar
+             kan jämföras mellan commits (--compare baseline.json).
+
+             Klienterna kräver aiohttp: pip install "python-socketio[asyncio_client]"
+
+KÖR:  python benchmarks/e2e_bench.py [--clients 10] [--turns 20] [--model gemini-2.0-flash-exp]
+                                     [--ttft-ms 300] [--tokens-per-s 40] [--tts] [--out result.json]
+                                     [--compare baseline.json --max-regression 10]
+==============================================================================
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+from fakes import FakeServices, FakeConfig, free_port
+
+# Meddelanden per sort. "home" ger HA-kontext (REST), "light" och "sensor"
+# får den falska Gemini att anropa verktyg (HA-tjänst resp. MQTT).
+MESSAGES = {
+    "chat": ["Hej DAA, hur mår du idag?", "Berätta något kort om rymden.", "Vad tycker du om kaffe?"],
+    "home": ["Hur ser det ut hemma, är lampor tända?", "Ge mig status för huset."],
+    "light": ["Tänd lampan i köket.", "Släck lampan i köket."],
+    "sensor": ["Vad säger sensor i sovrummet?"],
+}
+DEFAULT_MIX = "chat=6,home=2,light=1,sensor=1"
+# Mätvärden som jämförs med --compare (högre = sämre)
+COMPARED = [("ttfc_ms", "p50"), ("ttfc_ms", "p95"), ("ttfc_ms", "p99"), ("turn_ms", "p95")]
+
+
+def percentile(values, p):
+    """Linjär interpolation mellan närmaste rangerna (som numpy.percentile)."""
+    if not values: return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return round(ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo), 2)
+
+
+def summarize(values):
+    if not values: return {"count": 0}
+    return {"count": len(values), "mean": round(sum(values) / len(values), 2), "min": round(min(values), 2),
+            "p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99), "max": round(max(values), 2)}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in MESSAGES: raise SystemExit(f"Okänd meddelandesort: {kind}")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+def git_commit():
+    def run(*cmd):
+        try: return subprocess.run(cmd, cwd=BACKEND_DIR, capture_output=True, text=True, timeout=10).stdout.strip()
+        except Exception: return ""
+    return {"commit": run("git", "rev-parse", "--short", "HEAD") or None,
+            "dirty": bool(run("git", "status", "--porcelain", "--untracked-files=no"))}
+
+
+def process_memory(pid):
+    """RSS och topp-RSS (MB) för en process. Linux: /proc, annars psutil om det finns."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return {"rss_mb": round(int(fields["VmRSS"].split()[0]) / 1024, 1), "peak_mb": round(int(fields["VmHWM"].split()[0]) / 1024, 1)}
+    except Exception:
+        pass
+    try:
+        import psutil
+        return {"rss_mb": round(psutil.Process(pid).memory_info().rss / 1048576, 1), "peak_mb": None}
+    except Exception:
+        return {"rss_mb": None, "peak_mb": None}
+
+
+# --- SERVER ---
+
+def prepare_database(db_path, settings):
+    """Tillfällig DB med standardprompter och inställningar som pekar på fakes."""
+    os.environ["DAA_DB_PATH"] = db_path
+    from app.core.database import init_db, save_db_setting
+    init_db()
+    for key, value in settings.items():
+        save_db_setting(key, value)
+
+
+def start_server(port, env):
+    cmd = [sys.executable, "-m", "uvicorn", "server:app_socketio", "--host", "127.0.0.1", "--port", str(port),
+           "--log-level", "warning", "--loop", "asyncio"]
+    return subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+
+def wait_ready(proc, url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"Servern avslutades (kod {proc.returncode}):\n{proc.stdout.read()[-3000:]}")
+        try:
+            if httpx.get(f"{url}/ready", timeout=1).status_code == 200: return
+        except httpx.HTTPError: pass
+        time.sleep(0.1)
+    raise SystemExit(f"Servern blev inte redo inom {timeout} s")
+
+
+# --- KLIENTER ---
+
+class Client:
+    """En simulerad frontend: skickar user_message och väntar på ai_done."""
+    def __init__(self, index, url, args, rng):
+        import socketio
+        self.index = index
+        self.url = url
+        self.args = args
+        self.rng = rng
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.turns = []
+        self._turn = None
+        self.sio.on("ai_chunk", self._on_chunk)
+        self.sio.on("ai_done", self._on_done)
+
+    async def _on_chunk(self, data):
+        turn = self._turn
+        if not turn: return
+        now = time.perf_counter()
+        if turn["first"] is None: turn["first"] = now
+        turn["chunks"] += 1
+        turn["chars"] += len(data.get("text", ""))
+        turn["text"] += data.get("text", "")
+
+    async def _on_done(self, data):
+        if self._turn: self._turn["done"].set()
+
+    async def connect(self):
+        await self.sio.connect(self.url, transports=["websocket"], wait_timeout=10)
+
+    async def run(self, count, kinds, weights, http, record=True):
+        for n in range(count):
+            kind = self.rng.choices(kinds, weights)[0]
+            text = f"{self.rng.choice(MESSAGES[kind])} ({self.index}.{n})"
+            self._turn = turn = {"kind": kind, "first": None, "chunks": 0, "chars": 0, "text": "", "done": asyncio.Event()}
+            start = time.perf_counter()
+            await self.sio.emit("user_message", {"text": text, "model": self.args.model, "no_cache": not self.args.cache})
+            try:
+                await asyncio.wait_for(turn["done"].wait(), self.args.turn_timeout)
+                ok = turn["first"] is not None
+            except asyncio.TimeoutError:
+                ok = False
+            end = time.perf_counter()
+            result = {"kind": kind, "ok": ok, "ttfc_ms": round((turn["first"] - start) * 1000, 2) if turn["first"] else None,
+                      "turn_ms": round((end - start) * 1000, 2), "chunks": turn["chunks"], "chars": turn["chars"],
+                      "error": turn["text"].startswith(("Fel:", "⚠️"))}
+            if ok and self.args.tts:
+                t0 = time.perf_counter()
+                resp = await http.post(f"{self.url}/api/tts", json={"text": turn["text"][:500]}, timeout=self.args.turn_timeout)
+                result["tts_ms"] = round((time.perf_counter() - t0) * 1000, 2) if resp.status_code == 200 else None
+            self._turn = None
+            if record: self.turns.append(result)
+            if self.args.think_ms: await asyncio.sleep(self.rng.uniform(0, 2) * self.args.think_ms / 1000)
+
+    async def close(self):
+        await self.sio.disconnect()
+
+
+async def drive(url, args, server_pid):
+    try:
+        import socketio, aiohttp  # noqa: F401
+    except ImportError:
+        raise SystemExit('Klienterna kräver aiohttp: pip install "python-socketio[asyncio_client]"')
+    mix = parse_mix(args.mix)
+    kinds, weights = list(mix), list(mix.values())
+    rng = random.Random(args.seed)
+    clients = [Client(i, url, args, random.Random(rng.random())) for i in range(args.clients)]
+    async with httpx.AsyncClient() as http:
+        await asyncio.gather(*(c.connect() for c in clients))
+        # Uppvärmning: första frågan laddar llm_handler och SDK:erna
+        if args.warmup:
+            await asyncio.gather(*(c.run(args.warmup, kinds, weights, http, record=False) for c in clients))
+        memory_before = process_memory(server_pid)
+        t0 = time.perf_counter()
+        await asyncio.gather(*(c.run(args.turns, kinds, weights, http) for c in clients))
+        elapsed = time.perf_counter() - t0
+        memory_after = process_memory(server_pid)
+        server_metrics = None
+        try: server_metrics = (await http.get(f"{url}/metrics", timeout=5)).text
+        except httpx.HTTPError: pass
+    await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
+    return [t for c in clients for t in c.turns], elapsed, memory_before, memory_after, server_metrics
+
+
+def server_summary(text):
+    """Utdrag ur serverns /metrics: medel per histogram (sekunder -> ms)."""
+    if not text: return {}
+    sums, counts = {}, {}
+    for line in text.splitlines():
+        if line.startswith("#") or " " not in line: continue
+        name, value = line.rsplit(" ", 1)
+        for suffix, target in (("_sum", sums), ("_count", counts)):
+            if name.split("{")[0].endswith(suffix):
+                key = name.replace(suffix, "", 1)
+                target[key] = float(value)
+    return {k: round(sums[k] / counts[k] * 1000, 2) for k in sums if counts.get(k) and k.split("{")[0].endswith("_seconds")}
+
+
+def build_report(args, turns, elapsed, memory_before, memory_after, memory_start, fakes, server_metrics):
+    ok = [t for t in turns if t["ok"]]
+    by_kind = {kind: summarize([t["ttfc_ms"] for t in ok if t["kind"] == kind]) for kind in sorted({t["kind"] for t in turns})}
+    return {
+        **git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"clients": args.clients, "turns_per_client": args.turns, "warmup": args.warmup, "model": args.model,
+                   "mix": args.mix, "cache": args.cache, "tts": args.tts, "think_ms": args.think_ms, "seed": args.seed,
+                   "fakes": vars(fakes.cfg)},
+        "turns": len(turns),
+        "failed": len(turns) - len(ok),
+        "error_answers": sum(1 for t in ok if t["error"]),
+        "ttfc_ms": summarize([t["ttfc_ms"] for t in ok]),
+        "ttfc_ms_by_kind": by_kind,
+        "turn_ms": summarize([t["turn_ms"] for t in ok]),
+        "tts_ms": summarize([t["tts_ms"] for t in ok if t.get("tts_ms") is not None]) if args.tts else None,
+        "throughput": {"elapsed_s": round(elapsed, 2), "turns_per_s": round(len(ok) / elapsed, 2) if elapsed else None,
+                       "chunks_per_s": round(sum(t["chunks"] for t in ok) / elapsed, 1) if elapsed else None,
+                       "chars_per_s": round(sum(t["chars"] for t in ok) / elapsed, 1) if elapsed else None},
+        "memory": {"after_start": memory_start, "before_run": memory_before, "after_run": memory_after},
+        "fake_calls": dict(fakes.stats),
+        "server_avg_ms": server_summary(server_metrics),
+    }
+
+
+def compare(report, baseline, max_regression):
+    """Skillnad mot en tidigare körning. Returnerar listan med försämringar över gränsen."""
+    print(f"\nJämfört med {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    if baseline.get("config") != report["config"]:
+        print("  (obs: körningarna har olika inställningar)")
+    regressions = []
+    for group, stat in COMPARED:
+        old, new = (baseline.get(group) or {}).get(stat), (report.get(group) or {}).get(stat)
+        if not old or new is None: continue
+        change = (new - old) / old * 100
+        flag = "  <-- försämring" if change > max_regression else ""
+        print(f"  {group}.{stat:<4} {old:>9.1f} -> {new:>9.1f} ms ({change:+.1f} %){flag}")
+        if flag: regressions.append(f"{group}.{stat}")
+    old_tp = (baseline.get("throughput") or {}).get("turns_per_s")
+    new_tp = report["throughput"]["turns_per_s"]
+    if old_tp and new_tp is not None:
+        print(f"  turns/s   {old_tp:>9.2f} -> {new_tp:>9.2f}    ({(new_tp - old_tp) / old_tp * 100:+.1f} %)")
+    return regressions
+
+
+def print_report(r):
+    t, f = r["ttfc_ms"], r["turn_ms"]
+    print(f"\nE2E ({r['commit']}{'+' if r['dirty'] else ''}): {r['config']['clients']} klienter x "
+          f"{r['config']['turns_per_client']} turer, modell {r['config']['model']}")
+    print(f"  turer: {r['turns']} (misslyckade {r['failed']}, felsvar {r['error_answers']})")
+    if t.get("count"):
+        print(f"  TTFC ms:  p50 {t['p50']}  p95 {t['p95']}  p99 {t['p99']}  (medel {t['mean']}, max {t['max']})")
+        print(f"  tur ms:   p50 {f['p50']}  p95 {f['p95']}  p99 {f['p99']}")
+    for kind, s in r["ttfc_ms_by_kind"].items():
+        if s.get("count"): print(f"    {kind:<7} TTFC p50 {s['p50']}  p95 {s['p95']}  (n={s['count']})")
+    if r.get("tts_ms") and r["tts_ms"].get("count"):
+        print(f"  TTS ms:   p50 {r['tts_ms']['p50']}  p95 {r['tts_ms']['p95']}")
+    tp = r["throughput"]
+    print(f"  genomströmning: {tp['turns_per_s']} turer/s, {tp['chunks_per_s']} bitar/s ({tp['elapsed_s']} s)")
+    mem = r["memory"]
+    print(f"  minne (RSS MB): start {mem['after_start']['rss_mb']}, före {mem['before_run']['rss_mb']}, "
+          f"efter {mem['after_run']['rss_mb']}, topp {mem['after_run']['peak_mb']}")
+    print(f"  anrop till fakes: {r['fake_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end-benchmark av server.py mot lokala fakes")
+    parser.add_argument("--clients", type=int, default=10, help="Samtidiga Socket.IO-klienter")
+    parser.add_argument("--turns", type=int, default=20, help="Mätta turer per klient")
+    parser.add_argument("--warmup", type=int, default=1, help="Omätta turer per klient först")
+    parser.add_argument("--model", default="gemini-2.0-flash-exp", help="T.ex. gemini-2.0-flash-exp, gpt-4o, ollama: llama3")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Meddelandesorter och vikter (standard {DEFAULT_MIX})")
+    parser.add_argument("--cache", action="store_true", help="Tillåt den semantiska cachen (standard av)")
+    parser.add_argument("--tts", action="store_true", help="Hämta även TTS (/api/tts) för varje svar")
+    parser.add_argument("--think-ms", type=float, default=0, help="Medelpaus mellan en klients frågor")
+    parser.add_argument("--turn-timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--ttft-ms", type=float, default=FakeConfig.ttft_ms, help="Fake-LLM: tid till första token")
+    parser.add_argument("--tokens-per-s", type=float, default=FakeConfig.tokens_per_s, help="Fake-LLM: tokens per sekund")
+    parser.add_argument("--tokens", type=int, default=FakeConfig.tokens, help="Fake-LLM: tokens per svar")
+    parser.add_argument("--ha-ms", type=float, default=FakeConfig.ha_ms)
+    parser.add_argument("--tts-ms", type=float, default=FakeConfig.tts_ms)
+    parser.add_argument("--out", help="Skriv resultatet som JSON hit")
+    parser.add_argument("--compare", help="Jämför med ett tidigare resultat (JSON)")
+    parser.add_argument("--max-regression", type=float, default=10.0, help="Procent innan --compare ger exit 1")
+    parser.add_argument("--json", action="store_true", help="Skriv hela resultatet som JSON på stdout")
+    parser.add_argument("--server-log", action="store_true", help="Visa serverns utskrifter efteråt")
+    args = parser.parse_args()
+
+    cfg = FakeConfig(ttft_ms=args.ttft_ms, tokens_per_s=args.tokens_per_s, tokens=args.tokens, ha_ms=args.ha_ms, tts_ms=args.tts_ms)
+    with tempfile.TemporaryDirectory(prefix="daa_e2e_") as tmp, FakeServices(cfg) as fakes:
+        db_path = os.path.join(tmp, "bench.db")
+        prepare_database(db_path, fakes.settings())
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        env = {**os.environ, "DAA_DB_PATH": db_path, "DAA_TRACE_DIR": os.path.join(tmp, "traces"), "PYTHONUNBUFFERED": "1"}
+        proc = start_server(port, env)
+        try:
+            wait_ready(proc, url, timeout=60)
+            memory_start = process_memory(proc.pid)
+            turns, elapsed, before, after, server_metrics = asyncio.run(drive(url, args, proc.pid))
+        finally:
+            proc.terminate()
+            try: log = proc.communicate(timeout=10)[0]
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                log = proc.communicate()[0]
+        report = build_report(args, turns, elapsed, before, after, memory_start, fakes, server_metrics)
+
+    if args.server_log: print(log)
+    if args.json: print(json.dumps(report, ensure_ascii=False, indent=2))
+    else: print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nSparat: {args.out}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        if regressions:
+            print(f"\n❌ Försämring över {args.max_regression} %: {', '.join(regressions)}")
+            sys.exit(1)
+    if report["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
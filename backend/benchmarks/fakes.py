@@ -0,0 +1,365 @@
+"""
+==============================================================================
+FILE: benchmarks/fakes.py
+DESCRIPTION: Lokala ersättare för de externa tjänsterna, för benchmarks utan
+             nätverk och API-nycklar (se e2e_bench.py):
+
+             - LLM: Gemini (REST generateContent, med verktygsanrop),
+               OpenAI (/v1/chat/completions, SSE) och Ollama (/api/chat,
+               NDJSON) med inställbar tid till första token och tokens/s
+             - Home Assistant: REST (/api/states, /api/services) och
+               WebSocket-API:t (/api/websocket)
+             - MQTT-broker (MQTT 3.1.1, QoS 0) som svarar med retained
+               sensorvärden som Zigbee2MQTT
+             - ElevenLabs text-to-speech
+
+             Alla körs i en egen tråd med en egen event-loop, så att de inte
+             stjäl tid från klienterna som mäter.
+
+KÖR:  python benchmarks/fakes.py [--ttft-ms 300] [--tokens-per-s 40]   (skriver inställningarna)
+==============================================================================
+"""
+import json
+import time
+import socket
+import struct
+import asyncio
+import argparse
+import threading
+from dataclasses import dataclass
+
+import uvicorn
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+WORDS = ("Verkställer", "Anders.", "Allt", "ser", "bra", "ut", "här", "hemma", "och", "inget", "kräver",
+         "din", "uppmärksamhet", "just", "nu.", "Temperaturen", "är", "behaglig", "och", "lamporna", "lyser.")
+
+# Meddelanden som får den falska Gemini att anropa ett verktyg först (automatic function calling)
+TOOL_TRIGGERS = {
+    "tänd": ("tool_control_light", {"entity_id": "light.kok", "action": "on"}),
+    "släck": ("tool_control_light", {"entity_id": "light.kok", "action": "off"}),
+    "sensor": ("tool_get_sensor", {"friendly_name": "sovrum"}),
+}
+
+
+@dataclass
+class FakeConfig:
+    ttft_ms: float = 300.0        # tid till första token
+    tokens_per_s: float = 40.0    # därefter
+    tokens: int = 40              # tokens per svar
+    ha_ms: float = 15.0           # Home Assistant REST/WebSocket
+    mqtt_ms: float = 5.0          # innan broker skickar sensorvärdet
+    tts_ms: float = 250.0         # ElevenLabs per anrop
+    tts_bytes_per_char: int = 60  # storlek på "ljudet"
+
+
+def _tokens(count):
+    return [WORDS[i % len(WORDS)] + " " for i in range(count)]
+
+
+async def _token_stream(cfg):
+    """(token) med fakens TTFT och tokens/s."""
+    await asyncio.sleep(cfg.ttft_ms / 1000)
+    delay = 1 / cfg.tokens_per_s if cfg.tokens_per_s > 0 else 0
+    for i, token in enumerate(_tokens(cfg.tokens)):
+        if i and delay: await asyncio.sleep(delay)
+        yield token
+
+
+# --- LLM ---
+
+def llm_app(cfg, stats):
+    app = FastAPI()
+
+    @app.get("/v1beta/models")
+    async def gemini_models():
+        return {"models": [{"name": "models/gemini-2.0-flash-exp", "displayName": "Gemini 2.0 Flash (fake)",
+                            "supportedGenerationMethods": ["generateContent", "streamGenerateContent"]}]}
+
+    @app.post("/v1beta/models/{target:path}")
+    async def gemini_generate(target: str, request: Request):
+        """generateContent: svaret kommer i sin helhet (SDK:n strömmar inte med verktyg)."""
+        body = await request.json()
+        stats["gemini"] = stats.get("gemini", 0) + 1
+        contents = body.get("contents") or [{}]
+        last = contents[-1].get("parts") or [{}]
+        answered_tool = any("functionResponse" in p or "function_response" in p for p in last)
+        text = " ".join(p.get("text", "") for p in last).lower()
+        call = None if answered_tool else next((c for word, c in TOOL_TRIGGERS.items() if word in text), None)
+        if call:
+            await asyncio.sleep(cfg.ttft_ms / 1000)
+            parts = [{"functionCall": {"name": call[0], "args": call[1]}}]
+        else:
+            parts = [{"text": "".join([t async for t in _token_stream(cfg)])}]
+        return {"candidates": [{"content": {"role": "model", "parts": parts}, "finishReason": "STOP", "index": 0}],
+                "usageMetadata": {"promptTokenCount": 100, "candidatesTokenCount": cfg.tokens, "totalTokenCount": 100 + cfg.tokens}}
+
+    @app.post("/v1/chat/completions")
+    async def openai_completions(request: Request):
+        body = await request.json()
+        stats["openai"] = stats.get("openai", 0) + 1
+        model, created = body.get("model", "gpt-4o"), int(time.time())
+
+        def chunk(delta, finish=None):
+            return "data: " + json.dumps({"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                                          "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}) + "\n\n"
+
+        async def events():
+            yield chunk({"role": "assistant", "content": ""})
+            async for token in _token_stream(cfg):
+                yield chunk({"content": token})
+            yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+        if not body.get("stream"):
+            text = "".join([t async for t in _token_stream(cfg)])
+            return {"id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]}
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/api/tags")
+    async def ollama_tags():
+        return {"models": [{"name": "llama3:fake"}]}
+
+    @app.post("/api/chat")
+    async def ollama_chat(request: Request):
+        body = await request.json()
+        stats["ollama"] = stats.get("ollama", 0) + 1
+        model = body.get("model", "llama3")
+
+        async def lines():
+            async for token in _token_stream(cfg):
+                yield json.dumps({"model": model, "message": {"role": "assistant", "content": token}, "done": False}) + "\n"
+            yield json.dumps({"model": model, "message": {"role": "assistant", "content": ""}, "done": True}) + "\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    return app
+
+
+# --- HOME ASSISTANT ---
+
+def _ha_state(entity_id, state=None):
+    domain = entity_id.split(".")[0]
+    if domain == "sensor":
+        return {"entity_id": entity_id, "state": "21.5", "attributes": {"unit_of_measurement": "°C", "friendly_name": entity_id}}
+    return {"entity_id": entity_id, "state": state or ("docked" if domain == "vacuum" else "on"),
+            "attributes": {"friendly_name": entity_id}}
+
+
+def ha_app(cfg, stats):
+    app = FastAPI()
+
+    @app.get("/api/states/{entity_id}")
+    async def state(entity_id: str):
+        stats["ha_rest"] = stats.get("ha_rest", 0) + 1
+        await asyncio.sleep(cfg.ha_ms / 1000)
+        return _ha_state(entity_id)
+
+    @app.post("/api/services/{domain}/{service}")
+    async def service(domain: str, service: str, request: Request):
+        stats["ha_rest"] = stats.get("ha_rest", 0) + 1
+        body = await request.json()
+        await asyncio.sleep(cfg.ha_ms / 1000)
+        ids = body.get("entity_id") or []
+        ids = [ids] if isinstance(ids, str) else ids
+        new_state = {"turn_off": "off", "return_to_base": "returning"}.get(service, "on")
+        return JSONResponse([_ha_state(e, new_state) for e in ids])
+
+    @app.websocket("/api/websocket")
+    async def websocket(ws: WebSocket):
+        """auth_required -> auth -> auth_ok, därefter result för varje kommando."""
+        await ws.accept()
+        await ws.send_json({"type": "auth_required", "ha_version": "fake"})
+        try:
+            auth = await ws.receive_json()
+            if auth.get("type") != "auth":
+                await ws.close(); return
+            await ws.send_json({"type": "auth_ok", "ha_version": "fake"})
+            while True:
+                msg = await ws.receive_json()
+                stats["ha_ws"] = stats.get("ha_ws", 0) + 1
+                await asyncio.sleep(cfg.ha_ms / 1000)
+                result = None
+                if msg.get("type") == "get_states":
+                    result = [_ha_state(e) for e in ("light.kok", "vacuum.robot", "sensor.sovrum_temperature")]
+                await ws.send_json({"id": msg.get("id"), "type": "result", "success": True, "result": result})
+                if msg.get("type") == "subscribe_events":
+                    await ws.send_json({"id": msg.get("id"), "type": "event", "event": {
+                        "event_type": "state_changed", "data": {"entity_id": "light.kok", "new_state": _ha_state("light.kok")}}})
+        except WebSocketDisconnect:
+            pass
+
+    return app
+
+
+# --- ELEVENLABS ---
+
+def elevenlabs_app(cfg, stats):
+    app = FastAPI()
+
+    @app.post("/v1/text-to-speech/{voice_id}")
+    async def tts(voice_id: str, request: Request):
+        body = await request.json()
+        stats["tts"] = stats.get("tts", 0) + 1
+        await asyncio.sleep(cfg.tts_ms / 1000)
+        return Response(b"\xff\xfb" * (len(body.get("text", "")) * cfg.tts_bytes_per_char // 2), media_type="audio/mpeg")
+
+    return app
+
+
+# --- MQTT ---
+
+class MqttBroker:
+    """
+    Minimal MQTT 3.1.1-broker (bara QoS 0). Varje prenumeration får direkt
+    ett retained Zigbee2MQTT-meddelande för ämnet, vilket är allt som
+    z2m_core (paho subscribe.simple) behöver.
+    """
+    def __init__(self, cfg, stats, payload=None):
+        self.cfg = cfg
+        self.stats = stats
+        self.payload = payload or {"temperature": 21.5, "humidity": 41, "battery": 97, "linkquality": 120}
+        self.server = None
+
+    async def start(self, host, port):
+        self.server = await asyncio.start_server(self._client, host, port)
+
+    @staticmethod
+    def _packet(kind, body):
+        length, encoded = len(body), bytearray()
+        while True:
+            byte, length = length % 128, length // 128
+            encoded.append(byte | (0x80 if length else 0))
+            if not length: break
+        return bytes([kind]) + bytes(encoded) + body
+
+    async def _read(self, reader):
+        header = (await reader.readexactly(1))[0]
+        length, shift = 0, 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80: break
+        return header, await reader.readexactly(length) if length else b""
+
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                header, body = await self._read(reader)
+                kind = header >> 4
+                if kind == 1:      # CONNECT
+                    writer.write(self._packet(0x20, b"\x00\x00"))
+                elif kind == 8:    # SUBSCRIBE
+                    packet_id, pos, topics = body[:2], 2, []
+                    while pos < len(body):
+                        size = struct.unpack("!H", body[pos:pos + 2])[0]
+                        topics.append(body[pos + 2:pos + 2 + size])
+                        pos += size + 3
+                    writer.write(self._packet(0x90, packet_id + b"\x00" * len(topics)))
+                    await writer.drain()
+                    await asyncio.sleep(self.cfg.mqtt_ms / 1000)
+                    for topic in topics:
+                        self.stats["mqtt"] = self.stats.get("mqtt", 0) + 1
+                        data = json.dumps(self.payload).encode()
+                        # 0x31 = PUBLISH, QoS 0, retained
+                        writer.write(self._packet(0x31, struct.pack("!H", len(topic)) + topic + data))
+                elif kind == 10:   # UNSUBSCRIBE
+                    writer.write(self._packet(0xB0, body[:2]))
+                elif kind == 12:   # PINGREQ
+                    writer.write(self._packet(0xD0, b""))
+                elif kind == 14:   # DISCONNECT
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+# --- START ---
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class FakeServices:
+    """
+    Startar alla fakes i en bakgrundstråd. settings() ger inställningarna
+    som pekar DAA mot dem. stats räknar anropen per tjänst.
+    """
+    def __init__(self, cfg=None, host="127.0.0.1"):
+        self.cfg = cfg or FakeConfig()
+        self.host = host
+        self.stats = {}
+        self.ports = {name: free_port() for name in ("llm", "ha", "tts", "mqtt")}
+        self._servers = []
+        self._loop = None
+        self._thread = None
+        self._started = threading.Event()
+
+    def settings(self):
+        url = lambda name: f"http://{self.host}:{self.ports[name]}"
+        return {
+            "GOOGLE_API_KEY": "fake-google", "GEMINI_API_ENDPOINT": url("llm"),
+            "OPENAI_API_KEY": "fake-openai", "OPENAI_BASE_URL": f"{url('llm')}/v1",
+            "OLLAMA_URL": url("llm"),
+            "HA_BASE_URL": url("ha"), "HA_TOKEN": "fake-ha", "HA_CONTEXT_ENTITIES": "light.kok,sensor.sovrum_temperature",
+            "MQTT_BROKER_IP": self.host, "MQTT_PORT": str(self.ports["mqtt"]), "MQTT_TOPIC_BASE": "zigbee2mqtt",
+            "ELEVENLABS_API_KEY": "fake-elevenlabs", "ELEVENLABS_BASE_URL": url("tts"),
+        }
+
+    async def _serve(self):
+        apps = {"llm": llm_app, "ha": ha_app, "tts": elevenlabs_app}
+        for name, make in apps.items():
+            server = uvicorn.Server(uvicorn.Config(make(self.cfg, self.stats), host=self.host, port=self.ports[name],
+                                                   log_level="warning", loop="asyncio", lifespan="off"))
+            self._servers.append(server)
+            asyncio.create_task(server.serve())
+        broker = MqttBroker(self.cfg, self.stats)
+        await broker.start(self.host, self.ports["mqtt"])
+        while not all(s.started for s in self._servers):
+            await asyncio.sleep(0.01)
+        self._started.set()
+        while not all(s.should_exit for s in self._servers):
+            await asyncio.sleep(0.1)
+        broker.server.close()
+        await asyncio.sleep(0.2)
+
+    def start(self, timeout=10):
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._serve())
+        self._thread = threading.Thread(target=run, name="fakes", daemon=True)
+        self._thread.start()
+        if not self._started.wait(timeout):
+            raise RuntimeError("Fakes startade inte")
+        return self
+
+    def stop(self):
+        for server in self._servers:
+            server.should_exit = True
+        if self._thread: self._thread.join(5)
+
+    def __enter__(self): return self.start()
+    def __exit__(self, *exc): self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kör de falska tjänsterna tills Ctrl+C")
+    parser.add_argument("--ttft-ms", type=float, default=FakeConfig.ttft_ms)
+    parser.add_argument("--tokens-per-s", type=float, default=FakeConfig.tokens_per_s)
+    parser.add_argument("--tokens", type=int, default=FakeConfig.tokens)
+    args = parser.parse_args()
+    fakes = FakeServices(FakeConfig(ttft_ms=args.ttft_ms, tokens_per_s=args.tokens_per_s, tokens=args.tokens)).start()
+    print(json.dumps(fakes.settings(), indent=2))
+    try:
+        while True: time.sleep(1)
+    except KeyboardInterrupt:
+        fakes.stop()
+
+
+if __name__ == "__main__":
+    main()
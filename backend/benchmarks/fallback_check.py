@@ -0,0 +1,127 @@
+"""
+==============================================================================
+FILE: benchmarks/fallback_check.py
+DESCRIPTION: Kontrollerar FallbackPolicy och circuit breakers utan nätverk:
+             att en halvöppen brytare återhämtar sig när provanropet var
+             förloraren i ett lopp (avbrutet i stream(), övergivet i call()),
+             att en parallell reserv startas med hedge_factory (utan verktyg)
+             och att head_start=None aldrig kör två leverantörer samtidigt.
+             Misslyckas (exit 1) om någon kontroll inte håller.
+
+KÖR:  python benchmarks/fallback_check.py
+==============================================================================
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.services import fallback
+from app.services.fallback import FallbackPolicy, CircuitBreaker
+
+COOLDOWN = 0.05
+
+
+def half_open(name):
+    """Brytare som just gått över till halvöppen."""
+    breaker = CircuitBreaker(min_calls=1, cooldown=COOLDOWN)
+    breaker.record(False)
+    time.sleep(COOLDOWN * 1.5)
+    fallback._breakers[name] = breaker
+    assert breaker.state == "half_open" and breaker.allow()
+    return breaker
+
+
+async def slow(name, delay, text="svar"):
+    await asyncio.sleep(delay)
+    yield text
+
+
+def check_stream_cancelled_trial():
+    trial = half_open("stream_a")
+    policy = FallbackPolicy(["stream_a", "stream_b"], head_start=0.01)
+
+    async def run():
+        factory = lambda m: slow(m, 10.0) if m == "stream_a" else slow(m, 0.02)
+        return [x async for x in policy.stream(factory)]
+    out = asyncio.run(run())
+    assert out == [("stream_b", "svar")], out
+    assert not trial.trial_running, "avbrutet provanrop reserverar fortfarande brytaren"
+    assert trial.allow(), "brytaren släpper aldrig igenom ett nytt provanrop"
+
+
+def check_call_abandoned_trial():
+    trial = half_open("call_a")
+    release = threading.Event()
+    policy = FallbackPolicy(["call_a", "call_b"], head_start=0.01)
+
+    def fn(name):
+        if name == "call_a":
+            release.wait(5)
+            return "sent svar"
+        return "svar"
+    assert policy.call(fn) == ("call_b", "svar")
+    assert trial.trial_running, "provanropet kör fortfarande"
+    release.set()
+    deadline = time.time() + 2
+    while trial.trial_running and time.time() < deadline: time.sleep(0.01)
+    assert not trial.trial_running, "övergivet provanrop släpps aldrig"
+    assert trial.state == "closed", "lyckat (sent) provanrop stänger inte brytaren"
+
+
+def check_hedge_factory():
+    plain, hedged = [], []
+    policy = FallbackPolicy(["hedge_a", "hedge_b"], head_start=0.01)
+
+    async def run():
+        def factory(m):
+            plain.append(m)
+            return slow(m, 10.0)
+        def hedge(m):
+            hedged.append(m)
+            return slow(m, 0.01)
+        return [x async for x in policy.stream(factory, hedge_factory=hedge)]
+    out = asyncio.run(run())
+    assert out == [("hedge_b", "svar")], out
+    assert plain == ["hedge_a"] and hedged == ["hedge_b"], (plain, hedged)
+
+
+def check_no_hedge():
+    active, peak = [0], [0]
+    policy = FallbackPolicy(["seq_a", "seq_b"], head_start=None)
+
+    async def gen(m):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        try:
+            await asyncio.sleep(0.1)
+            if m == "seq_a": raise RuntimeError("fel")
+            yield "svar"
+        finally:
+            active[0] -= 1
+
+    async def run():
+        return [x async for x in policy.stream(gen)]
+    assert asyncio.run(run()) == [("seq_b", "svar")]
+    assert peak[0] == 1, f"{peak[0]} leverantörer körde samtidigt"
+
+
+CHECKS = [check_stream_cancelled_trial, check_call_abandoned_trial, check_hedge_factory, check_no_hedge]
+
+
+def main():
+    failures = 0
+    for check in CHECKS:
+        try:
+            check()
+            print(f"✅ {check.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {check.__name__}: {e}")
+    if failures: sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
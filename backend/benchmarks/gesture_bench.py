@@ -0,0 +1,100 @@
+"""
+==============================================================================
+FILE: benchmarks/gesture_bench.py
+DESCRIPTION: Spelar upp en inspelad video genom gestmotorn och mäter
+             bilder per sekund och CPU-tid per bild. Jämför gärna med
+             --legacy (den gamla pipelinen) och --no-gate (utan frame
+             differencing). Videon spelas så fort som möjligt, utan den
+             adaptiva väntetiden, så att siffrorna mäter själva analysen.
+
+KÖR:  python benchmarks/gesture_bench.py inspelning.mp4 [--legacy] [--no-gate] [--json]
+==============================================================================
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.tools.gesture_engine import GestureEngine, extract_roi, classify
+
+
+def legacy_process(frame):
+    """Den ursprungliga pipelinen från vision_core (för jämförelse)."""
+    roi = extract_roi(frame)
+    hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, np.array([0, 20, 70], dtype=np.uint8), np.array([20, 255, 255], dtype=np.uint8))
+    mask = cv2.dilate(mask, np.ones((3, 3), np.uint8), iterations=4)
+    mask = cv2.GaussianBlur(mask, (5, 5), 100)
+    contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours: return None, None
+    contour = max(contours, key=lambda x: cv2.contourArea(x))
+    if cv2.contourArea(contour) <= 10000: return None, None
+    defects = cv2.convexityDefects(contour, cv2.convexHull(contour, returnPoints=False))
+    if defects is None: return None, None
+    count = 0
+    defects, points = defects.reshape(-1, 4), contour.reshape(-1, 2)
+    for i in range(defects.shape[0]):
+        s, e, f, d = defects[i]
+        start, end, far = tuple(points[s]), tuple(points[e]), tuple(points[f])
+        a = math.sqrt((end[0] - start[0]) ** 2 + (end[1] - start[1]) ** 2)
+        b = math.sqrt((far[0] - start[0]) ** 2 + (far[1] - start[1]) ** 2)
+        c = math.sqrt((end[0] - far[0]) ** 2 + (end[1] - far[1]) ** 2)
+        if b * c and math.acos(max(-1, min(1, (b ** 2 + c ** 2 - a ** 2) / (2 * b * c)))) * 57 <= 90:
+            count += 1
+    return classify(count + 1), count + 1
+
+
+def run(video, legacy=False, gate=True, repeat=1):
+    engine = GestureEngine(use_motion_gate=gate, adaptive=False)
+    process = legacy_process if legacy else engine.process
+    frames, gestures = 0, {}
+    wall, cpu = 0.0, 0.0
+    for _ in range(repeat):
+        cap = cv2.VideoCapture(video)
+        if not cap.isOpened():
+            raise SystemExit(f"Kunde inte öppna {video}")
+        while True:
+            ret, frame = cap.read()
+            if not ret: break
+            t0, c0 = time.perf_counter(), time.process_time()
+            gesture, _ = process(frame)
+            wall += time.perf_counter() - t0
+            cpu += time.process_time() - c0
+            frames += 1
+            if gesture: gestures[gesture] = gestures.get(gesture, 0) + 1
+        cap.release()
+    return {
+        "pipeline": "legacy" if legacy else ("engine" if gate else "engine_no_gate"),
+        "frames": frames,
+        "analyzed": frames if legacy else engine.analyzed,
+        "fps": round(frames / wall, 1) if wall else None,
+        "cpu_ms_per_frame": round(cpu / frames * 1000, 3) if frames else None,
+        "wall_ms_per_frame": round(wall / frames * 1000, 3) if frames else None,
+        "gestures": gestures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark för gestmotorn")
+    parser.add_argument("video", help="Inspelad video (t.ex. från webbkameran)")
+    parser.add_argument("--legacy", action="store_true", help="Mät den gamla pipelinen")
+    parser.add_argument("--no-gate", action="store_true", help="Stäng av frame differencing")
+    parser.add_argument("--repeat", type=int, default=1, help="Spela upp videon flera gånger")
+    parser.add_argument("--json", action="store_true", help="Skriv resultatet som JSON")
+    args = parser.parse_args()
+
+    result = run(args.video, legacy=args.legacy, gate=not args.no_gate, repeat=args.repeat)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        for key, value in result.items():
+            print(f"{key:>18}: {value}")
+
+
+if __name__ == "__main__":
+    main()
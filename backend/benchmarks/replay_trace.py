@@ -0,0 +1,200 @@
+"""
+==============================================================================
+FILE: benchmarks/replay_trace.py
+DESCRIPTION: Spelar upp spårade chatturer (logs/traces/turns.jsonl) offline.
+             Den riktiga pipelinen (run_turn, datakällor, cache, reservmodell,
+             DB) körs, men modellen, minnet och datakällorna ersätts av
+             stubbar som väntar lika länge som i spårningen och returnerar
+             lika mycket text. Skillnaden mellan inspelad och uppspelad tid
+             per steg visar var en prestandaförsämring sitter.
+
+             --scale 0 tar bort all väntan (bara den lokala koden mäts).
+
+KÖR:  python benchmarks/replay_trace.py [--file turns.jsonl] [--id ID | --last 5] [--scale 1.0] [--json]
+==============================================================================
+"""
+import os
+import sys
+import json
+import time
+import types
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Uppspelningen ska inte röra den riktiga databasen
+_tmp = tempfile.TemporaryDirectory(prefix="daa_replay_")
+import config.settings as settings
+settings.DB_PATH = os.path.join(_tmp.name, "replay.db")
+import app.core.database as database
+database.DB_PATH = settings.DB_PATH
+
+from app.utils import tracing
+from app.utils.metrics import timed_stream
+
+
+class Collector:
+    """Ersätter TraceWriter: uppspelningens egna spårningar sparas i minnet."""
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+    def close(self, timeout=None):
+        pass
+
+
+def _stages(record, name):
+    return [s for s in record.get("stages", []) if s.get("name") == name]
+
+
+def _duration(stage):
+    return max(0.0, (stage.get("end_ms") or stage.get("start_ms", 0)) - stage.get("start_ms", 0))
+
+
+async def _sleep_ms(ms, scale):
+    if ms and scale:
+        await asyncio.sleep(ms * scale / 1000)
+
+
+def stub_llm(record, scale):
+    """llm_handler med en stream_response som spelar upp spårningens minnessökning, modell och verktyg."""
+    winner = record.get("provider") or record.get("model")
+    llm = next((s for s in _stages(record, "llm") if s.get("first_token_ms") is not None), None) or {}
+    memory = _stages(record, "memory_search")
+    tool_calls = [c for c in record.get("calls", []) if c.get("kind") == "tool"]
+    chunks = max(1, record.get("response_chunks") or 1)
+    chars = record.get("response_chars") or 0
+
+    async def replay(model_id, history, new_message, image_data=None, system_injection=None, tools=True):
+        if model_id != winner:
+            from app.services.chat_pipeline import _head_start
+            # Förloraren i spårningen: svarar aldrig (reservmodellen tar över efter försprånget),
+            # eller misslyckas om modellen inte hedgas (Gemini)
+            if _head_start(model_id) is None: raise RuntimeError("förlorade i spårningen")
+            await asyncio.sleep(3600)
+        for stage in memory:
+            with tracing.stage("memory_search"):
+                await _sleep_ms(_duration(stage), scale)
+        with tracing.stage("llm", provider="replay", model=model_id) as entry:
+            ttft = (llm.get("first_token_ms") or 0) - llm.get("start_ms", 0)
+            # Verktygen körs innan första token (Geminis automatiska function calling)
+            for call in (tool_calls if tools else []):
+                t0 = time.perf_counter()
+                await _sleep_ms(call.get("ms", 0), scale)
+                trace = tracing.current()
+                if trace: trace.call("tool", call["op"], call.get("args"), call.get("kwargs"), t0, time.perf_counter())
+            await _sleep_ms(max(0.0, ttft - sum(c.get("ms", 0) for c in tool_calls if tools)), scale)
+            trace = tracing.current()
+            if trace: entry["first_token_ms"] = trace.ms()
+            rest = max(0.0, _duration(llm) - ttft)
+            size = max(1, chars // chunks)
+            for i in range(chunks):
+                if i: await _sleep_ms(rest / max(1, chunks - 1), scale)
+                yield "x" * size
+
+    module = types.ModuleType("app.services.llm_handler")
+    module.stream_response = lambda *a, **k: timed_stream("response", replay(*a, **k), model=a[0])
+    return module
+
+
+def stub_context(record, scale):
+    """Ersätter datakällorna med stubbar som tar lika lång tid och ger lika mycket text."""
+    from app.services import context_providers
+    context_providers._providers.clear()
+    for src in record.get("context_sources", []):
+        ms = src.get("ms", 0) if not src.get("timed_out") else (context_providers.DEFAULT_BUDGET * 1000 + 500)
+        text = "x" * src.get("chars", 0)
+
+        async def fetch(ms=ms, text=text):
+            await _sleep_ms(ms, scale)
+            return text
+        provider = context_providers.register_provider(src["source"], fetch, ttl=3600, scorer=lambda m: 1.0)
+        if src.get("cached"):
+            provider.cached_text, provider.cached_at = text, time.time()
+    # Inga källor i spårningen: registrera inga standardkällor heller
+    if not context_providers._providers:
+        context_providers.register_provider("_none", lambda: None, ttl=0, scorer=lambda m: 0.0)
+
+
+def seed_history(record, session_id):
+    database.init_db()
+    with database.get_db_connection() as conn:
+        conn.execute("DELETE FROM history")
+        count = record.get("history_messages") or 0
+        size = (record.get("history_chars") or 0) // max(1, count)
+        conn.executemany("INSERT INTO history (session_id, role, content) VALUES (?, ?, ?)",
+                         [(session_id, "user" if i % 2 == 0 else "assistant", "x" * size) for i in range(count)])
+        conn.commit()
+
+
+async def replay_one(record, scale):
+    from app.services import chat_pipeline
+    sys.modules["app.services.llm_handler"] = stub_llm(record, scale)
+    stub_context(record, scale)
+    seed_history(record, "replay")
+    collector = Collector()
+    tracing._writer = collector
+    head_start = chat_pipeline.CHAT_HEAD_START
+    chat_pipeline.CHAT_HEAD_START = max(0.05, head_start * scale)
+    try:
+        async for _ in chat_pipeline.run_turn("x" * (record.get("message_chars") or 1), record.get("model"),
+                                              session_id="replay", use_cache=False, source="replay"):
+            pass
+    finally:
+        chat_pipeline.CHAT_HEAD_START = head_start
+    return collector.records[-1]
+
+
+def compare(recorded, replayed):
+    def summary(r):
+        out = {"total": r.get("total_ms"), "first_chunk": r.get("first_chunk_ms")}
+        for s in r.get("stages", []):
+            out[s["name"]] = round(out.get(s["name"], 0) + _duration(s), 2)
+        return out
+    a, b = summary(recorded), summary(replayed)
+    rows = []
+    for key in list(dict.fromkeys(list(a) + list(b))):
+        ra, rb = a.get(key), b.get(key)
+        rows.append({"step": key, "recorded_ms": ra, "replayed_ms": rb,
+                     "diff_ms": round(rb - ra, 2) if ra is not None and rb is not None else None})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spela upp spårade chatturer mot stubbar")
+    parser.add_argument("--file", help=f"Spårningsfil (standard {os.path.join(tracing.TRACE_DIR, tracing.TRACE_FILE)})")
+    parser.add_argument("--id", help="Spela bara upp turen med detta id")
+    parser.add_argument("--last", type=int, default=1, help="Spela upp de N senaste turerna")
+    parser.add_argument("--scale", type=float, default=1.0, help="Skala väntetiderna (0 = ingen väntan)")
+    parser.add_argument("--json", action="store_true", help="Skriv resultatet som JSON")
+    args = parser.parse_args()
+
+    records = [r for r in tracing.read_traces(args.file) if r.get("source") != "replay"]
+    records = [r for r in records if r.get("id") == args.id] if args.id else records[-args.last:]
+    if not records:
+        raise SystemExit("Inga spårningar hittades.")
+
+    results = []
+    for record in records:
+        replayed = asyncio.run(replay_one(record, args.scale))
+        results.append({"id": record["id"], "source": record.get("source"), "model": record.get("model"),
+                        "cache_hit": record.get("cache_hit", False), "steps": compare(record, replayed)})
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    for res in results:
+        note = " (cacheträff i originalet, uppspelad utan cache)" if res["cache_hit"] else ""
+        print(f"\nTur {res['id']} [{res['source']}] {res['model']}{note}")
+        print(f"  {'steg':<16}{'inspelat':>12}{'uppspelat':>12}{'skillnad':>12}")
+        for row in res["steps"]:
+            fmt = lambda v: "-" if v is None else f"{v:.1f}"
+            print(f"  {row['step']:<16}{fmt(row['recorded_ms']):>12}{fmt(row['replayed_ms']):>12}{fmt(row['diff_ms']):>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+==============================================================================
+FILE: benchmarks/startup_budget.py
+DESCRIPTION: Kontrollerar att server.py startar snabbt. Importerar servern
+             med `python -X importtime` i en ny process och misslyckas
+             (exit 1) om importen tar längre än budgeten eller om något av
+             de tunga paketen (modell-SDK:er, PyAudio, OpenCV, verktygens
+             backends) laddas redan vid start. Med --serve startas även
+             uvicorn och tiden tills Socket.IO svarar mäts.
+
+KÖR:  python benchmarks/startup_budget.py [--budget-ms 1500] [--serve] [--json]
+==============================================================================
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Total importtid för server.py (millisekunder)
+DEFAULT_BUDGET_MS = 1500
+# Får inte importeras förrän de används
+LAZY_MODULES = [
+    "google.generativeai", "google.genai", "pyaudio", "cv2", "numpy",
+    "openai", "anthropic", "mem0", "paho", "googleapiclient", "garminconnect",
+    "app.services.llm_handler", "app.services.gemini_live", "app.tools.gesture_engine",
+    "app.tools.z2m_core", "app.tools.gcal_core", "app.tools.code_auditor",
+]
+
+
+def measure_imports():
+    """Kör `import server` med -X importtime. Returnerar {modul: kumulativ tid i ms}."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import server"],
+                          cwd=BACKEND_DIR, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise SystemExit(f"Kunde inte importera server.py:\n{proc.stderr[-2000:]}")
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line: continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative) / 1000
+    return modules
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_first_connection(timeout=60):
+    """Startar servern och mäter tiden tills Socket.IO-handskakningen svarar (sekunder)."""
+    import requests
+    port = _free_port()
+    code = f"import uvicorn, server; uvicorn.run(server.app_socketio, host='127.0.0.1', port={port}, log_level='warning')"
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-c", code], cwd=BACKEND_DIR)
+    try:
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise SystemExit("Servern avslutades innan den svarade.")
+            try:
+                resp = requests.get(f"http://127.0.0.1:{port}/socket.io/?EIO=4&transport=polling", timeout=1)
+                if resp.status_code == 200:
+                    return time.perf_counter() - start
+            except requests.RequestException:
+                pass
+            time.sleep(0.02)
+        raise SystemExit(f"Ingen Socket.IO-anslutning inom {timeout} s.")
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startbudget för server.py")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="Max importtid för server.py")
+    parser.add_argument("--serve", action="store_true", help="Mät även tiden till första Socket.IO-anslutning")
+    parser.add_argument("--top", type=int, default=10, help="Visa de N långsammaste direkta importerna")
+    parser.add_argument("--json", action="store_true", help="Skriv resultatet som JSON")
+    args = parser.parse_args()
+
+    modules = measure_imports()
+    total = modules.get("server", 0.0)
+    loaded = [m for m in LAZY_MODULES if m in modules]
+    result = {
+        "import_ms": round(total, 1),
+        "budget_ms": args.budget_ms,
+        "eager_heavy_modules": loaded,
+        "slowest": sorted(((n, round(t, 1)) for n, t in modules.items() if n != "server" and "." not in n),
+                          key=lambda x: -x[1])[:args.top],
+    }
+    if args.serve:
+        result["first_connection_s"] = round(measure_first_connection(), 3)
+    ok = total <= args.budget_ms and not loaded
+
+    if args.json:
+        print(json.dumps(dict(result, ok=ok), ensure_ascii=False))
+    else:
+        print(f"server.py importeras på {result['import_ms']} ms (budget {args.budget_ms} ms)")
+        for name, ms in result["slowest"]:
+            print(f"  {name:<28} {ms:>8} ms")
+        if "first_connection_s" in result:
+            print(f"Första Socket.IO-anslutningen efter {result['first_connection_s']} s")
+        if loaded:
+            print("Laddas vid start men borde laddas vid första användning: " + ", ".join(loaded))
+        print("OK" if ok else "ÖVER BUDGET")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
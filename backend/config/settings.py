@@ -1,18 +1,38 @@
 import os
+import time
 import sqlite3
+import threading
 
 # --- INFRASTRUKTUR ---
 # Endast absolut nödvändiga sökvägar för att applikationen ska kunna starta
 # och hitta sin databasfil. Dessa sparas inte i DB då de är beroende av filsystemet.
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DB_PATH = os.path.join(BASE_DIR, "logs", "daa_memory.db")
+# DAA_DB_PATH pekar om databasen (t.ex. benchmarks/e2e_bench.py med en tillfällig DB)
+DB_PATH = os.environ.get("DAA_DB_PATH") or os.path.join(BASE_DIR, "logs", "daa_memory.db")
 SERVICE_ACCOUNT_FILE = os.path.join(os.path.dirname(__file__), 'service_account.json')
+# Läggs till av get_config, sparas aldrig som inställningar
+SYSTEM_KEYS = ("DB_PATH", "SERVICE_ACCOUNT_FILE")
+
+# get_config anropas överallt. Inställningarna läses om från DB högst var
+# CONFIG_TTL sekund, och direkt efter save_db_setting (invalidate_config).
+CONFIG_TTL = 30
+_cache = {"config": None, "path": None, "at": 0.0}
+_cache_lock = threading.Lock()
+
+def invalidate_config():
+    _cache["config"] = None
 
 def get_config():
     """
-    Hämtar konfiguration enbart från databasen.
+    Hämtar konfiguration enbart från databasen (cachad, se CONFIG_TTL).
     Innehåller inga hårdkodade användarinställningar.
     """
+    with _cache_lock:
+        if _cache["config"] is None or _cache["path"] != DB_PATH or time.monotonic() - _cache["at"] > CONFIG_TTL:
+            _cache.update(config=_load_config(), path=DB_PATH, at=time.monotonic())
+        return dict(_cache["config"])
+
+def _load_config():
     # Skapa mappen logs om den inte finns (för första körningen)
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     
@@ -47,4 +67,14 @@ def get_config():
     except: 
         pass
 
-    return config
\ No newline at end of file
+    return config
+
+def gemini_options(config):
+    """
+    Argument till genai.configure. GEMINI_API_ENDPOINT (valfri) skickar
+    anropen till en annan server över REST, t.ex. benchmarks/fakes.py.
+    """
+    options = {"api_key": config.get("GOOGLE_API_KEY")}
+    if config.get("GEMINI_API_ENDPOINT"):
+        options.update(transport="rest", client_options={"api_endpoint": config["GEMINI_API_ENDPOINT"]})
+    return options
@@ -1,24 +1,36 @@
 import sys
 import os
 import asyncio
+import importlib
 import socketio
 import uvicorn
-import requests
-from fastapi import FastAPI, Response
+from fastapi import FastAPI, Response, Header
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from contextlib import asynccontextmanager
+from typing import Optional
 
 if sys.platform == 'win32':
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
 
-import google.generativeai as genai
-from app.services.gemini_live import AudioLoop
-from app.core.database import init_db, save_message, get_history, save_db_setting, get_db_prompts, save_db_prompt
-from app.services.llm_handler import stream_response
+# Modell-SDK:er, PyAudio, OpenCV och verktygen laddas först när de används
+# (se chat_pipeline, start_audio och vision_service) så att servern tar emot
+# anslutningar direkt. Mät med benchmarks/startup_budget.py.
+from app.core.database import (get_db_prompts, save_db_settings, save_db_prompts,
+                               get_settings_etag, get_prompts_etag, VersionConflict)
+from app.core.message_writer import get_message_writer
+from app.services.chat_pipeline import run_turn
+from app.services.job_queue import get_job_queue
+from app.services.history_archive import ArchiveScheduler
+from app.services.vision_service import get_vision_service
+from app.services.warmup import get_warmup
+from app.services.model_catalog import get_available_models, invalidate_models, CATALOG_SETTINGS
+from app.services.response_cache import get_semantic_cache
+from app.utils import metrics
+from app.utils.tracing import get_trace_writer
 from app.tools.tts_core import generate_elevenlabs_audio
-# IMPORTERA ENDAST FUNKTIONEN
-from app.core.prompts import get_system_prompt 
+from app.interface.api import router as api_router
 
 try:
     from config.settings import get_config
@@ -26,53 +38,78 @@ except:
     def get_config(): return {}
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-init_db()
 
 audio_loop = None
 loop_task = None
+# Bakgrundsjobb vars resultat inte hör hemma i chatthistoriken
+QUIET_JOBS = {"archive_history"}
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Databasen öppnas direkt, resten värms i bakgrunden (se /ready)
+    await get_warmup().start()
     conf = get_config()
-    if conf.get("GOOGLE_API_KEY"):
-        try: genai.configure(api_key=conf["GOOGLE_API_KEY"])
-        except: pass
+    jobs = get_job_queue()
+    jobs.add_listener(on_job_event)
+    await jobs.start()
+    archiver = ArchiveScheduler(jobs)
+    archiver.start()
+    if str(conf.get("VISION_ENABLED", "")).lower() in ("1", "true", "ja"):
+        try: await get_vision_service(on_gesture).start()
+        except Exception as e: print(f"[VISION] Kunde inte starta: {e}")
     yield 
+    await get_vision_service().stop()
+    await archiver.stop()
+    await jobs.stop()
+    # Historik som ännu ligger i write-behind-kön
+    await asyncio.to_thread(get_message_writer().close)
+    await asyncio.to_thread(get_trace_writer().close)
     global audio_loop, loop_task
     if audio_loop: audio_loop.stop()
     if loop_task: loop_task.cancel()
 
-def get_available_models_sync():
-    conf = get_config() 
-    models = []
-    if conf.get("GOOGLE_API_KEY"):
-        try:
-            genai.configure(api_key=conf["GOOGLE_API_KEY"])
-            for m in genai.list_models():
-                if 'generateContent' in m.supported_generation_methods:
-                    clean_id = m.name.replace("models/", "")
-                    models.append({'id': clean_id, 'name': f"Google: {getattr(m, 'display_name', clean_id)}"})
-        except: models.append({'id': 'gemini-2.0-flash-exp', 'name': 'Google: Gemini 2.0 Flash (Fallback)'})
-    if conf.get("OPENAI_API_KEY"): models.append({'id': 'gpt-4o', 'name': 'OpenAI: GPT-4o'})
-    ollama_url = conf.get("OLLAMA_URL", "http://127.0.0.1:11434")
-    try:
-        resp = requests.get(f"{ollama_url}/api/tags", timeout=1)
-        if resp.status_code == 200:
-            for m in resp.json().get('models', []):
-                models.append({'id': m.get('name'), 'name': f"Ollama: {m.get('name')}"})
-    except: pass
-    if not models: models.append({'id': 'error', 'name': '⚠️ No Models Found'})
-    return models
+def on_job_event(event, job):
+    """Bakgrundsjobb (t.ex. kodanalys) -> Socket.IO. Körs i event-loopen."""
+    if event == "progress":
+        asyncio.create_task(sio.emit('status', {'msg': job.get('message') or f"Jobb #{job['id']}: {round(job['progress'] * 100)} %"}))
+    elif event in ("done", "failed"):
+        text = job.get("result") if event == "done" else f"⚠️ Jobb #{job['id']} misslyckades: {job.get('error')}"
+        asyncio.create_task(sio.emit('job_done', {'id': job['id'], 'kind': job['kind'], 'status': event, 'text': text}))
+        # Resultatet hamnar i chatthistoriken så att modellen kan referera till det
+        if job['kind'] in QUIET_JOBS: return
+        get_message_writer().enqueue("hybrid", "assistant", text)
+
+async def on_gesture(event):
+    """Gest från kameran (och vad den styrde) -> Socket.IO."""
+    await sio.emit('gesture', event)
 
 sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
 app = FastAPI(lifespan=lifespan)
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+app.include_router(api_router)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"],
+                   expose_headers=["ETag"])
 app_socketio = socketio.ASGIApp(sio, app)
 
 class TTSRequest(BaseModel): text: str
 class SettingsRequest(BaseModel): settings: dict
 class PromptRequest(BaseModel): prompts: dict
 
+@app.get("/health")
+async def health():
+    """Processen lever. Uppvärmningens status och tider per komponent."""
+    return {"status": "ok", **get_warmup().report()}
+
+@app.get("/ready")
+async def ready():
+    """200 när backend kan ta emot frågor, annars 503 (Electron väntar på detta)."""
+    report = get_warmup().report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Latens och fel (TTFT, modeller, verktyg, DB, Gemini Live) i Prometheus-format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/api/tts")
 async def tts_endpoint(req: TTSRequest):
     loop = asyncio.get_event_loop()
@@ -82,40 +119,52 @@ async def tts_endpoint(req: TTSRequest):
     except: pass
     return Response(status_code=500)
 
+# GET skickar en ETag, POST med If-Match ger 412 om någon annan sparat emellan.
+# Utan If-Match sparas värdena ändå. Allt skrivs i en transaktion.
+async def _bulk_save(save, values, if_match):
+    try: result = await asyncio.to_thread(save, values, if_match)
+    except VersionConflict as e:
+        return JSONResponse({"status": "conflict", "etag": e.etag}, status_code=412, headers={"ETag": e.etag}), None
+    if result is None: return JSONResponse({"status": "error"}, status_code=500), None
+    etag, changed = result
+    return JSONResponse({"status": "ok", "etag": etag, "changed": changed}, headers={"ETag": etag}), changed
+
 @app.get("/api/settings")
 async def get_s():
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, get_config)
+    # Taggen först: sparar någon emellan blir det 412 hellre än ett tyst överskrivande
+    etag = await asyncio.to_thread(get_settings_etag)
+    conf = await asyncio.to_thread(get_config)
+    return JSONResponse(conf, headers={"ETag": etag})
 
 @app.post("/api/settings")
-async def up_s(d: SettingsRequest): 
-    loop = asyncio.get_event_loop()
-    for k, v in d.settings.items(): await loop.run_in_executor(None, save_db_setting, k, v)
-    return {"status": "ok"}
+async def up_s(d: SettingsRequest, if_match: Optional[str] = Header(None)):
+    response, changed = await _bulk_save(save_db_settings, d.settings, if_match)
+    if changed and any(k in CATALOG_SETTINGS for k in changed): invalidate_models()
+    return response
 
 @app.get("/api/prompts")
 async def get_prompts_endpoint():
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, get_db_prompts)
+    etag = await asyncio.to_thread(get_prompts_etag)
+    prompts = await asyncio.to_thread(get_db_prompts)
+    return JSONResponse(prompts, headers={"ETag": etag})
 
 @app.post("/api/prompts")
-async def save_prompts_endpoint(req: PromptRequest):
-    loop = asyncio.get_event_loop()
-    for k, v in req.prompts.items(): await loop.run_in_executor(None, save_db_prompt, k, v)
-    return {"status": "ok"}
+async def save_prompts_endpoint(req: PromptRequest, if_match: Optional[str] = Header(None)):
+    response, changed = await _bulk_save(save_db_prompts, req.prompts, if_match)
+    # Cachade svar bygger på de gamla prompterna
+    if changed: get_semantic_cache().clear()
+    return response
 
 @sio.event
 async def connect(sid, env):
-    await sio.emit('status', {'msg': 'DAA Connected'})
-    loop = asyncio.get_event_loop()
-    mods = await loop.run_in_executor(None, get_available_models_sync)
-    await sio.emit('models_list', {'models': mods})
+    await sio.emit('status', {'msg': 'DAA Connected'}, to=sid)
+    mods = await asyncio.to_thread(get_available_models)
+    await sio.emit('models_list', {'models': mods}, to=sid)
 
 @sio.event
 async def get_models(sid):
-    loop = asyncio.get_event_loop()
-    mods = await loop.run_in_executor(None, get_available_models_sync)
-    await sio.emit('models_list', {'models': mods})
+    mods = await asyncio.to_thread(get_available_models, True)
+    await sio.emit('models_list', {'models': mods}, to=sid)
 
 @sio.event
 async def start_audio(sid, data=None):
@@ -131,6 +180,8 @@ async def start_audio(sid, data=None):
     def on_turn_complete(): asyncio.create_task(sio.emit('ai_done', {}))
 
     try:
+        # gemini_live drar in google.genai och PyAudio, laddas vid första start
+        AudioLoop = (await asyncio.to_thread(importlib.import_module, "app.services.gemini_live")).AudioLoop
         audio_loop = AudioLoop(api_key=api_key, on_status=on_status, on_error=on_error, on_transcription=on_transcription, on_turn_complete=on_turn_complete)
         loop_task = asyncio.create_task(audio_loop.run())
         await sio.emit('status', {'msg': 'DAA Live Starting...'})
@@ -145,37 +196,22 @@ async def stop_audio(sid):
         await sio.emit('status', {'msg': 'DAA Live Stopped'})
 
 @sio.event
-async def user_message(sid, data):
-    text = data.get('text', '')
-    requested_model = data.get('model', 'gemini-2.0-flash-exp')
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, save_message, "hybrid", "user", text)
-    full_resp = ""
+async def start_vision(sid):
     try:
-        hist = await loop.run_in_executor(None, get_history, "hybrid", 10)
-        
-        # --- CLEAN: Inga hårdkodade instruktioner här ---
-        sys_prompt = get_system_prompt()
-
-        try:
-            async for chunk in stream_response(requested_model, hist, text, None, system_injection=sys_prompt):
-                full_resp += chunk
-                await sio.emit('ai_chunk', {'text': chunk})
-        except Exception as e:
-            fallback = "gemini-2.0-flash-exp"
-            if requested_model != fallback:
-                await sio.emit('ai_chunk', {'text': f"\n[System: Byter till {fallback}...]\n"})
-                async for chunk in stream_response(fallback, hist, text, None, system_injection=sys_prompt):
-                    full_resp += chunk
-                    await sio.emit('ai_chunk', {'text': chunk})
-            else: raise e
-
-    except Exception as e:
-        print(f"[LLM ERROR] {e}")
-        await sio.emit('ai_chunk', {'text': f"Fel: {e}"})
-
-    await loop.run_in_executor(None, save_message, "hybrid", "assistant", full_resp)
-    await sio.emit('ai_done', {})
+        await get_vision_service(on_gesture).start()
+        await sio.emit('status', {'msg': 'DAA Vision: Active'})
+    except Exception as e: await sio.emit('error', {'msg': str(e)})
+
+@sio.event
+async def stop_vision(sid):
+    await get_vision_service().stop()
+    await sio.emit('status', {'msg': 'DAA Vision Stopped'})
+
+@sio.event
+async def user_message(sid, data):
+    async for chunk in run_turn(data.get('text', ''), data.get('model'), use_cache=not data.get('no_cache'), source="socket"):
+        await sio.emit('ai_chunk', {'text': chunk}, to=sid)
+    await sio.emit('ai_done', {}, to=sid)
 
 if __name__ == "__main__":
     uvicorn.run(app_socketio, host="127.0.0.1", port=8000, reload=False, loop="asyncio")
\ No newline at end of file
@@ -2,6 +2,7 @@ const { app, BrowserWindow } = require('electron');
 const path = require('path');
 const { spawn } = require('child_process');
 const fs = require('fs');
+const http = require('http');
 
 let mainWindow;
 let backendProcess = null;
@@ -10,6 +11,9 @@ let backendProcess = null;
 const BACKEND_DIR = path.resolve(__dirname, '..', 'backend');
 const BACKEND_PATH = path.join(BACKEND_DIR, 'server.py');
 const FRONTEND_URL = 'http://localhost:5173'; 
+const BACKEND_READY_URL = 'http://127.0.0.1:8000/ready';
+const BACKEND_READY_TIMEOUT = 30000; // ms, därefter laddas frontend ändå
+const BACKEND_POLL_INTERVAL = 250;
 
 function getPythonPath() {
   // 1. Försök hitta Python i den virtuella miljön (venv)
@@ -55,6 +59,36 @@ function startBackend() {
   });
 }
 
+// Väntar tills backend svarar 200 på /ready (databasen öppen, uppvärmningen klar)
+function waitForBackend() {
+  const started = Date.now();
+  return new Promise((resolve) => {
+    const poll = () => {
+      const req = http.get(BACKEND_READY_URL, (res) => {
+        let body = '';
+        res.on('data', (chunk) => { body += chunk; });
+        res.on('end', () => {
+          if (res.statusCode === 200) {
+            console.log(`[Electron] Backend redo efter ${Date.now() - started} ms: ${body}`);
+            return resolve(true);
+          }
+          retry();
+        });
+      });
+      req.on('error', retry);
+      req.setTimeout(1000, () => req.destroy());
+    };
+    const retry = () => {
+      if (Date.now() - started > BACKEND_READY_TIMEOUT) {
+        console.log("[Electron] Backend svarade inte på /ready i tid, laddar frontend ändå.");
+        return resolve(false);
+      }
+      setTimeout(poll, BACKEND_POLL_INTERVAL);
+    };
+    poll();
+  });
+}
+
 function createWindow() {
   mainWindow = new BrowserWindow({
     width: 1200,
@@ -79,8 +113,9 @@ function createWindow() {
   });
 }
 
-app.on('ready', () => {
+app.on('ready', async () => {
   startBackend();
+  await waitForBackend();
   createWindow();
 });
 
@@ -27,6 +27,7 @@ function App() {
   const [selectedModel, setSelectedModel] = useState("loading");
   
   const currentResponseRef = useRef(""); 
+  const settingsEtagRef = useRef(null);
 
   const addLog = (text) => setLogs(prev => [...prev, text]);
 
@@ -74,6 +75,7 @@ function App() {
   const loadSettings = async () => {
     try {
         const res = await fetch('http://localhost:8000/api/settings');
+        settingsEtagRef.current = res.headers.get('ETag');
         setConfigData(await res.json());
     } catch (e) { addLog(`[ERR] Settings error: ${e.message}`); }
   };
@@ -81,11 +83,20 @@ function App() {
   const saveSettings = async (e) => {
     e.preventDefault();
     try {
-        await fetch('http://localhost:8000/api/settings', {
+        const headers = {'Content-Type': 'application/json'};
+        if (settingsEtagRef.current) headers['If-Match'] = settingsEtagRef.current;
+        const res = await fetch('http://localhost:8000/api/settings', {
             method: 'POST',
-            headers: {'Content-Type': 'application/json'},
+            headers,
             body: JSON.stringify({ settings: configData })
         });
+        if (res.status === 412) {
+            // Någon annan har sparat sedan dialogen öppnades, visa de nya värdena
+            addLog("[ERR] Settings changed elsewhere, reloaded.");
+            await loadSettings();
+            return;
+        }
+        settingsEtagRef.current = res.headers.get('ETag');
         addLog("[SYS] Settings saved.");
         setViewMode('chat');
     } catch (e) { addLog(`[ERR] Save failed: ${e.message}`); }
@@ -132,6 +143,15 @@ function App() {
         });
     });
 
+    socket.on('job_done', (job) => {
+        addLog(`[JOB] #${job.id} ${job.kind}: ${job.status}`);
+        setMessages(prev => [...prev, { role: 'ai', text: job.text, isStreaming: false }]);
+    });
+
+    socket.on('gesture', (g) => {
+        addLog(`[VISION] ${g.gesture}${g.entity_id ? ` -> ${g.entity_id} ${g.action}${g.ok ? '' : ' (fel)'}` : ''}`);
+    });
+
     return () => {
         socket.off('connect');
         socket.off('disconnect');
@@ -140,6 +160,8 @@ function App() {
         socket.off('models_list');
         socket.off('ai_chunk');
         socket.off('ai_done');
+        socket.off('job_done');
+        socket.off('gesture');
     };
   }, [selectedModel, isMuted]);
 
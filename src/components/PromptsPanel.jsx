@@ -1,25 +1,38 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useState, useRef } from 'react';
 
 const PromptsPanel = () => {
   const [prompts, setPrompts] = useState({});
   const [loading, setLoading] = useState(true);
+  const etagRef = useRef(null);
 
-  useEffect(() => {
+  const loadPrompts = () => {
     fetch('http://localhost:8000/api/prompts')
-      .then(res => res.json())
+      .then(res => { etagRef.current = res.headers.get('ETag'); return res.json(); })
       .then(data => {
         setPrompts(data);
         setLoading(false);
       })
       .catch(err => console.error("Failed to load prompts", err));
-  }, []);
+  };
+
+  useEffect(loadPrompts, []);
 
   const handleSave = () => {
+    const headers = {'Content-Type': 'application/json'};
+    if (etagRef.current) headers['If-Match'] = etagRef.current;
     fetch('http://localhost:8000/api/prompts', {
       method: 'POST',
-      headers: {'Content-Type': 'application/json'},
+      headers,
       body: JSON.stringify({ prompts })
-    }).then(() => alert("Prompter sparade! Starta om en ny konversation för att testa."));
+    }).then(res => {
+      if (res.status === 412) {
+        alert("Prompterna har ändrats någon annanstans. De nya värdena laddas, gör om ändringen.");
+        loadPrompts();
+        return;
+      }
+      etagRef.current = res.headers.get('ETag');
+      alert("Prompter sparade! Starta om en ny konversation för att testa.");
+    });
   };
 
   const handleChange = (key, value) => {